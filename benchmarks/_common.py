@@ -0,0 +1,68 @@
+# coding=utf-8
+"""
+Model setup shared by the benchmarks.
+
+Without `--model_path` the benchmarks run a `VibeVoiceForConditionalGenerationInference` built from
+a VibeVoice config with random weights. Its diffusion head, speech tokenizers and connectors keep
+their full size, so the speech-side timings are faithful, while the language model is cut down to
+`--num_hidden_layers` decoder layers (and a vocabulary holding just the special tokens of
+`RandomModelTokenizer`) unless a benchmark needs more. The zero-initialized modulation layers of
+the diffusion head are re-drawn so that the head is not constant. Random weights say nothing
+about audible quality.
+"""
+
+import json
+
+import torch
+
+from vibevoice.modular.configuration_vibevoice import VibeVoiceConfig
+from vibevoice.modular.modeling_vibevoice_inference import VibeVoiceForConditionalGenerationInference
+
+
+class RandomModelTokenizer:
+    """The special token ids `generate` reads from the tokenizer, for the vocabulary of a random model."""
+    speech_diffusion_id = 0
+    speech_start_id = 1
+    speech_end_id = 2
+    bos_token_id = 3
+    eos_token_id = 4
+    pad_token_id = 4
+    vocab_size = 8
+
+
+def add_model_arguments(parser, num_hidden_layers=1):
+    parser.add_argument("--config", type=str, default="vibevoice/configs/qwen2.5_1.5b_64k.json")
+    parser.add_argument("--model_path", type=str, default=None, help="Use this checkpoint instead of random weights")
+    parser.add_argument(
+        "--num_hidden_layers", type=int, default=num_hidden_layers,
+        help="Decoder layers of the random model's language model (0 keeps the config's)",
+    )
+
+
+def build_model(args) -> VibeVoiceForConditionalGenerationInference:
+    """The model of `--model_path` in float32, or a random one built from `--config` (see the module docstring)."""
+    if args.model_path is not None:
+        model = VibeVoiceForConditionalGenerationInference.from_pretrained(args.model_path, torch_dtype=torch.float32)
+        return model.eval()
+
+    with open(args.config) as f:
+        config_dict = json.load(f)
+    config_dict["torch_dtype"] = "float32"
+    config_dict["tie_word_embeddings"] = False
+    config_dict["decoder_config"]["vocab_size"] = RandomModelTokenizer.vocab_size
+    if args.num_hidden_layers:
+        config_dict["decoder_config"]["num_hidden_layers"] = args.num_hidden_layers
+        config_dict["decoder_config"]["max_window_layers"] = args.num_hidden_layers
+    config = VibeVoiceConfig(**config_dict)
+    config.decoder_config._attn_implementation = "sdpa"
+
+    torch.manual_seed(0)
+    model = VibeVoiceForConditionalGenerationInference(config).eval()
+    generator = torch.Generator().manual_seed(0)
+    with torch.no_grad():
+        for param in model.model.prediction_head.parameters():
+            param.copy_(torch.randn(param.shape, generator=generator) * 0.02)
+        # the checkpoints store the latent normalization, a fresh model has NaN placeholders
+        model.model.speech_scaling_factor.fill_(1.0)
+        model.model.speech_bias_factor.fill_(0.0)
+    return model
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Per-frame cost and deviation of the diffusion sampling modes of `sample_speech_tokens`:
+full classifier-free guidance, guidance restricted to part of the schedule
+(`guidance_interval`) and guidance off (`cfg_scale=1.0`).
+
+Every mode samples from the same initial noise and conditions; the deviation is the RMS
+difference of the sampled latents to the full-CFG latents, relative to their RMS. Without
+`--model_path` the model has random weights (see `_common.build_model`).
+
+With the random model, `cfg_scale=1.0` against `--cfg_scale` is then also timed end to end,
+through `generate` and through `VibeVoiceContinuousBatchingEngine`, so the skipped negative
+language model branch and the skipped unconditional diffusion batch both count. Its `lm_head`
+rows of the special tokens are zeroed so that greedy decoding emits a speech frame on every
+step; the per-frame time includes the prefill of a `--frames` token prompt and the streaming
+decode of the audio.
+
+    python benchmarks/cfg_modes.py --config vibevoice/configs/qwen2.5_1.5b_64k.json --cfg_scale 1.3
+"""
+
+import argparse
+import time
+
+import torch
+
+from _common import RandomModelTokenizer, add_model_arguments, build_model
+from vibevoice.modular.continuous_batching import VibeVoiceContinuousBatchingEngine, VibeVoiceGenerationRequest
+
+MODES = [
+    ("full CFG", None, None),
+    ("interval [0.0, 0.5)", None, (0.0, 0.5)),
+    ("interval [0.25, 0.75)", None, (0.25, 0.75)),
+    ("interval [0.5, 1.0)", None, (0.5, 1.0)),
+    ("CFG off", 1.0, None),
+]
+
+
+def sample(model, condition, neg_condition, cfg_scale, guidance_interval, seed):
+    torch.manual_seed(seed)
+    return model.sample_speech_tokens(condition, neg_condition, cfg_scale=cfg_scale, guidance_interval=guidance_interval)
+
+
+def num_frames(sequences):
+    """Speech frames of the longest sample (the prompt holds no speech diffusion tokens)."""
+    return int((sequences == RandomModelTokenizer.speech_diffusion_id).sum(dim=-1).max().item())
+
+
+def time_generate(model, input_ids, cfg_scale):
+    """Mean wall time per speech frame of a `generate` call."""
+    start = time.perf_counter()
+    outputs = model.generate(
+        input_ids=input_ids, attention_mask=torch.ones_like(input_ids), tokenizer=RandomModelTokenizer,
+        max_new_tokens=input_ids.shape[1], cfg_scale=cfg_scale, generation_config={"do_sample": False},
+    )
+    return (time.perf_counter() - start) / num_frames(outputs.sequences)
+
+
+def time_engine(model, input_ids, cfg_scale):
+    """Mean wall time per speech frame of `VibeVoiceContinuousBatchingEngine` serving one request per row."""
+    engine = VibeVoiceContinuousBatchingEngine(model, RandomModelTokenizer, max_batch_size=input_ids.shape[0])
+    for sample_ids in input_ids:
+        engine.add_request(VibeVoiceGenerationRequest(
+            input_ids=sample_ids, cfg_scale=cfg_scale, max_new_tokens=input_ids.shape[1],
+        ))
+    start = time.perf_counter()
+    outputs = engine.run()
+    elapsed = time.perf_counter() - start
+    return elapsed / max(num_frames(output.sequences) for output in outputs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    # the negative branch costs one language model forward per frame, so keep a few layers
+    add_model_arguments(parser, num_hidden_layers=4)
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--num_steps", type=int, default=20, help="Denoising steps per frame")
+    parser.add_argument("--cfg_scale", type=float, default=1.3)
+    parser.add_argument("--frames", type=int, default=50, help="Frames timed (and compared) per mode")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    model = build_model(args)
+    model.set_ddpm_inference_steps(args.num_steps)
+    hidden_size = model.prediction_head.config.hidden_size
+    generator = torch.Generator().manual_seed(1)
+    conditions = torch.randn(args.frames, args.batch_size, hidden_size, generator=generator)
+    neg_conditions = torch.randn(args.frames, args.batch_size, hidden_size, generator=generator)
+
+    reference = None
+    print(f"batch {args.batch_size}, {args.num_steps} steps, cfg_scale {args.cfg_scale}, {args.frames} frames")
+    print(f"{'mode':<24} {'ms/frame':>9} {'speedup':>8} {'rel. RMS diff':>14}")
+    for name, cfg_scale, guidance_interval in MODES:
+        cfg_scale = args.cfg_scale if cfg_scale is None else cfg_scale
+        sample(model, conditions[0], neg_conditions[0], cfg_scale, guidance_interval, 0)
+        latents = []
+        start = time.perf_counter()
+        for frame in range(args.frames):
+            latents.append(sample(model, conditions[frame], neg_conditions[frame], cfg_scale, guidance_interval, frame))
+        elapsed = (time.perf_counter() - start) / args.frames
+        latents = torch.stack(latents)
+        if reference is None:
+            reference, reference_time = latents, elapsed
+        deviation = ((latents - reference).pow(2).mean() / reference.pow(2).mean()).sqrt().item()
+        print(f"{name:<24} {elapsed * 1e3:>9.2f} {reference_time / elapsed:>7.2f}x {deviation:>14.4f}")
+
+    if args.model_path is not None:
+        return
+    with torch.no_grad():
+        # all logits tie and greedy decoding picks the lowest valid id, the speech diffusion token
+        model.lm_head.weight.zero_()
+    # plain tokens after the special ones; the prompt length bounds the generated length
+    input_ids = torch.randint(
+        RandomModelTokenizer.pad_token_id + 1, RandomModelTokenizer.vocab_size, (args.batch_size, args.frames),
+        generator=generator,
+    )
+    print(f"{'end to end':<24} {'cfg 1.0 ms':>10} {f'cfg {args.cfg_scale:g} ms':>10} {'speedup':>8}")
+    for name, run in (("generate", time_generate), ("continuous batching", time_engine)):
+        run(model, input_ids[:, :8], args.cfg_scale)  # warm-up
+        unguided, guided = run(model, input_ids, 1.0), run(model, input_ids, args.cfg_scale)
+        print(f"{name:<24} {unguided * 1e3:>10.2f} {guided * 1e3:>10.2f} {guided / unguided:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
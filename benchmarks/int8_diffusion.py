@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Per-frame cost and accuracy of the int8 dynamically quantized diffusion head
+(`model.quantize_speech_modules()`) against the unquantized head on the CPU.
+
+Reports the relative RMS error and the worst cosine similarity of the head's predictions
+(`diffusion_head_error`), then times full denoising loops with both heads from the same noise
+and conditions and reports the RMS deviation of the sampled latents relative to their RMS.
+Without `--model_path` the model has random weights (see `_common.build_model`), which gives
+pessimistic errors: trained weights have far fewer outliers.
+
+    python benchmarks/int8_diffusion.py --config vibevoice/configs/qwen2.5_1.5b_64k.json --batch_size 4
+"""
+
+import argparse
+import copy
+import time
+
+import torch
+
+from _common import add_model_arguments, build_model
+from vibevoice.modular.quantization import Int8DynamicLinear, diffusion_head_error
+
+
+def run(model, conditions, neg_conditions, cfg_scale):
+    """Latents of every frame and the mean wall time per frame."""
+    model.sample_speech_tokens(conditions[0], neg_conditions[0], cfg_scale)
+    latents = []
+    start = time.perf_counter()
+    for frame in range(len(conditions)):
+        torch.manual_seed(frame)
+        latents.append(model.sample_speech_tokens(conditions[frame], neg_conditions[frame], cfg_scale))
+    return torch.stack(latents), (time.perf_counter() - start) / len(conditions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_model_arguments(parser)
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--num_steps", type=int, default=20, help="Denoising steps per frame")
+    parser.add_argument("--cfg_scale", type=float, default=1.3)
+    parser.add_argument("--frames", type=int, default=20, help="Frames timed (and compared) per head")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    model = build_model(args)
+    model.set_ddpm_inference_steps(args.num_steps)
+    quantized = copy.deepcopy(model)
+    quantized.quantize_speech_modules(check_accuracy=False)
+    num_layers = sum(isinstance(module, Int8DynamicLinear) for module in quantized.modules())
+
+    timesteps = model.noise_scheduler.get_schedule(args.num_steps).timesteps
+    report = diffusion_head_error(model.prediction_head, quantized.prediction_head, timesteps)
+    print(f"{num_layers} linear layers quantized, {args.num_steps} steps, batch {args.batch_size}, cfg_scale {args.cfg_scale}")
+    print(f"predictions: relative RMS error {report['relative_rms_error']:.4f}, "
+          f"min cosine similarity {report['min_cosine_similarity']:.4f}")
+
+    hidden_size = model.prediction_head.config.hidden_size
+    generator = torch.Generator().manual_seed(1)
+    conditions = torch.randn(args.frames, args.batch_size, hidden_size, generator=generator)
+    neg_conditions = torch.randn(args.frames, args.batch_size, hidden_size, generator=generator)
+    reference, reference_time = run(model, conditions, neg_conditions, args.cfg_scale)
+    latents, elapsed = run(quantized, conditions, neg_conditions, args.cfg_scale)
+    deviation = ((latents - reference).pow(2).mean() / reference.pow(2).mean()).sqrt().item()
+    print(f"{'head':<8} {'ms/frame':>9} {'speedup':>8} {'rel. RMS diff':>14}")
+    print(f"{'fp32':<8} {reference_time * 1e3:>9.2f} {1.0:>7.2f}x {0.0:>14.4f}")
+    print(f"{'int8':<8} {elapsed * 1e3:>9.2f} {reference_time / elapsed:>7.2f}x {deviation:>14.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Per-step decode latency of the language model at minute 1 and minute 60 of a long-form
+session, with the full KV cache and with `generate(kv_window=...)`.
+
+The language model is built from the decoder config of a VibeVoice config with random
+weights, and the KV caches are filled with random states of the length the session would
+have reached (7.5 speech frames per second), so no checkpoint is needed. The decode steps
+run a bare `Qwen2Model`, not `generate()`: the reported eviction cost is that of
+`_evict_kv_columns` alone, and the rest of the window bookkeeping in `generate()` (mask and
+position updates, offsets) is not measured.
+
+    python benchmarks/long_form_kv_window.py --config vibevoice/configs/qwen2.5_1.5b_64k.json --num_hidden_layers 4
+"""
+
+import argparse
+import json
+import time
+
+import torch
+from transformers import Qwen2Config, Qwen2Model
+from transformers.cache_utils import DynamicCache
+
+from vibevoice.modular.modeling_vibevoice_inference import VibeVoiceForConditionalGenerationInference
+
+FRAMES_PER_MINUTE = 450  # 7.5 Hz speech tokenizer
+
+
+def random_cache(config, batch_size, length, dtype):
+    head_dim = config.hidden_size // config.num_attention_heads
+    cache = DynamicCache()
+    for _ in range(config.num_hidden_layers):
+        shape = (batch_size, config.num_key_value_heads, length, head_dim)
+        cache.key_cache.append(torch.randn(shape, dtype=dtype))
+        cache.value_cache.append(torch.randn(shape, dtype=dtype))
+    cache._seen_tokens = length
+    return cache
+
+
+@torch.no_grad()
+def time_decode_step(model, config, batch_size, cache_length, position, dtype, iters):
+    """Mean latency of one decode forward over a cache of `cache_length` tokens."""
+    cache = random_cache(config, batch_size, cache_length, dtype)
+    inputs_embeds = torch.randn(batch_size, 1, config.hidden_size, dtype=dtype)
+    attention_mask = torch.ones(batch_size, cache_length + 1, dtype=torch.long)
+    position_ids = torch.full((batch_size, 1), position, dtype=torch.long)
+    cache_position = torch.tensor([cache_length])
+
+    def step():
+        model(
+            inputs_embeds=inputs_embeds, attention_mask=attention_mask, position_ids=position_ids,
+            past_key_values=cache, use_cache=True, cache_position=cache_position,
+        )
+        # drop the appended column again so every iteration sees the same cache length
+        for states in (cache.key_cache, cache.value_cache):
+            for layer_idx, layer_states in enumerate(states):
+                states[layer_idx] = layer_states[:, :, :cache_length]
+
+    step()
+    start = time.perf_counter()
+    for _ in range(iters):
+        step()
+    return (time.perf_counter() - start) / iters, cache
+
+
+@torch.no_grad()
+def time_eviction(config, batch_size, prompt_length, window, dtype, iters):
+    """Amortized per-step cost of trimming a cache of `prompt + window + block` tokens back to `prompt + window`."""
+    block = max(window // 8, 1)
+    total = 0.0
+    for _ in range(iters):
+        cache = random_cache(config, batch_size, prompt_length + window + block, dtype)
+        mask = torch.ones(batch_size, prompt_length + window + block + 1, dtype=torch.long)
+        start = time.perf_counter()
+        VibeVoiceForConditionalGenerationInference._evict_kv_columns(
+            cache, mask, prompt_length, block, prompt_length + window + block,
+        )
+        total += time.perf_counter() - start
+    return total / iters / block
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", type=str, default="vibevoice/configs/qwen2.5_1.5b_64k.json")
+    parser.add_argument("--num_hidden_layers", type=int, default=None, help="Override the number of decoder layers")
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--prompt_length", type=int, default=2048, help="System + voice + script prompt tokens")
+    parser.add_argument("--kv_window", type=int, default=2048, help="Generated tokens kept by `kv_window`")
+    parser.add_argument("--minutes", type=int, nargs="+", default=[1, 60])
+    parser.add_argument("--iters", type=int, default=20)
+    parser.add_argument("--dtype", type=str, default="float32", choices=["float32", "bfloat16"])
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    dtype = getattr(torch, args.dtype)
+    with open(args.config) as f:
+        decoder_config = json.load(f)["decoder_config"]
+    if args.num_hidden_layers is not None:
+        decoder_config["num_hidden_layers"] = args.num_hidden_layers
+    config = Qwen2Config(**decoder_config)
+    config._attn_implementation = "sdpa"
+    model = Qwen2Model(config).to(dtype).eval()
+
+    print(f"{config.num_hidden_layers} layers, hidden {config.hidden_size}, batch {args.batch_size}, "
+          f"prompt {args.prompt_length} tokens, kv_window {args.kv_window}")
+    print(f"{'minute':>6} {'full KV':>10} {'ms/step':>9} {'window KV':>10} {'ms/step':>9}")
+    for minute in args.minutes:
+        generated = minute * FRAMES_PER_MINUTE
+        full_length = args.prompt_length + generated
+        window_length = args.prompt_length + min(generated, args.kv_window)
+        position = args.prompt_length + generated
+        full_time, _ = time_decode_step(model, config, args.batch_size, full_length, position, dtype, args.iters)
+        window_time, _ = time_decode_step(model, config, args.batch_size, window_length, position, dtype, args.iters)
+        print(f"{minute:>6} {full_length:>10} {full_time * 1e3:>9.2f} {window_length:>10} {window_time * 1e3:>9.2f}")
+
+    eviction = time_eviction(config, args.batch_size, args.prompt_length, args.kv_window, dtype, 5)
+    print(f"amortized eviction cost: {eviction * 1e3:.3f} ms/step")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Per-frame cost and parity of the ONNX Runtime backend (`VibeVoiceOnnxRuntime`) against the eager
+PyTorch modules on the CPU: the diffusion head over a full denoising loop, and one streaming step
+of the acoustic decoder followed by one of the semantic encoder.
+
+Exports the graphs to `--onnx_dir` first (see `export_onnx`) and reports the parity of every
+component (`onnx_runtime_error`: largest absolute difference relative to the largest eager value)
+before timing. Without `--model_path` the model has random weights (see `_common.build_model`).
+
+    python benchmarks/onnx_runtime.py --config vibevoice/configs/qwen2.5_1.5b_64k.json --batch_size 1
+"""
+
+import argparse
+import time
+
+import torch
+
+from _common import add_model_arguments, build_model
+from vibevoice.modular.modular_vibevoice_tokenizer import VibeVoiceTokenizerStreamingCache
+from vibevoice.modular.onnx_runtime import VibeVoiceOnnxRuntime, export_onnx, onnx_runtime_error
+
+
+@torch.no_grad()
+def time_diffusion(model, runtime, conditions, neg_conditions, cfg_scale):
+    """Mean wall time per frame of the denoising loop, with the head on `runtime` (None for eager)."""
+    model.set_onnx_runtime(runtime)
+    model.sample_speech_tokens(conditions[0], neg_conditions[0], cfg_scale)
+    start = time.perf_counter()
+    for frame in range(len(conditions)):
+        model.sample_speech_tokens(conditions[frame], neg_conditions[frame], cfg_scale)
+    elapsed = (time.perf_counter() - start) / len(conditions)
+    model.set_onnx_runtime(None)
+    return elapsed
+
+
+@torch.no_grad()
+def time_codecs(codecs, latents):
+    """Mean wall time per frame of one streaming decode and the semantic encode of its audio."""
+    batch_size = latents.shape[0]
+    sample_indices = torch.arange(batch_size)
+    acoustic_cache, semantic_cache = VibeVoiceTokenizerStreamingCache(batch_size), VibeVoiceTokenizerStreamingCache(batch_size)
+    start = time.perf_counter()
+    for frame in range(latents.shape[1]):
+        audio = codecs.acoustic_tokenizer.decode(
+            latents[:, frame: frame + 1], cache=acoustic_cache, sample_indices=sample_indices, use_cache=True,
+        )
+        codecs.semantic_tokenizer.encode(audio, cache=semantic_cache, sample_indices=sample_indices, use_cache=True)
+    return (time.perf_counter() - start) / latents.shape[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_model_arguments(parser)
+    parser.add_argument("--onnx_dir", type=str, default="vibevoice-onnx")
+    parser.add_argument("--skip_export", action="store_true", help="Reuse the graphs already in --onnx_dir")
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--num_steps", type=int, default=20, help="Denoising steps per frame")
+    parser.add_argument("--cfg_scale", type=float, default=1.3)
+    parser.add_argument("--frames", type=int, default=50, help="Frames timed per backend")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    model = build_model(args)
+    model.set_ddpm_inference_steps(args.num_steps)
+    modules = model.model
+    if not args.skip_export:
+        export_onnx(modules, args.onnx_dir)
+    runtime = VibeVoiceOnnxRuntime(modules, args.onnx_dir, intra_op_num_threads=args.threads)
+    for name, error in onnx_runtime_error(modules, runtime, batch_size=args.batch_size).items():
+        print(f"{name:<18} max relative difference {error:.2e}")
+
+    hidden_size = modules.prediction_head.config.hidden_size
+    generator = torch.Generator().manual_seed(1)
+    conditions = torch.randn(args.frames, args.batch_size, hidden_size, generator=generator)
+    neg_conditions = torch.randn(args.frames, args.batch_size, hidden_size, generator=generator)
+    latents = torch.randn(args.batch_size, args.frames, modules.acoustic_tokenizer.config.vae_dim, generator=generator)
+
+    print(f"batch {args.batch_size}, {args.num_steps} steps, cfg_scale {args.cfg_scale}, {args.frames} frames")
+    print(f"{'component':<18} {'eager ms':>9} {'onnx ms':>9} {'speedup':>8}")
+    eager = time_diffusion(model, None, conditions, neg_conditions, args.cfg_scale)
+    onnx = time_diffusion(model, runtime, conditions, neg_conditions, args.cfg_scale)
+    print(f"{'diffusion loop':<18} {eager * 1e3:>9.2f} {onnx * 1e3:>9.2f} {eager / onnx:>7.2f}x")
+    eager, onnx = time_codecs(modules, latents), time_codecs(runtime, latents)
+    print(f"{'decode + encode':<18} {eager * 1e3:>9.2f} {onnx * 1e3:>9.2f} {eager / onnx:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
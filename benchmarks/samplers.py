@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Quality and per-frame cost of the diffusion samplers of `vibevoice.schedule.samplers` at
+few denoising steps.
+
+Every sampler and step count samples from the same initial noise and conditions as a
+reference run of the model's `noise_scheduler` (DPM-Solver++ 2M) with `--reference_steps`
+steps; the reported error is the MSE of the sampled latents to the reference latents. Without
+`--model_path` the model has random weights (see `_common.build_model`), so the errors say
+little about how they translate to audible quality.
+`--early_exit_tolerance` runs every configuration with adaptive step counts and also
+reports the mean number of denoising steps per frame actually taken. `--compile` runs the
+denoising loops through a `VibeVoiceCompiledDenoiser`, compiled before timing.
+
+    python benchmarks/samplers.py --config vibevoice/configs/qwen2.5_1.5b_64k.json --steps 5,8,10,20
+"""
+
+import argparse
+import time
+
+import torch
+
+from _common import add_model_arguments, build_model
+from vibevoice.modular.compiled_diffusion import VibeVoiceCompiledDenoiser
+from vibevoice.schedule.samplers import available_samplers
+
+
+def run(model, conditions, neg_conditions, cfg_scale, sampler, num_steps, early_exit_tolerance=None):
+    """Latents of every frame, the mean wall time per frame and the mean denoising steps per frame."""
+    model.set_ddpm_inference_steps(num_steps)
+    kwargs = dict(cfg_scale=cfg_scale, sampler=sampler, early_exit_tolerance=early_exit_tolerance, return_num_steps=True)
+    # warm-up, also builds and caches the compiled schedule
+    model.sample_speech_tokens(conditions[0], neg_conditions[0], **kwargs)
+    latents, steps = [], []
+    start = time.perf_counter()
+    for frame in range(len(conditions)):
+        torch.manual_seed(frame)
+        latent, num_steps_taken = model.sample_speech_tokens(conditions[frame], neg_conditions[frame], **kwargs)
+        latents.append(latent)
+        steps.append(num_steps_taken)
+    elapsed = (time.perf_counter() - start) / len(conditions)
+    return torch.stack(latents), elapsed, torch.cat(steps).float().mean().item()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_model_arguments(parser)
+    parser.add_argument("--samplers", type=str, default=",".join(available_samplers()), help="Comma-separated names")
+    parser.add_argument("--steps", type=str, default="5,6,8,10,20", help="Comma-separated denoising step counts")
+    parser.add_argument("--reference_steps", type=int, default=50)
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--cfg_scale", type=float, default=1.3)
+    parser.add_argument("--early_exit_tolerance", type=float, default=None, help="Adaptive step count, see generate")
+    parser.add_argument("--compile", action="store_true", help="Use the torch.compile'd denoising loop")
+    parser.add_argument("--frames", type=int, default=20, help="Frames timed (and compared) per configuration")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    model = build_model(args)
+    if args.compile:
+        model.set_compiled_denoiser(VibeVoiceCompiledDenoiser(batch_buckets=(args.batch_size,)))
+    hidden_size = model.model.prediction_head.config.hidden_size
+    generator = torch.Generator().manual_seed(1)
+    conditions = torch.randn(args.frames, args.batch_size, hidden_size, generator=generator)
+    neg_conditions = torch.randn(args.frames, args.batch_size, hidden_size, generator=generator)
+
+    reference, reference_time, _ = run(model, conditions, neg_conditions, args.cfg_scale, None, args.reference_steps)
+    print(f"batch {args.batch_size}, cfg_scale {args.cfg_scale}, {args.frames} frames")
+    print(f"reference: dpmsolver++2m, {args.reference_steps} steps, {reference_time * 1e3:.2f} ms/frame")
+    print(f"{'sampler':<16} {'steps':>5} {'steps/frame':>11} {'ms/frame':>9} {'latent MSE':>11}")
+    for sampler in args.samplers.split(","):
+        for num_steps in (int(n) for n in args.steps.split(",")):
+            latents, elapsed, steps_per_frame = run(
+                model, conditions, neg_conditions, args.cfg_scale, sampler, num_steps, args.early_exit_tolerance,
+            )
+            mse = (latents - reference).pow(2).mean().item()
+            print(f"{sampler:<16} {num_steps:>5} {steps_per_frame:>11.2f} {elapsed * 1e3:>9.2f} {mse:>11.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# coding=utf-8
+"""
+Steps saved and deviation of warm starting `sample_speech_tokens` from the previous frame's
+latent (`generate(warm_start=...)`) on a sequence of consecutive frames.
+
+The frames are sampled in order, each warm one starting from the latent of the frame before.
+The deviation is the MSE of the latents to a cold start (every frame from noise) with
+`--reference_steps` steps on the same conditions and seeds. Consecutive speech frames are
+correlated through their conditions, which are drawn here as an AR(1) sequence with
+correlation `--correlation`. Without `--model_path` the model has random weights (see
+`_common.build_model`).
+
+    python benchmarks/warm_start.py --config vibevoice/configs/qwen2.5_1.5b_64k.json --warm_starts 1.0,0.5,0.3
+"""
+
+import argparse
+import time
+
+import torch
+
+from _common import add_model_arguments, build_model
+
+
+def run(model, conditions, neg_conditions, cfg_scale, num_steps, warm_start=None):
+    """Latents of every frame, the mean wall time per frame and the mean denoising steps per frame."""
+    model.set_ddpm_inference_steps(num_steps)
+    latents, steps = [], []
+    start = time.perf_counter()
+    for frame in range(len(conditions)):
+        torch.manual_seed(frame)
+        init_latent = latents[-1] if warm_start is not None and latents else None
+        latent, num_steps_taken = model.sample_speech_tokens(
+            conditions[frame], neg_conditions[frame], cfg_scale=cfg_scale, return_num_steps=True,
+            init_latent=init_latent, warm_start=warm_start if init_latent is not None else 1.0,
+        )
+        latents.append(latent)
+        steps.append(num_steps_taken)
+    elapsed = (time.perf_counter() - start) / len(conditions)
+    return torch.stack(latents), elapsed, torch.cat(steps).float().mean().item()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_model_arguments(parser)
+    parser.add_argument("--warm_starts", type=str, default="1.0,0.75,0.5,0.3", help="Comma-separated fractions")
+    parser.add_argument("--num_steps", type=int, default=20, help="Denoising steps of the full schedule")
+    parser.add_argument("--reference_steps", type=int, default=50)
+    parser.add_argument("--correlation", type=float, default=0.9, help="Of the conditions of consecutive frames")
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--cfg_scale", type=float, default=1.3)
+    parser.add_argument("--frames", type=int, default=50, help="Consecutive frames per configuration")
+    parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    model = build_model(args)
+    hidden_size = model.model.prediction_head.config.hidden_size
+    generator = torch.Generator().manual_seed(1)
+    innovations = torch.randn(2, args.frames, args.batch_size, hidden_size, generator=generator)
+    conditions = [innovations[:, 0]]
+    for frame in range(1, args.frames):
+        conditions.append(args.correlation * conditions[-1] + (1 - args.correlation**2) ** 0.5 * innovations[:, frame])
+    conditions, neg_conditions = torch.stack(conditions, dim=1)
+
+    reference, reference_time, _ = run(model, conditions, neg_conditions, args.cfg_scale, args.reference_steps)
+    cold, cold_time, _ = run(model, conditions, neg_conditions, args.cfg_scale, args.num_steps)
+    print(f"batch {args.batch_size}, cfg_scale {args.cfg_scale}, {args.frames} frames, correlation {args.correlation}")
+    print(f"reference: cold start, {args.reference_steps} steps, {reference_time * 1e3:.2f} ms/frame")
+    print(f"{'start':<16} {'steps/frame':>11} {'ms/frame':>9} {'latent MSE':>11}")
+    print(f"{'cold':<16} {args.num_steps:>11.2f} {cold_time * 1e3:>9.2f} {(cold - reference).pow(2).mean().item():>11.2e}")
+    for warm_start in (float(w) for w in args.warm_starts.split(",")):
+        latents, elapsed, steps_per_frame = run(
+            model, conditions, neg_conditions, args.cfg_scale, args.num_steps, warm_start,
+        )
+        mse = (latents - reference).pow(2).mean().item()
+        print(f"{f'warm {warm_start:g}':<16} {steps_per_frame:>11.2f} {elapsed * 1e3:>9.2f} {mse:>11.2e}")
+
+
+if __name__ == "__main__":
+    main()
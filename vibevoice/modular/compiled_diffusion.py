@@ -0,0 +1,169 @@
+from typing import Dict, Optional, Sequence, Tuple
+
+import torch
+from transformers.utils import logging
+
+from vibevoice.schedule.dpm_solver import DPMSolverCompiledSchedule, DPMSolverState
+
+logger = logging.get_logger(__name__)
+
+
+def denoise_loop(
+    prediction_head,
+    schedule: DPMSolverCompiledSchedule,
+    num_history: int,
+    guided_steps: Tuple[bool, ...],
+    speech: torch.Tensor,
+    timestep_embeddings: torch.Tensor,
+    projected_condition: torch.Tensor,
+    cfg_scale: Optional[torch.Tensor],
+) -> torch.Tensor:
+    """
+    The fixed-length denoising loop of `sample_speech_tokens` over a compiled schedule, as one function so it
+    can be traced whole: the head evaluations, the guidance combination and the tabulated solver updates.
+    """
+    state = DPMSolverState(schedule=schedule, model_outputs=[None] * num_history)
+    batch_size = speech.shape[0]
+    uncond_eps = None
+    for step_index, guided in enumerate(guided_steps):
+        if guided:
+            combined = torch.cat([speech, speech], dim=0)
+            eps = prediction_head.denoise(combined, timestep_embeddings[step_index], projected_condition)
+            cond_eps, uncond_eps = torch.split(eps, batch_size, dim=0)
+        else:
+            cond_eps = prediction_head.denoise(speech, timestep_embeddings[step_index], projected_condition[:batch_size])
+        eps = cond_eps if uncond_eps is None else uncond_eps + cfg_scale * (cond_eps - uncond_eps)
+        speech = schedule.step(state, eps, speech)
+    return speech
+
+
+class VibeVoiceCompiledDenoiser:
+    """
+    `torch.compile`d denoising loop for `sample_speech_tokens`.
+
+    The whole loop of a frame (every diffusion head evaluation, the classifier-free guidance
+    combination and the tabulated solver updates, see `DPMSolverCompiledSchedule`) is compiled
+    into one graph, so the adaLN modulation, SwiGLU and RMSNorm chains of the head layers are
+    fused across steps instead of launching a few dozen small kernels per step. Shapes are
+    static: every batch is padded to the smallest of `batch_buckets` that fits, and one graph is
+    compiled per bucket, schedule and guidance pattern. Batches above the largest bucket,
+    solvers with noise (SDE variants) or dynamic thresholding, and the adaptive early exit run
+    the eager loop, as does everything after a compilation failure.
+
+    Args:
+        batch_buckets (`Sequence[int]`, *optional*, defaults to `(1, 2, 4, 8, 16)`):
+            Padded batch sizes that get a compiled graph.
+        backend (`str`, *optional*, defaults to `"inductor"`):
+            `torch.compile` backend.
+        mode (`str`, *optional*):
+            `torch.compile` mode, e.g. `"max-autotune"`.
+
+    Example:
+
+    ```python
+    >>> model.set_compiled_denoiser(VibeVoiceCompiledDenoiser(batch_buckets=(1, 2, 4)))
+    >>> model.compiled_denoiser.warmup(model)  # compiles every bucket once, ahead of the first request
+    ```
+    """
+
+    def __init__(self, batch_buckets: Sequence[int] = (1, 2, 4, 8, 16), backend: str = "inductor", mode: Optional[str] = None):
+        self.batch_buckets = tuple(sorted(batch_buckets))
+        self.backend = backend
+        self.mode = mode
+        self.disabled = not hasattr(torch, "compile")
+        if self.disabled:
+            logger.warning("torch.compile is not available in this PyTorch version, the denoising loop runs eagerly")
+        self._compiled = None
+        # schedule of every compiled graph, kept alive so no other schedule can reuse its id
+        self._graphs: Dict[tuple, DPMSolverCompiledSchedule] = {}
+
+    def bucket(self, batch_size: int) -> Optional[int]:
+        """The padded batch size of `batch_size`, or None if it is above every bucket."""
+        for bucket in self.batch_buckets:
+            if bucket >= batch_size:
+                return bucket
+        return None
+
+    def _compiled_loop(self):
+        if self._compiled is None:
+            # one graph per bucket, schedule and guidance pattern, all of them guarded on the same code object
+            dynamo_config = torch._dynamo.config
+            dynamo_config.cache_size_limit = max(dynamo_config.cache_size_limit, 4 * len(self.batch_buckets))
+            self._compiled = torch.compile(denoise_loop, backend=self.backend, mode=self.mode, dynamic=False)
+        return self._compiled
+
+    def __call__(
+        self,
+        noise_scheduler,
+        schedule,
+        guided_steps: Sequence[bool],
+        speech: torch.Tensor,
+        timestep_embeddings: torch.Tensor,
+        projected_condition: torch.Tensor,
+        cfg_scale,
+        prediction_head,
+    ) -> Optional[torch.Tensor]:
+        """
+        The denoised `speech` after every step of `schedule`, or None when this loop cannot be compiled and the
+        caller should run it eagerly.
+        """
+        batch_size = speech.shape[0]
+        bucket = self.bucket(batch_size)
+        if (
+            self.disabled
+            or bucket is None
+            or not isinstance(schedule, DPMSolverCompiledSchedule)
+            or noise_scheduler.config.algorithm_type in ["sde-dpmsolver", "sde-dpmsolver++"]
+        ):
+            return None
+
+        guided = any(guided_steps)
+        padding = bucket - batch_size
+        if padding > 0:
+            speech = torch.cat([speech, speech.new_zeros(padding, speech.shape[1])])
+            halves = projected_condition.split(batch_size) if guided else (projected_condition[:batch_size],)
+            projected_condition = torch.cat(
+                [torch.cat([half, half.new_zeros(padding, half.shape[1])]) for half in halves]
+            )
+        if guided:
+            # a per-row tensor either way, so changing the scale does not recompile
+            cfg_scale = torch.as_tensor(cfg_scale, dtype=speech.dtype, device=speech.device).reshape(-1, 1)
+            cfg_scale = torch.cat([cfg_scale.expand(batch_size, 1), cfg_scale.new_ones(padding, 1)])
+        else:
+            cfg_scale = None
+
+        key = (id(schedule), tuple(guided_steps), bucket, speech.dtype, str(speech.device))
+        try:
+            output = self._compiled_loop()(
+                prediction_head, schedule, noise_scheduler.config.solver_order, tuple(guided_steps),
+                speech, timestep_embeddings, projected_condition, cfg_scale,
+            )
+        except Exception as e:
+            logger.warning(f"Compiling the denoising loop failed, falling back to eager execution: {e}")
+            self.disabled = True
+            return None
+        self._graphs[key] = schedule
+        return output[:batch_size]
+
+    @torch.no_grad()
+    def warmup(self, model, sampler: Optional[str] = None, guidance_interval: Optional[Tuple[float, float]] = None):
+        """
+        Compile the graphs of every bucket for `model`'s current number of inference steps, with and without
+        guidance, so no request pays for the compilation.
+        """
+        prediction_head = model.model.prediction_head
+        hidden_size = prediction_head.config.hidden_size
+        for bucket in self.batch_buckets:
+            condition = torch.randn(bucket, hidden_size, dtype=prediction_head.dtype, device=prediction_head.device)
+            for cfg_scale in (1.3, 1.0):
+                model.sample_speech_tokens(
+                    condition, torch.zeros_like(condition), cfg_scale=cfg_scale,
+                    guidance_interval=guidance_interval, sampler=sampler,
+                )
+        logger.info(f"Compiled {len(self._graphs)} denoising loop graphs")
+
+
+__all__ = [
+    "VibeVoiceCompiledDenoiser",
+    "denoise_loop",
+]
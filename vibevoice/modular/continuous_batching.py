@@ -0,0 +1,697 @@
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional, Tuple, Union
+import itertools
+
+import torch
+import torch.nn as nn
+
+from transformers.cache_utils import DynamicCache
+from transformers.utils import logging
+
+from .modular_vibevoice_tokenizer import VibeVoiceTokenizerStreamingCache
+from .prefix_cache import VibeVoicePrefixCache
+from .modeling_vibevoice_inference import (
+    VibeVoiceForConditionalGenerationInference,
+    VibeVoiceGenerationOutput,
+    VibeVoiceNegativeCache,
+)
+from .streamer import AudioStreamer, AsyncAudioStreamer
+
+logger = logging.get_logger(__name__)
+
+
+@dataclass
+class VibeVoiceGenerationRequest:
+    """
+    A single generation request for the continuous batching engine.
+
+    Args:
+        input_ids (`torch.LongTensor` of shape `(sequence_length,)`):
+            Prompt token ids of one sample, without padding.
+        speech_tensors (`torch.FloatTensor` of shape `(num_voices, num_samples)`, *optional*):
+            Voice prompt waveforms referenced by this sample.
+        speech_masks (`torch.BoolTensor` of shape `(num_voices, num_latents)`, *optional*):
+            Valid latent frames of each voice prompt.
+        speech_input_mask (`torch.BoolTensor` of shape `(sequence_length,)`, *optional*):
+            Positions in `input_ids` where the voice embeddings are inserted.
+        cfg_scale (`float`):
+            CFG scale used for this request's diffusion steps.
+        max_new_tokens (`int`, *optional*):
+            Maximum number of generated tokens. Defaults to the remaining context.
+        audio_streamer (`AudioStreamer`, *optional*):
+            Streamer created with `batch_size=1` receiving this request's audio chunks.
+        request_id (`str`, *optional*):
+            Identifier of the request. Assigned by the engine if not given.
+        speech_type (`str`, *optional*, defaults to `"audio"`):
+            `"audio"` for waveforms, `"pt"` for voice pack latents.
+        voice_prompt_length (`int`, *optional*):
+            Number of system + voice prompt tokens at the start of `input_ids`. Needed to reuse
+            the prefix KV states from the engine's `prefix_cache`.
+        sampler (`str`, *optional*):
+            Name of the diffusion sampler for this request's speech latents, see
+            `vibevoice.schedule.samplers`. Defaults to the model's `noise_scheduler`.
+        warm_start (`float`, *optional*):
+            Warm start every speech frame but the first of a segment from the previous frame's
+            latent and only run this fraction of the denoising steps, see `generate`.
+    """
+    input_ids: torch.LongTensor
+    speech_tensors: Optional[torch.FloatTensor] = None
+    speech_masks: Optional[torch.BoolTensor] = None
+    speech_input_mask: Optional[torch.BoolTensor] = None
+    cfg_scale: float = 1.3
+    max_new_tokens: Optional[int] = None
+    audio_streamer: Optional[Union[AudioStreamer, AsyncAudioStreamer]] = None
+    request_id: Optional[str] = None
+    speech_type: str = "audio"
+    voice_prompt_length: Optional[int] = None
+    sampler: Optional[str] = None
+    warm_start: Optional[float] = None
+
+    @classmethod
+    def from_batch(
+        cls,
+        input_ids: torch.LongTensor,
+        attention_mask: Optional[torch.LongTensor] = None,
+        speech_tensors: Optional[torch.FloatTensor] = None,
+        speech_masks: Optional[torch.BoolTensor] = None,
+        speech_input_mask: Optional[torch.BoolTensor] = None,
+        **kwargs,
+    ) -> List["VibeVoiceGenerationRequest"]:
+        """
+        Split a padded batch produced by `VibeVoiceProcessor` into one request per sample.
+
+        The processor stacks the voice prompts of all samples in order, one row per
+        contiguous run of `speech_input_mask`, so each sample takes as many rows as it
+        has runs. Unknown keyword arguments (e.g. `parsed_scripts`) are ignored, while
+        `cfg_scale`, `max_new_tokens`, `speech_type`, `sampler` and `warm_start` are forwarded to every request and
+        `voice_prompt_lengths` is split over them.
+        """
+        voice_prompt_lengths = kwargs.get("voice_prompt_lengths")
+        request_kwargs = {k: kwargs[k] for k in ("cfg_scale", "max_new_tokens", "speech_type", "sampler", "warm_start") if k in kwargs}
+        if attention_mask is None:
+            attention_mask = torch.ones_like(input_ids)
+
+        requests = []
+        speech_row = 0
+        for b in range(input_ids.shape[0]):
+            valid = attention_mask[b].bool()
+            sample_ids = input_ids[b][valid]
+            sample_speech_mask = speech_input_mask[b][valid] if speech_input_mask is not None else None
+
+            sample_tensors, sample_masks = None, None
+            if speech_tensors is not None and sample_speech_mask is not None and sample_speech_mask.any():
+                flags = sample_speech_mask.long()
+                num_voices = int((flags[1:] > flags[:-1]).sum().item() + flags[0].item())
+                sample_tensors = speech_tensors[speech_row: speech_row + num_voices]
+                sample_masks = speech_masks[speech_row: speech_row + num_voices]
+                speech_row += num_voices
+
+            requests.append(cls(
+                input_ids=sample_ids,
+                speech_tensors=sample_tensors,
+                speech_masks=sample_masks,
+                speech_input_mask=sample_speech_mask if sample_tensors is not None else None,
+                voice_prompt_length=voice_prompt_lengths[b] if voice_prompt_lengths is not None else None,
+                **request_kwargs,
+            ))
+        return requests
+
+
+@dataclass
+class _ActiveRequest:
+    """Bookkeeping of a request occupying a batch row."""
+    request: VibeVoiceGenerationRequest
+    slot: int
+    max_steps: int
+    step: int = 0
+    tokens: List[int] = field(default_factory=list)
+    audio_chunks: List[torch.Tensor] = field(default_factory=list)
+    finished: bool = False
+    reach_max_step: bool = False
+    diffusion_steps: int = 0
+    diffusion_frames: int = 0
+    # latent of the last speech frame of the current segment, for `warm_start`
+    previous_latent: Optional[torch.Tensor] = None
+
+
+@dataclass(eq=False)
+class _PrefillState:
+    """Bookkeeping of a request whose prompt is being prefilled, possibly over several engine steps."""
+    request: VibeVoiceGenerationRequest
+    slot: int
+    max_steps: int
+    input_ids: torch.LongTensor
+    cache: DynamicCache
+    offset: int = 0
+    speech_embeds: Optional[torch.FloatTensor] = None
+    speech_input_mask: Optional[torch.BoolTensor] = None
+
+
+def _pad_cache_left(cache: DynamicCache, length: int):
+    """Left-pad every layer of `cache` with `length` empty positions."""
+    if length <= 0:
+        return
+    for layer_idx in range(len(cache.key_cache)):
+        for states in (cache.key_cache, cache.value_cache):
+            t = states[layer_idx]
+            states[layer_idx] = torch.cat([t.new_zeros(t.shape[0], t.shape[1], length, t.shape[3]), t], dim=2)
+    cache._seen_tokens = cache.get_seq_length()
+
+
+def _merge_rows(
+    cache: Optional[DynamicCache],
+    attention_mask: Optional[torch.LongTensor],
+    new_cache: DynamicCache,
+    new_attention_mask: torch.LongTensor,
+) -> Tuple[DynamicCache, torch.LongTensor]:
+    """Append the rows of `new_cache` to `cache`, left-padding whichever is shorter."""
+    if cache is None:
+        return new_cache, new_attention_mask
+
+    length, new_length = attention_mask.shape[1], new_attention_mask.shape[1]
+    shift = max(new_length - length, 0)
+    _pad_cache_left(cache, shift)
+    _pad_cache_left(new_cache, length - new_length)
+    attention_mask = nn.functional.pad(attention_mask, (shift, 0))
+    new_attention_mask = nn.functional.pad(new_attention_mask, (max(length - new_length, 0), 0))
+
+    for layer_idx in range(len(cache.key_cache)):
+        cache.key_cache[layer_idx] = torch.cat([cache.key_cache[layer_idx], new_cache.key_cache[layer_idx]], dim=0)
+        cache.value_cache[layer_idx] = torch.cat([cache.value_cache[layer_idx], new_cache.value_cache[layer_idx]], dim=0)
+    return cache, torch.cat([attention_mask, new_attention_mask], dim=0)
+
+
+def _select_rows(
+    cache: DynamicCache,
+    attention_mask: torch.LongTensor,
+    rows: torch.LongTensor,
+) -> Tuple[DynamicCache, torch.LongTensor]:
+    """Keep only `rows` of the cache and drop leading columns no remaining row attends to."""
+    attention_mask = attention_mask.index_select(0, rows)
+    attended = attention_mask.any(dim=0).nonzero()
+    start = int(attended[0].item()) if attended.numel() > 0 else attention_mask.shape[1]
+    attention_mask = attention_mask[:, start:]
+    for layer_idx in range(len(cache.key_cache)):
+        cache.key_cache[layer_idx] = cache.key_cache[layer_idx].index_select(0, rows)[:, :, start:]
+        cache.value_cache[layer_idx] = cache.value_cache[layer_idx].index_select(0, rows)[:, :, start:]
+    cache._seen_tokens = cache.get_seq_length()
+    return cache, attention_mask
+
+
+class VibeVoiceContinuousBatchingEngine:
+    """
+    Continuous batching driver for `VibeVoiceForConditionalGenerationInference`.
+
+    Unlike `generate`, which runs a fixed batch until its longest sample finishes, the
+    engine frees a batch row as soon as its request emits EOS (or reaches its step
+    limit) and admits the next queued request into it on the following step. Every row
+    keeps its own KV cache row, negative (CFG) cache row, attention mask and position
+    counter, and its own slot in the acoustic/semantic streaming caches, so requests of
+    very different lengths can share the batch without padding each other out.
+
+    Args:
+        model (`VibeVoiceForConditionalGenerationInference`):
+            The model used for generation.
+        tokenizer (`VibeVoiceTextTokenizer` or `VibeVoiceTextTokenizerFast`):
+            Text tokenizer providing the special speech token ids.
+        max_batch_size (`int`, *optional*, defaults to 4):
+            Maximum number of requests decoded together.
+        do_sample (`bool`, *optional*, defaults to `False`):
+            Whether to sample the next token instead of taking the argmax.
+        max_length_times (`float`, *optional*, defaults to 2):
+            Maximum number of generated tokens relative to the prompt length.
+        return_speech (`bool`, *optional*, defaults to `True`):
+            Whether to keep the generated audio in the outputs.
+        verbose (`bool`, *optional*, defaults to `False`):
+            Whether to print admission and completion messages.
+        prefix_cache (`VibeVoicePrefixCache`, *optional*):
+            Cache of system + voice prompt KV states. Requests with a `voice_prompt_length` only
+            prefill the rest of their prompt when their prefix is cached.
+        prefill_chunk_size (`int`, *optional*):
+            Prefill admitted prompts in chunks of this many tokens, one chunk per request and
+            step, so that long prompts are interleaved with the decode steps of the running
+            requests instead of stalling them. By default a prompt is prefilled in one step.
+        guidance_interval (`Tuple[float, float]`, *optional*):
+            Fractions of the denoising schedule on which CFG runs the unconditional diffusion
+            batch, see `generate`. Requests with `cfg_scale=1.0` are never guided.
+        early_exit_tolerance (`float`, *optional*):
+            Stop denoising a speech frame once its predicted latent has converged to this relative
+            tolerance, see `generate`. The outputs report the mean `diffusion_steps_per_frame`.
+
+    Example:
+
+    ```python
+    >>> engine = VibeVoiceContinuousBatchingEngine(model, processor.tokenizer, max_batch_size=4)
+    >>> for request in VibeVoiceGenerationRequest.from_batch(**inputs, cfg_scale=1.3):
+    ...     engine.add_request(request)
+    >>> outputs = engine.run()
+    ```
+    """
+
+    def __init__(
+        self,
+        model: VibeVoiceForConditionalGenerationInference,
+        tokenizer,
+        max_batch_size: int = 4,
+        do_sample: bool = False,
+        max_length_times: float = 2,
+        return_speech: bool = True,
+        verbose: bool = False,
+        prefix_cache: Optional[VibeVoicePrefixCache] = None,
+        prefill_chunk_size: Optional[int] = None,
+        guidance_interval: Optional[Tuple[float, float]] = None,
+        early_exit_tolerance: Optional[float] = None,
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.do_sample = do_sample
+        self.max_length_times = max_length_times
+        self.return_speech = return_speech
+        self.verbose = verbose
+        self.prefix_cache = prefix_cache
+        self.prefill_chunk_size = prefill_chunk_size
+        self.guidance_interval = guidance_interval
+        self.early_exit_tolerance = early_exit_tolerance
+
+        self.device = model.device
+        self.speech_start_id = tokenizer.speech_start_id
+        self.speech_end_id = tokenizer.speech_end_id
+        self.speech_diffusion_id = tokenizer.speech_diffusion_id
+        self.eos_token_id = tokenizer.eos_token_id
+
+        valid_tokens = [self.speech_start_id, self.speech_end_id, self.speech_diffusion_id, self.eos_token_id]
+        if getattr(tokenizer, "bos_token_id", None) is not None:
+            valid_tokens.append(tokenizer.bos_token_id)
+        # Only these rows of lm_head are ever projected, see `generate(restrict_vocab=True)`
+        self.valid_token_ids = torch.tensor(sorted(set(valid_tokens)), dtype=torch.long, device=self.device)
+
+        self.acoustic_cache = VibeVoiceTokenizerStreamingCache(max_batch_size)
+        self.semantic_cache = VibeVoiceTokenizerStreamingCache(max_batch_size)
+
+        self._queue: Deque[VibeVoiceGenerationRequest] = deque()
+        self._request_counter = itertools.count()
+        self._free_slots = list(range(max_batch_size))
+        self._rows: List[_ActiveRequest] = []
+        self._prefilling: List[_PrefillState] = []
+        self._outputs: Dict[str, VibeVoiceGenerationOutput] = {}
+
+        # Batched decoding state, one row per entry of `self._rows`
+        self._cache: Optional[DynamicCache] = None
+        self._attention_mask: Optional[torch.LongTensor] = None
+        self._positions: Optional[torch.LongTensor] = None
+        self._neg_cache = VibeVoiceNegativeCache()
+        self._inputs_embeds: Optional[torch.FloatTensor] = None
+
+    @property
+    def num_active_requests(self) -> int:
+        return len(self._rows)
+
+    @property
+    def num_pending_requests(self) -> int:
+        return len(self._queue)
+
+    @property
+    def num_prefilling_requests(self) -> int:
+        return len(self._prefilling)
+
+    def has_unfinished_requests(self) -> bool:
+        return len(self._rows) > 0 or len(self._prefilling) > 0 or len(self._queue) > 0
+
+    def add_request(self, request: VibeVoiceGenerationRequest) -> str:
+        """Queue a request; it is admitted as soon as a batch row is free. Returns its id."""
+        if request.request_id is None:
+            request.request_id = str(next(self._request_counter))
+        self._queue.append(request)
+        return request.request_id
+
+    def get_output(self, request_id: str) -> Optional[VibeVoiceGenerationOutput]:
+        """Return and forget the output of a finished request, or `None` if it is still running."""
+        return self._outputs.pop(request_id, None)
+
+    @torch.no_grad()
+    def run(self) -> List[VibeVoiceGenerationOutput]:
+        """Step until every queued request is finished and return the outputs in submission order."""
+        order = (
+            [request.request_id for request in self._queue]
+            + [state.request.request_id for state in self._prefilling]
+            + [row.request.request_id for row in self._rows]
+        )
+        while self.has_unfinished_requests():
+            self.step()
+        return [self._outputs.pop(request_id) for request_id in order]
+
+    @torch.no_grad()
+    def step(self) -> List[str]:
+        """
+        Run one decoding step over the running requests, admitting queued requests into
+        free rows. Returns the ids of the requests that finished during this step.
+        """
+        num_running = len(self._rows)
+        hidden_states, neg_hidden_states = [], []
+        next_tokens = []
+
+        # 1. Decode one token for the requests that are already running
+        if num_running > 0:
+            outputs = self._forward_positive(self._inputs_embeds)
+            hidden_states.append(outputs.last_hidden_state[:, -1, :])
+            next_tokens.append(self._select_tokens(outputs.logits[:, -1, :]))
+
+            # Only the diffusing rows of requests with guidance extend their negative sequence
+            neg_hidden = hidden_states[0].new_zeros(hidden_states[0].shape)
+            diffusion_rows = [
+                i for i, token in enumerate(next_tokens[0].tolist())
+                if token == self.speech_diffusion_id and self._rows[i].request.cfg_scale != 1.0
+            ]
+            if diffusion_rows:
+                neg_hidden[diffusion_rows] = self.model._forward_negative(
+                    self._neg_cache, diffusion_rows, inputs_embeds=self._inputs_embeds[diffusion_rows],
+                )
+            neg_hidden_states.append(neg_hidden)
+
+        # 2. Prefill queued requests into free rows, one chunk per request and step
+        while self._queue and self._free_slots:
+            self._prefilling.append(self._start_prefill(self._queue.popleft()))
+        for state in list(self._prefilling):
+            outputs = self._advance_prefill(state)
+            if outputs is None:
+                continue
+            self._prefilling.remove(state)
+            hidden, neg_hidden, logits = self._admit(state, outputs)
+            hidden_states.append(hidden)
+            neg_hidden_states.append(neg_hidden if neg_hidden is not None else hidden.new_zeros(hidden.shape))
+            next_tokens.append(self._select_tokens(logits))
+
+        if len(self._rows) == 0:
+            return []
+
+        hidden_states = torch.cat(hidden_states, dim=0)
+        neg_hidden_states = torch.cat(neg_hidden_states, dim=0)
+        next_tokens = torch.cat(next_tokens, dim=0)
+        token_list = next_tokens.tolist()
+
+        # 3. Book-keeping of the sampled tokens
+        finished_ids = []
+        for row, token in zip(self._rows, token_list):
+            row.tokens.append(token)
+            if token == self.eos_token_id:
+                row.finished = True
+
+        speech_end_rows = [i for i, token in enumerate(token_list) if token == self.speech_end_id]
+        if speech_end_rows:
+            slots = torch.tensor([self._rows[i].slot for i in speech_end_rows], dtype=torch.long)
+            self.acoustic_cache.set_to_zero(slots)
+            self.semantic_cache.set_to_zero(slots)
+            for i in speech_end_rows:
+                self._rows[i].previous_latent = None
+
+        speech_start_rows = [i for i, token in enumerate(token_list) if token == self.speech_start_id]
+        if speech_start_rows:
+            self._neg_cache.reset_rows(speech_start_rows)
+        # Requests admitted this step keep their speech_start entry only if they diffuse right away
+        idle_rows = [
+            i for i in range(num_running, len(self._rows)) if token_list[i] != self.speech_diffusion_id
+        ]
+        if idle_rows:
+            self._neg_cache.discard_rows(idle_rows)
+
+        # 4. Diffusion for the rows that emitted a speech diffusion token
+        next_inputs_embeds = self.model.model.get_input_embeddings()(next_tokens).unsqueeze(1)
+        diffusion_rows = [i for i, token in enumerate(token_list) if token == self.speech_diffusion_id]
+        if diffusion_rows:
+            diffusion_indices = torch.tensor(diffusion_rows, dtype=torch.long, device=self.device)
+            next_inputs_embeds[diffusion_indices] = self._diffuse(
+                diffusion_rows, hidden_states[diffusion_indices], neg_hidden_states[diffusion_indices],
+            )
+        self._inputs_embeds = next_inputs_embeds
+
+        # 5. Retire finished requests and free their rows
+        for row in self._rows:
+            row.step += 1
+            if not row.finished and row.step >= row.max_steps:
+                row.finished = True
+                row.reach_max_step = True
+                if self.verbose:
+                    print(f"Request {row.request.request_id} reached max generation length at step {row.step}.", flush=True)
+            if row.finished:
+                finished_ids.append(row.request.request_id)
+                self._finish(row)
+
+        if finished_ids:
+            keep = [i for i, row in enumerate(self._rows) if not row.finished]
+            self._remove_rows(keep)
+        return finished_ids
+
+    def _select_tokens(self, logits: torch.FloatTensor) -> torch.LongTensor:
+        scores = logits.to(dtype=torch.float32)
+        if self.do_sample:
+            probs = nn.functional.softmax(scores, dim=-1)
+            return self.valid_token_ids[torch.multinomial(probs, num_samples=1).squeeze(1)]
+        return self.valid_token_ids[torch.argmax(scores, dim=-1)]
+
+    def _forward_positive(self, inputs_embeds: torch.FloatTensor):
+        length = self._attention_mask.shape[1]
+        self._attention_mask = nn.functional.pad(self._attention_mask, (0, 1), value=1)
+        outputs = self.model(
+            inputs_embeds=inputs_embeds,
+            attention_mask=self._attention_mask,
+            position_ids=self._positions[:, None],
+            past_key_values=self._cache,
+            use_cache=True,
+            cache_position=torch.arange(length, length + 1, device=self.device),
+            logits_to_keep=1,
+            lm_head_indices=self.valid_token_ids,
+            return_dict=True,
+        )
+        self._positions = self._positions + 1
+        return outputs
+
+    def _start_prefill(self, request: VibeVoiceGenerationRequest) -> _PrefillState:
+        """Reserve a slot for `request` and set up its prefill; the prompt itself is run by `_advance_prefill`."""
+        slot = self._free_slots.pop(0)
+        input_ids = request.input_ids.to(self.device).view(1, -1)
+        prompt_length = input_ids.shape[1]
+        max_new_tokens = request.max_new_tokens
+        if max_new_tokens is None:
+            max_new_tokens = self.model.config.decoder_config.max_position_embeddings - prompt_length
+        max_steps = min(max_new_tokens, int(self.max_length_times * prompt_length))
+
+        # Fresh streaming state for the acoustic decoder and the semantic encoder
+        slot_index = torch.tensor([slot], dtype=torch.long)
+        self.acoustic_cache.set_to_zero(slot_index)
+        self.semantic_cache.set_to_zero(slot_index)
+
+        state = _PrefillState(
+            request=request, slot=slot, max_steps=max_steps, input_ids=input_ids, cache=DynamicCache(),
+        )
+        speech_tensors = speech_masks = speech_input_mask = None
+        if request.speech_tensors is not None:
+            speech_tensors = request.speech_tensors.to(self.device)
+            speech_masks = request.speech_masks.to(self.device)
+            speech_input_mask = request.speech_input_mask.to(self.device).view(1, -1)
+
+        if self.prefix_cache is not None and request.voice_prompt_length is not None:
+            # Start from the cached system + voice prompt states and only prefill the rest;
+            # every voice embedding lives in the prefix, so the rest is plain text.
+            prefix_length = request.voice_prompt_length
+            if not 0 < prefix_length < input_ids.shape[1]:
+                raise ValueError(
+                    f"Voice prompt length {prefix_length} does not fit the prompt of {input_ids.shape[1]} tokens."
+                )
+            if speech_input_mask is not None and speech_input_mask[0, prefix_length:].any():
+                raise ValueError("Voice embeddings must be inside the voice prompt prefix to use the prefix cache.")
+            entry = self.model._get_prefix_states(
+                self.prefix_cache, input_ids[0, :prefix_length],
+                speech_tensors=speech_tensors, speech_masks=speech_masks,
+                speech_input_mask=speech_input_mask[0, :prefix_length] if speech_input_mask is not None else None,
+                speech_type=request.speech_type, prefill_chunk_size=self.prefill_chunk_size,
+            )
+            state.cache.key_cache = list(entry.key_cache)
+            state.cache.value_cache = list(entry.value_cache)
+            state.cache._seen_tokens = prefix_length
+            state.offset = prefix_length
+        elif speech_tensors is not None:
+            state.speech_embeds = self.model._process_speech_inputs(
+                speech_tensors.to(self.model.dtype), speech_masks, speech_type=request.speech_type,
+            )[1]
+            state.speech_input_mask = speech_input_mask
+        return state
+
+    def _advance_prefill(self, state: _PrefillState):
+        """Prefill the next chunk of `state`'s prompt. Returns the model outputs once the whole prompt is in the cache."""
+        prompt_length = state.input_ids.shape[1]
+        end = prompt_length
+        if self.prefill_chunk_size is not None:
+            end = min(state.offset + self.prefill_chunk_size, prompt_length)
+        outputs = self.model._forward_prefill_chunk(
+            state.input_ids,
+            torch.ones_like(state.input_ids),
+            torch.arange(prompt_length, device=self.device)[None],
+            state.cache,
+            state.offset,
+            end,
+            speech_embeds=state.speech_embeds,
+            speech_input_mask=state.speech_input_mask,
+            compute_logits=end == prompt_length,
+            lm_head_indices=self.valid_token_ids,
+        )
+        state.offset = end
+        return outputs if end == prompt_length else None
+
+    def _admit(self, state: _PrefillState, outputs):
+        """
+        Merge the caches of a fully prefilled request into the running batch. Returns its last hidden state,
+        its negative (CFG) hidden state (`None` without guidance) and its logits.
+        """
+        request = state.request
+        prompt_length = state.input_ids.shape[1]
+
+        # The negative branch starts from a lone speech_start token. Without guidance it is never
+        # run; the request still gets an (empty) row so the negative rows stay aligned with `_rows`.
+        neg_cache = VibeVoiceNegativeCache(1)
+        neg_hidden = None
+        if request.cfg_scale != 1.0:
+            neg_hidden = self.model._forward_negative(
+                neg_cache, [0], input_ids=torch.full((1, 1), self.speech_start_id, dtype=torch.long, device=self.device),
+            )
+
+        attention_mask = torch.ones_like(state.input_ids)
+        self._cache, self._attention_mask = _merge_rows(self._cache, self._attention_mask, state.cache, attention_mask)
+        self._neg_cache.append(neg_cache)
+        new_position = torch.tensor([prompt_length], dtype=torch.long, device=self.device)
+        if self._positions is None or len(self._rows) == 0:
+            self._positions = new_position
+        else:
+            self._positions = torch.cat([self._positions, new_position])
+
+        self._rows.append(_ActiveRequest(request=request, slot=state.slot, max_steps=state.max_steps))
+        if self.verbose:
+            print(f"Admitted request {request.request_id} into slot {state.slot} ({prompt_length} prompt tokens).", flush=True)
+        return outputs.last_hidden_state[:, -1, :], neg_hidden, outputs.logits[:, -1, :]
+
+    def _sample_latents(
+        self,
+        rows: List[int],
+        condition: torch.FloatTensor,
+        neg_condition: Optional[torch.FloatTensor],
+        sampler: Optional[str],
+        warm_start: Optional[float] = None,
+    ) -> Tuple[torch.FloatTensor, torch.LongTensor]:
+        """
+        Speech latents of `rows`, which share `sampler` and `warm_start` (None for rows starting from noise),
+        guided with each row's own `cfg_scale`, and the number of denoising steps each took.
+        """
+        model = self.model
+        cfg_scales = [self._rows[i].request.cfg_scale for i in rows]
+        if all(scale == 1.0 for scale in cfg_scales):
+            # no row is guided, skip the unconditional diffusion batch
+            cfg_scale, neg_condition = 1.0, None
+        else:
+            cfg_scale = torch.tensor(cfg_scales, dtype=condition.dtype, device=model.prediction_head.device)[:, None]
+        return model.sample_speech_tokens(
+            condition, neg_condition, cfg_scale=cfg_scale, guidance_interval=self.guidance_interval, sampler=sampler,
+            early_exit_tolerance=self.early_exit_tolerance, return_num_steps=True,
+            init_latent=torch.stack([self._rows[i].previous_latent for i in rows]) if warm_start is not None else None,
+            warm_start=warm_start if warm_start is not None else 1.0,
+        )
+
+    def _diffuse(self, rows: List[int], condition: torch.FloatTensor, neg_condition: torch.FloatTensor) -> torch.FloatTensor:
+        """Sample one speech latent per diffusing row, decode it and return the next input embeddings."""
+        model = self.model
+        # rows warm start only from a previous frame of the same speech segment
+        keys = [
+            (row.request.sampler, row.request.warm_start if row.previous_latent is not None else None)
+            for row in (self._rows[i] for i in rows)
+        ]
+        if len(set(keys)) == 1:
+            speech_latent, num_steps = self._sample_latents(rows, condition, neg_condition, *keys[0])
+        else:
+            # one diffusion batch per sampler and warm start, reassembled in row order
+            order, latents, steps = [], [], []
+            for key in dict.fromkeys(keys):
+                group = [k for k, row_key in enumerate(keys) if row_key == key]
+                index = torch.tensor(group, dtype=torch.long, device=condition.device)
+                group_latent, group_steps = self._sample_latents(
+                    [rows[k] for k in group], condition[index],
+                    neg_condition[index] if neg_condition is not None else None, *key,
+                )
+                latents.append(group_latent)
+                steps.append(group_steps)
+                order.extend(group)
+            inverse = torch.tensor(order).argsort()
+            speech_latent = torch.cat(latents)[inverse.to(latents[0].device)]
+            num_steps = torch.cat(steps)[inverse]
+        speech_latent = speech_latent.unsqueeze(1)
+
+        slots = torch.tensor([self._rows[i].slot for i in rows], dtype=torch.long)
+        scaled_latent = speech_latent / model.model.speech_scaling_factor.to(speech_latent.device) - model.model.speech_bias_factor.to(speech_latent.device)
+        codecs = model.model if model.onnx_runtime is None else model.onnx_runtime
+        audio_chunk = codecs.acoustic_tokenizer.decode(
+            scaled_latent.to(codecs.acoustic_tokenizer.device),
+            cache=self.acoustic_cache,
+            sample_indices=slots.to(codecs.acoustic_tokenizer.device),
+            use_cache=True,
+            debug=False,
+        )
+
+        for i, row_idx in enumerate(rows):
+            row = self._rows[row_idx]
+            row.diffusion_steps += int(num_steps[i])
+            row.diffusion_frames += 1
+            if row.request.warm_start is not None:
+                row.previous_latent = speech_latent[i, 0]
+            if self.return_speech:
+                row.audio_chunks.append(audio_chunk[i])
+            if row.request.audio_streamer is not None:
+                row.request.audio_streamer.put(audio_chunk[i: i + 1], torch.zeros(1, dtype=torch.long))
+
+        semantic_features = codecs.semantic_tokenizer.encode(
+            audio_chunk,
+            cache=self.semantic_cache,
+            sample_indices=slots.to(codecs.semantic_tokenizer.device),
+            use_cache=True,
+            debug=False,
+        ).mean
+
+        acoustic_embed = model.model.acoustic_connector(speech_latent)
+        semantic_embed = model.model.semantic_connector(semantic_features)
+        return acoustic_embed + semantic_embed
+
+    def _finish(self, row: _ActiveRequest):
+        request = row.request
+        if request.audio_streamer is not None:
+            request.audio_streamer.end()
+        if self.verbose:
+            print(f"Request {request.request_id} finished after {row.step} steps.", flush=True)
+
+        generated = torch.tensor(row.tokens, dtype=torch.long, device=request.input_ids.device)
+        speech = torch.cat(row.audio_chunks, dim=-1) if row.audio_chunks else None
+        self._outputs[request.request_id] = VibeVoiceGenerationOutput(
+            sequences=torch.cat([request.input_ids.view(-1), generated])[None],
+            speech_outputs=[speech] if self.return_speech else None,
+            reach_max_step_sample=torch.tensor([row.reach_max_step]),
+            diffusion_steps_per_frame=torch.tensor([row.diffusion_steps / max(row.diffusion_frames, 1)]),
+        )
+        self._free_slots.append(row.slot)
+        self._free_slots.sort()
+
+    def _remove_rows(self, keep: List[int]):
+        self._rows = [self._rows[i] for i in keep]
+        if not keep:
+            self._cache = self._attention_mask = self._positions = None
+            self._neg_cache = VibeVoiceNegativeCache()
+            self._inputs_embeds = None
+            return
+
+        rows = torch.tensor(keep, dtype=torch.long, device=self.device)
+        self._cache, self._attention_mask = _select_rows(self._cache, self._attention_mask, rows)
+        self._neg_cache.select_rows(keep)
+        self._positions = self._positions[rows]
+        self._inputs_embeds = self._inputs_embeds[rows]
+
+
+__all__ = [
+    "VibeVoiceGenerationRequest",
+    "VibeVoiceContinuousBatchingEngine",
+]
@@ -0,0 +1,202 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Union
+
+import torch
+from transformers.utils import logging
+
+logger = logging.get_logger(__name__)
+
+
+@dataclass(eq=False)
+class _DiffusionJob:
+    """One `sample_speech_tokens` call waiting for the batcher."""
+    condition: torch.Tensor
+    neg_condition: Optional[torch.Tensor]
+    cfg_scale: Union[float, torch.Tensor]
+    noise: torch.Tensor
+    init_latent: Optional[torch.Tensor]
+    key: tuple
+    kwargs: Dict[str, Any]
+    done: threading.Event = field(default_factory=threading.Event)
+    latent: Optional[torch.Tensor] = None
+    num_steps: Optional[torch.LongTensor] = None
+    error: Optional[BaseException] = None
+
+    @property
+    def batch_size(self) -> int:
+        return self.condition.shape[0]
+
+
+class VibeVoiceDiffusionBatcher:
+    """
+    Cross-request micro-batcher for the diffusion head.
+
+    Generations running in different threads on one model (e.g. the requests of a gradio demo)
+    each sample a handful of speech latents per frame, and a diffusion head batch of a few rows
+    leaves most of a CPU's matrix throughput unused. With a batcher set on the model
+    (`set_diffusion_batcher`), `sample_speech_tokens` hands its rows to a worker thread instead.
+    The worker collects the calls arriving within `max_wait_ms` of the first one, up to
+    `max_batch_size` rows, and denoises all compatible calls (same sampler, number of steps,
+    guidance interval, warm start and early exit setting, and all guided or all unguided) as one
+    batch, so every solver step is one `prediction_head` forward for all of them. Each call keeps
+    its own `cfg_scale` (a scalar or one per row) and its own initial noise, drawn in the calling
+    thread, so a seeded call gives the same latents as without the batcher, up to batched-GEMM
+    rounding.
+
+    Args:
+        model (`VibeVoiceForConditionalGenerationInference`):
+            The model whose `sample_speech_tokens` runs the merged batches.
+        max_batch_size (`int`, *optional*, defaults to 64):
+            Maximum number of rows (before the unconditional CFG copy) collected into one batch.
+        max_wait_ms (`float`, *optional*, defaults to 2.0):
+            How long the worker waits for more calls after the first one arrived.
+
+    Example:
+
+    ```python
+    >>> model.set_diffusion_batcher(VibeVoiceDiffusionBatcher(model, max_wait_ms=2.0))
+    >>> # run generate() from several threads as usual
+    >>> model.diffusion_batcher.close()
+    ```
+    """
+
+    def __init__(self, model, max_batch_size: int = 64, max_wait_ms: float = 2.0):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._pending: List[_DiffusionJob] = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="vibevoice-diffusion-batcher", daemon=True)
+        self._worker.start()
+        # number of merged batches and of calls in them, e.g. to tune `max_wait_ms`
+        self.num_batches = 0
+        self.num_calls = 0
+
+    def owns_current_thread(self) -> bool:
+        """Whether the caller is the worker thread, whose `sample_speech_tokens` calls run directly."""
+        return threading.current_thread() is self._worker
+
+    def submit(
+        self,
+        condition: torch.Tensor,
+        neg_condition: Optional[torch.Tensor],
+        cfg_scale: Union[float, torch.Tensor] = 3.0,
+        noise: Optional[torch.Tensor] = None,
+        init_latent: Optional[torch.Tensor] = None,
+        return_num_steps: bool = False,
+        **kwargs,
+    ):
+        """Queue one `sample_speech_tokens` call, wait for its batch and return its part of the result."""
+        batch_size = condition.shape[0]
+        if noise is None:
+            # drawn here like `sample_speech_tokens` does, so the seed of the calling thread applies
+            noise = torch.randn(2 * batch_size, self.model.config.acoustic_vae_dim).to(condition)[:batch_size]
+        guided = neg_condition is not None and not (isinstance(cfg_scale, (int, float)) and cfg_scale == 1.0)
+        warm_start = kwargs.get("warm_start", 1.0) if init_latent is not None else None
+        key = (
+            kwargs.get("sampler"),
+            self.model.ddpm_inference_steps,
+            kwargs.get("guidance_interval"),
+            warm_start,
+            kwargs.get("early_exit_tolerance"),
+            guided,
+        )
+        job = _DiffusionJob(
+            condition=condition,
+            neg_condition=neg_condition if guided else None,
+            cfg_scale=cfg_scale,
+            noise=noise,
+            init_latent=init_latent,
+            key=key,
+            kwargs=kwargs,
+        )
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("The diffusion batcher is closed")
+            self._pending.append(job)
+            self._condition.notify_all()
+        job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return (job.latent, job.num_steps) if return_num_steps else job.latent
+
+    def close(self):
+        """Stop the worker once the queued calls are done. Later calls fail, so unset the batcher first."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._worker.join()
+
+    def _take_jobs(self) -> List[_DiffusionJob]:
+        with self._condition:
+            while not self._pending and not self._closed:
+                self._condition.wait()
+            if not self._pending:
+                return []
+            deadline = time.monotonic() + self.max_wait_ms / 1000
+            while sum(job.batch_size for job in self._pending) < self.max_batch_size and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            jobs, rows = [], 0
+            while self._pending and (not jobs or rows + self._pending[0].batch_size <= self.max_batch_size):
+                job = self._pending.pop(0)
+                jobs.append(job)
+                rows += job.batch_size
+            return jobs
+
+    def _run(self):
+        while True:
+            jobs = self._take_jobs()
+            if not jobs:
+                return
+            groups: Dict[tuple, List[_DiffusionJob]] = {}
+            for job in jobs:
+                groups.setdefault(job.key, []).append(job)
+            for group in groups.values():
+                try:
+                    self._sample(group)
+                except BaseException as e:
+                    for job in group:
+                        job.error = e
+                for job in group:
+                    job.done.set()
+
+    def _sample(self, jobs: List[_DiffusionJob]):
+        first = jobs[0]
+        guided = first.neg_condition is not None
+        cfg_scales = [job.cfg_scale for job in jobs]
+        if not guided or (all(isinstance(scale, (int, float)) for scale in cfg_scales) and len(set(cfg_scales)) == 1):
+            cfg_scale = cfg_scales[0]
+        else:
+            # one scale per row, from the calls' scalars or per-row tensors
+            device = self.model.model.prediction_head.device
+            cfg_scale = torch.cat([
+                torch.as_tensor(job.cfg_scale, dtype=first.condition.dtype, device=device).reshape(-1, 1)
+                .expand(job.batch_size, 1) for job in jobs
+            ])
+        latents, num_steps = self.model.sample_speech_tokens(
+            torch.cat([job.condition for job in jobs]),
+            torch.cat([job.neg_condition for job in jobs]) if guided else None,
+            cfg_scale=cfg_scale,
+            noise=torch.cat([job.noise for job in jobs]),
+            init_latent=torch.cat([job.init_latent for job in jobs]) if first.init_latent is not None else None,
+            return_num_steps=True,
+            **first.kwargs,
+        )
+        self.num_batches += 1
+        self.num_calls += len(jobs)
+        offset = 0
+        for job in jobs:
+            job.latent = latents[offset: offset + job.batch_size]
+            job.num_steps = num_steps[offset: offset + job.batch_size]
+            offset += job.batch_size
+
+
+__all__ = [
+    "VibeVoiceDiffusionBatcher",
+]
@@ -6,6 +6,7 @@ import torch.nn as nn
 
 from transformers.models.auto import AutoModel, AutoModelForCausalLM
 
+from transformers.cache_utils import DynamicCache
 from transformers.generation import GenerationMixin, GenerationConfig, LogitsProcessor, LogitsProcessorList, StoppingCriteriaList
 from transformers.modeling_outputs import BaseModelOutputWithPast, ModelOutput
 from transformers import modeling_utils
@@ -18,12 +19,19 @@ from transformers.utils import logging
 from .modular_vibevoice_tokenizer import VibeVoiceTokenizerStreamingCache, VibeVoiceTokenizerEncoderOutput
 from .modular_vibevoice_diffusion_head import VibeVoiceDiffusionHead
 from vibevoice.schedule.dpm_solver import DPMSolverMultistepScheduler
+from vibevoice.schedule.samplers import create_sampler
 
 from .configuration_vibevoice import VibeVoiceConfig
 
 from .modular_vibevoice_text_tokenizer import VibeVoiceTextTokenizer, VibeVoiceTextTokenizerFast
 
 from .modeling_vibevoice import VibeVoiceModel, VibeVoicePreTrainedModel
+from .prefix_cache import VibeVoicePrefixCache, VibeVoicePrefixCacheEntry
+from .voice_latent_cache import VibeVoiceVoiceLatentCache, VibeVoiceVoiceLatents
+from .compiled_diffusion import VibeVoiceCompiledDenoiser
+from .diffusion_batcher import VibeVoiceDiffusionBatcher
+from .quantization import quantize_diffusion_modules
+from .onnx_runtime import VibeVoiceOnnxRuntime
 from .streamer import AudioStreamer, AsyncAudioStreamer
 
 logger = logging.get_logger(__name__)
@@ -45,10 +53,14 @@ class VibeVoiceGenerationOutput(ModelOutput):
             The generated sequences. 
         speech_outputs (`List[torch.FloatTensor]`, *optional*):
             List of generated speech waveforms or latents for each speech segment.
+        diffusion_steps_per_frame (`torch.FloatTensor` of shape `(batch_size,)`, *optional*):
+            Mean number of denoising steps per generated speech frame of every sample, lower than the
+            configured number of inference steps with `early_exit_tolerance`.
     """
     sequences: torch.LongTensor = None
     speech_outputs: Optional[List[torch.FloatTensor]] = None
     reach_max_step_sample: Optional[torch.BoolTensor] = None
+    diffusion_steps_per_frame: Optional[torch.FloatTensor] = None
 
 class VibeVoiceTokenConstraintProcessor(LogitsProcessor):
     """Constrains token generation to only valid tokens during speech generation."""
@@ -65,6 +77,143 @@ class VibeVoiceTokenConstraintProcessor(LogitsProcessor):
         scores = scores + mask
         return scores
     
+class VibeVoiceNegativeCache:
+    """
+    Key/value cache of the CFG negative sequences, one row per sample.
+
+    Every row stores its entries contiguously from column 0 (the speech_start token) and
+    keeps its own length, so rows are extended independently: a forward pass only gathers
+    the rows taking part in it and writes their new entries back in place. Restarting a
+    row from speech_start just rewinds its length to 1, discarding a row rewinds it to 0.
+    `evict` drops the oldest entries after speech_start; the row keeps counting positions
+    from where it was.
+    """
+
+    def __init__(self, batch_size: int = 0):
+        self.key_cache: List[torch.Tensor] = []
+        self.value_cache: List[torch.Tensor] = []
+        self.lengths: List[int] = [0] * batch_size
+        self.evicted: List[int] = [0] * batch_size
+
+    @property
+    def batch_size(self) -> int:
+        return len(self.lengths)
+
+    @property
+    def capacity(self) -> int:
+        return self.key_cache[0].shape[2] if self.key_cache else 0
+
+    def _row_index(self, rows: List[int], device):
+        if rows == list(range(self.batch_size)):
+            return slice(None)
+        return torch.tensor(rows, dtype=torch.long, device=device)
+
+    def prepare_rows(self, rows: List[int], device):
+        """Build the cache, attention mask, position ids and cache position to extend `rows` by one token."""
+        lengths = [self.lengths[r] for r in rows]
+        max_length = max(lengths)
+        cache = DynamicCache()
+        if max_length > 0:
+            index = self._row_index(rows, self.key_cache[0].device)
+            for k, v in zip(self.key_cache, self.value_cache):
+                cache.key_cache.append(k[index, :, :max_length])
+                cache.value_cache.append(v[index, :, :max_length])
+            cache._seen_tokens = max_length
+
+        positions = torch.tensor([self.lengths[r] + self.evicted[r] for r in rows], dtype=torch.long, device=device)
+        lengths = torch.tensor(lengths, dtype=torch.long, device=device)
+        columns = torch.arange(max_length + 1, device=device)
+        # Shorter rows are right-padded; the new token always sits in the last column
+        attention_mask = ((columns[None] < lengths[:, None]) | (columns[None] == max_length)).long()
+        cache_position = torch.arange(max_length, max_length + 1, device=device)
+        return cache, attention_mask, positions[:, None], cache_position
+
+    def update_rows(self, rows: List[int], cache: DynamicCache):
+        """Store the entries `cache` produced for the new token of each of `rows`."""
+        self._reserve(max(self.lengths[r] for r in rows) + 1, cache.key_cache)
+        device = self.key_cache[0].device
+        index = torch.tensor(rows, dtype=torch.long, device=device)
+        columns = torch.tensor([self.lengths[r] for r in rows], dtype=torch.long, device=device)
+        for layer_idx in range(len(cache.key_cache)):
+            self.key_cache[layer_idx][index, :, columns] = cache.key_cache[layer_idx][:, :, -1]
+            self.value_cache[layer_idx][index, :, columns] = cache.value_cache[layer_idx][:, :, -1]
+        for r in rows:
+            self.lengths[r] += 1
+
+    def reset_rows(self, rows: List[int]):
+        """Restart `rows` from their speech_start entry."""
+        for r in rows:
+            self.lengths[r] = min(self.lengths[r], 1)
+            self.evicted[r] = 0
+
+    def discard_rows(self, rows: List[int]):
+        """Drop every entry of `rows`; their next token starts a new sequence."""
+        for r in rows:
+            self.lengths[r] = 0
+            self.evicted[r] = 0
+
+    def evict(self, window: int, block: int = 1):
+        """
+        Keep only the speech_start entry and the last `window` entries of every row. A row is
+        trimmed once it exceeds the window by `block` entries, so the copy is amortized.
+        """
+        for r, length in enumerate(self.lengths):
+            count = length - 1 - window
+            if count < block:
+                continue
+            for states in self.key_cache + self.value_cache:
+                states[r, :, 1:1 + window] = states[r, :, 1 + count:length].clone()
+            self.lengths[r] -= count
+            self.evicted[r] += count
+
+    def select_rows(self, rows: List[int]):
+        """Keep only `rows`, in the given order."""
+        if self.key_cache:
+            index = torch.tensor(rows, dtype=torch.long, device=self.key_cache[0].device)
+            self.key_cache = [k.index_select(0, index) for k in self.key_cache]
+            self.value_cache = [v.index_select(0, index) for v in self.value_cache]
+        self.lengths = [self.lengths[r] for r in rows]
+        self.evicted = [self.evicted[r] for r in rows]
+
+    def append(self, other: "VibeVoiceNegativeCache"):
+        """Append the rows of `other` after the rows of this cache."""
+        if self.key_cache and not other.key_cache:
+            # rows that never ran (e.g. of unguided requests) still need their buffer rows
+            other._reserve(self.capacity, self.key_cache)
+        if not other.key_cache:
+            self.lengths = self.lengths + other.lengths
+            self.evicted = self.evicted + other.evicted
+            return
+        if self.batch_size > 0 and not self.key_cache:
+            self._reserve(1, other.key_cache)
+        capacity = max(self.capacity, other.capacity)
+        self._reserve(capacity, other.key_cache)
+        other._reserve(capacity, other.key_cache)
+        if self.batch_size == 0:
+            self.key_cache, self.value_cache = list(other.key_cache), list(other.value_cache)
+        else:
+            self.key_cache = [torch.cat([a, b], dim=0) for a, b in zip(self.key_cache, other.key_cache)]
+            self.value_cache = [torch.cat([a, b], dim=0) for a, b in zip(self.value_cache, other.value_cache)]
+        self.lengths = self.lengths + other.lengths
+        self.evicted = self.evicted + other.evicted
+
+    def _reserve(self, length: int, like: List[torch.Tensor]):
+        """Make sure the buffers hold at least `length` columns, doubling their capacity when growing."""
+        if length <= self.capacity:
+            return
+        capacity = max(length, 2 * self.capacity, 64)
+        key_cache, value_cache = [], []
+        for layer_idx, t in enumerate(like):
+            shape = (self.batch_size, t.shape[1], capacity, t.shape[3])
+            new_k, new_v = t.new_zeros(shape), t.new_zeros(shape)
+            if self.key_cache:
+                new_k[:, :, :self.capacity] = self.key_cache[layer_idx]
+                new_v[:, :, :self.capacity] = self.value_cache[layer_idx]
+            key_cache.append(new_k)
+            value_cache.append(new_v)
+        self.key_cache, self.value_cache = key_cache, value_cache
+
+
 class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, GenerationMixin):
     _tied_weights_keys = ["lm_head.weight"]
     _tp_plan = {"lm_head": "colwise_rep"}
@@ -80,6 +229,15 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
         
         # inference configuration
         self.ddpm_inference_steps = config.diffusion_head_config.ddpm_num_inference_steps
+        self.voice_latent_cache: Optional[VibeVoiceVoiceLatentCache] = None
+        # bumped whenever the speech modules are rewritten in place, so cached voice latents are not reused
+        self._speech_modules_revision = 0
+        self.compiled_denoiser: Optional[VibeVoiceCompiledDenoiser] = None
+        self.diffusion_batcher: Optional[VibeVoiceDiffusionBatcher] = None
+        self.speech_encode_chunk_size: Optional[int] = None
+        self.onnx_runtime: Optional[VibeVoiceOnnxRuntime] = None
+        # samplers selected by name, see `get_noise_sampler`
+        self._noise_samplers: Dict[str, Tuple[DPMSolverMultistepScheduler, DPMSolverMultistepScheduler]] = {}
 
         # Initialize weights and apply final processing
         self.post_init()
@@ -146,12 +304,124 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
     def set_ddpm_inference_steps(self, num_steps=None):
         self.ddpm_inference_steps = num_steps or self.config.diffusion_head_config.ddpm_num_inference_steps
 
+    def get_noise_sampler(self, sampler: Optional[str] = None) -> DPMSolverMultistepScheduler:
+        """
+        The sampler named `sampler` (see `vibevoice.schedule.samplers.available_samplers`), built from the config
+        of `noise_scheduler`, or `noise_scheduler` itself for `None`.
+        """
+        noise_scheduler = self.model.noise_scheduler
+        if sampler is None:
+            return noise_scheduler
+        cached = self._noise_samplers.get(sampler)
+        # rebuilt when `noise_scheduler` was replaced, e.g. with another beta schedule
+        if cached is None or cached[0] is not noise_scheduler:
+            cached = (noise_scheduler, create_sampler(sampler, noise_scheduler))
+            self._noise_samplers[sampler] = cached
+        return cached[1]
+
+    def set_compiled_denoiser(self, denoiser: Optional[VibeVoiceCompiledDenoiser] = None):
+        """Run the denoising loop of `sample_speech_tokens` through `denoiser` (`None` runs it eagerly)."""
+        self.compiled_denoiser = denoiser
+
+    def set_onnx_runtime(self, runtime: Optional[VibeVoiceOnnxRuntime] = None):
+        """
+        Run the diffusion head and the per-frame streaming codecs on `runtime` (`None` runs them in PyTorch). The
+        graphs come from `vibevoice.modular.onnx_runtime.export_onnx` of this model.
+        """
+        self.onnx_runtime = runtime
+
+    def quantize_speech_modules(self, check_accuracy: bool = True, num_samples: int = 64) -> Optional[Dict[str, float]]:
+        """
+        Opt-in int8 inference on the CPU: replaces every linear layer of the diffusion head and of the acoustic and
+        semantic connectors by an `Int8DynamicLinear` (per-channel int8 weights, dynamically quantized
+        activations). Returns the deviation of the quantized head's predictions from the original ones when
+        `check_accuracy` is set, see `vibevoice.modular.quantization.diffusion_head_error`. Irreversible; the
+        quantized modules cannot be moved off the CPU.
+        """
+        self._speech_modules_revision += 1
+        return quantize_diffusion_modules(self.model, check_accuracy=check_accuracy, num_samples=num_samples)
+
+    def freeze_speech_tokenizers(self):
+        """
+        Fold the acoustic and semantic tokenizers for inference, see
+        `VibeVoiceAcousticTokenizerModel.freeze_for_inference`. Irreversible; call it before generating.
+        """
+        self._speech_modules_revision += 1
+        for tokenizer in (self.model.acoustic_tokenizer, self.model.semantic_tokenizer):
+            if tokenizer is not None:
+                tokenizer.freeze_for_inference()
+
+    def set_diffusion_batcher(self, batcher: Optional[VibeVoiceDiffusionBatcher] = None):
+        """Batch the `sample_speech_tokens` calls of concurrent generations in `batcher` (`None` disables it)."""
+        self.diffusion_batcher = batcher
+
+    def set_voice_latent_cache(self, cache: Optional[VibeVoiceVoiceLatentCache] = None):
+        """Cache encoded voice prompts across calls in `cache` (`None` disables caching)."""
+        self.voice_latent_cache = cache
+
+    def set_speech_encode_chunk_size(self, chunk_size: Optional[int] = None):
+        """
+        Encode voice prompts in chunks of `chunk_size` samples (`None` encodes them whole), bounding the encoder's
+        activation memory for long prompts, see `VibeVoiceAcousticTokenizerModel.encode_chunked`.
+        """
+        self.speech_encode_chunk_size = chunk_size
+
+    def _encode_speech(self, speech_tensors, speech_masks):
+        """`acoustic_tokenizer.encode` of the padded waveforms, in chunks if `speech_encode_chunk_size` is set."""
+        audio = speech_tensors.unsqueeze(1)
+        if self.speech_encode_chunk_size is None:
+            return self.model.acoustic_tokenizer.encode(audio)
+        hop_length = int(self.model.acoustic_tokenizer.encoder.hop_length)
+        # the shorter voices stop after their last frame, which may be partly padding as in a whole encode
+        lengths = [n * hop_length for n in speech_masks.sum(dim=-1).tolist()]
+        return self.model.acoustic_tokenizer.encode_chunked(audio, self.speech_encode_chunk_size, lengths=lengths)
+
+    def _voice_latent_cache_revision(self):
+        return (
+            f"{self.config._name_or_path}@{getattr(self.config, '_commit_hash', None)}/{self.dtype}"
+            f"/r{self._speech_modules_revision}"
+        )
+
+    def _process_cached_speech_inputs(self, speech_tensors, speech_masks):
+        """`_process_speech_inputs` for raw audio, looking every waveform up in the voice latent cache first."""
+        cache = self.voice_latent_cache
+        revision = self._voice_latent_cache_revision()
+        num_frames = speech_masks.sum(dim=-1).tolist()
+        keys = [cache.make_key(speech, n, revision) for speech, n in zip(speech_tensors, num_frames)]
+        entries = [cache.get(key) for key in keys]
+
+        missing = [i for i, entry in enumerate(entries) if entry is None]
+        if len(missing) > 0:
+            # the encoder is causal, so the padding of the other voices does not change the valid frames
+            index = torch.tensor(missing, dtype=torch.long, device=speech_tensors.device)
+            encoder_output = self._encode_speech(speech_tensors[index], speech_masks[index.to(speech_masks.device)])
+            acoustic_latents = encoder_output.sample(dist_type=self.model.acoustic_tokenizer.std_dist_type)[0]
+            acoustic_features = (acoustic_latents + self.model.speech_bias_factor.to(acoustic_latents.device)) * self.model.speech_scaling_factor.to(acoustic_latents.device)
+            acoustic_connected = self.model.acoustic_connector(acoustic_features)
+            for j, i in enumerate(missing):
+                n = num_frames[i]
+                entries[i] = VibeVoiceVoiceLatents(
+                    mean=encoder_output.mean[j, :n],
+                    features=acoustic_features[j, :n],
+                    connected=acoustic_connected[j, :n],
+                )
+                cache.put(keys[i], entries[i])
+
+        features = entries[0].features
+        acoustic_features = features.new_zeros((len(entries), speech_masks.shape[1], features.shape[-1]))
+        for i, entry in enumerate(entries):
+            acoustic_features[i, :num_frames[i]] = entry.features
+        acoustic_connected = torch.cat([entry.connected for entry in entries], dim=0)
+        return acoustic_features, acoustic_connected
+
     def _process_speech_inputs(self, speech_tensors, speech_masks, speech_type="audio"):
         """Process speech inputs through tokenizers and connectors."""
         with torch.no_grad():
-            if speech_type == "audio":
+            if speech_type == "audio" and self.voice_latent_cache is not None:
+                return self._process_cached_speech_inputs(speech_tensors, speech_masks)
+            elif speech_type == "audio":
                 # Encode audio to acoustic latents
-                encoder_output = self.model.acoustic_tokenizer.encode(speech_tensors.unsqueeze(1))
+                encoder_output = self._encode_speech(speech_tensors, speech_masks)
                 acoustic_latents = encoder_output.sample(dist_type=self.model.acoustic_tokenizer.std_dist_type)[0]
                 
                 # Apply scaling and bias
@@ -193,6 +463,9 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
         speech_masks: Optional[torch.BoolTensor] = None,
         speech_input_mask: Optional[torch.BoolTensor] = None,
         logits_to_keep: Union[int, slice] = 0,
+        lm_head_indices: Optional[torch.LongTensor] = None,
+        compute_logits: bool = True,
+        speech_type: str = "audio",
         **kwargs,
     ) -> Union[Tuple, VibeVoiceCausalLMOutputWithPast]:
         """
@@ -207,6 +480,14 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
                 Masks indicating valid speech frames.
             speech_input_mask (`torch.BoolTensor`, *optional*):
                 Positions in the input sequence where speech embeddings should be inserted.
+            lm_head_indices (`torch.LongTensor`, *optional*):
+                Vocabulary rows of `lm_head` to project onto. If given, the returned logits only
+                cover these tokens, in the given order.
+            compute_logits (`bool`, *optional*, defaults to `True`):
+                Whether to apply `lm_head` at all. Set to `False` when only the hidden states are needed.
+            speech_type (`str`, *optional*, defaults to `"audio"`):
+                `"audio"` if `speech_tensors` are waveforms, `"pt"` if they are pre-encoded acoustic latents
+                (voice packs) of shape `(num_voices, num_frames, vae_dim)`.
         
         Returns:
             `VibeVoiceCausalLMOutputWithPast` or tuple
@@ -219,7 +500,7 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
         
         # Process speech inputs if provided
         if speech_tensors is not None and speech_masks is not None:
-            acoustic_features, speech_embeds = self._process_speech_inputs(speech_tensors.to(self.dtype), speech_masks)
+            acoustic_features, speech_embeds = self._process_speech_inputs(speech_tensors.to(self.dtype), speech_masks, speech_type=speech_type)
             if speech_input_mask is not None:
                 inputs_embeds[speech_input_mask] = speech_embeds
 
@@ -238,8 +519,13 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
 
         hidden_states = outputs[0] if not return_dict else outputs.last_hidden_state
         # Only compute necessary logits, and do not upcast them to float if we are not computing the loss
-        slice_indices = slice(-logits_to_keep, None) if isinstance(logits_to_keep, int) else logits_to_keep
-        logits = self.lm_head(hidden_states[:, slice_indices, :])
+        logits = None
+        if compute_logits:
+            slice_indices = slice(-logits_to_keep, None) if isinstance(logits_to_keep, int) else logits_to_keep
+            if lm_head_indices is not None:
+                logits = nn.functional.linear(hidden_states[:, slice_indices, :], self.lm_head.weight[lm_head_indices])
+            else:
+                logits = self.lm_head(hidden_states[:, slice_indices, :])
                 
         if labels is not None:
             raise NotImplementedError("Loss computation is not implemented in this version.")
@@ -251,6 +537,317 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
             attentions=outputs.attentions,
         )
 
+    def _forward_negative(self, negative_cache, rows, inputs_embeds=None, input_ids=None):
+        """Extend `rows` of the negative (CFG) cache by one token and return their last hidden states."""
+        past_key_values, attention_mask, position_ids, cache_position = negative_cache.prepare_rows(rows, self.device)
+        outputs = self(
+            input_ids=input_ids,
+            inputs_embeds=inputs_embeds,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=past_key_values,
+            use_cache=True,
+            cache_position=cache_position,
+            compute_logits=False,
+            return_dict=True,
+        )
+        negative_cache.update_rows(rows, outputs.past_key_values)
+        return outputs.last_hidden_state[:, -1, :]
+
+    def _init_fused_cfg_state(self, past_key_values, attention_mask, negative_cache):
+        """
+        Stack the positive cache and the negative (CFG) rows into one cache with 2 * batch_size rows.
+
+        The negative rows are left-padded to the positive length. Their speech_start entry sits
+        in the last column, which is remembered so that a row can be restarted from it later.
+        """
+        batch_size, length = attention_mask.shape
+        cache = DynamicCache()
+        for layer_idx in range(len(past_key_values.key_cache)):
+            for states, negative_states in (
+                (past_key_values.key_cache, negative_cache.key_cache),
+                (past_key_values.value_cache, negative_cache.value_cache),
+            ):
+                positive = states[layer_idx]
+                negative = nn.functional.pad(negative_states[layer_idx][:, :, :1], (0, 0, length - 1, 0))
+                fused = torch.cat([positive, negative], dim=0)
+                if states is past_key_values.key_cache:
+                    cache.key_cache.append(fused)
+                else:
+                    cache.value_cache.append(fused)
+        cache._seen_tokens = length
+
+        negative_attention_mask = torch.zeros_like(attention_mask)
+        negative_attention_mask[:, -1] = 1
+        return {
+            "past_key_values": cache,
+            "attention_mask": torch.cat([attention_mask, negative_attention_mask], dim=0),
+            "position_ids": torch.cat([attention_mask.sum(dim=-1), torch.ones_like(attention_mask[:, 0])]),
+            "speech_start_column": length - 1,
+            "started": torch.ones_like(attention_mask[:, 0], dtype=torch.bool),
+            "batch_size": batch_size,
+        }
+
+    def _forward_fused_cfg(self, state, inputs_embeds, lm_head_indices=None):
+        """
+        Run the positive and negative rows of every sample through the language model in one forward.
+
+        Every negative row is speculatively extended with the sample's input; `_rollback_fused_cfg`
+        drops the new entry again for the samples that turn out not to run diffusion.
+        """
+        batch_size = state["batch_size"]
+        length = state["attention_mask"].shape[1]
+        state["attention_mask"] = nn.functional.pad(state["attention_mask"], (0, 1), value=1)
+        outputs = self(
+            inputs_embeds=torch.cat([inputs_embeds, inputs_embeds], dim=0),
+            attention_mask=state["attention_mask"],
+            position_ids=state["position_ids"][:, None],
+            past_key_values=state["past_key_values"],
+            use_cache=True,
+            cache_position=torch.arange(length, length + 1, device=inputs_embeds.device),
+            compute_logits=False,
+            return_dict=True,
+        )
+        state["position_ids"] = state["position_ids"] + 1
+
+        hidden_states = outputs.last_hidden_state[:, -1:, :]
+        positive_hidden, negative_hidden = hidden_states[:batch_size], hidden_states[batch_size:]
+        if lm_head_indices is not None:
+            logits = nn.functional.linear(positive_hidden, self.lm_head.weight[lm_head_indices])
+        else:
+            logits = self.lm_head(positive_hidden)
+        positive_outputs = VibeVoiceCausalLMOutputWithPast(logits=logits, last_hidden_state=positive_hidden)
+        return positive_outputs, negative_hidden[:, -1, :]
+
+    def _rollback_fused_cfg(self, state, rows):
+        """Mask the speculative negative entry of `rows` written by the last fused forward."""
+        rows = rows + state["batch_size"]
+        state["attention_mask"][rows, -1] = 0
+        state["position_ids"][rows] -= 1
+
+    def _reset_fused_cfg(self, state, rows):
+        """Restart the negative sequence of `rows` from their speech_start entry, or empty if they never started."""
+        started = state["started"][rows].long()
+        rows = rows + state["batch_size"]
+        state["attention_mask"][rows] = 0
+        state["attention_mask"][rows, state["speech_start_column"]] = started
+        state["position_ids"][rows] = started
+
+    def _discard_fused_cfg(self, state, rows):
+        """Drop the negative sequence of `rows`; their next kept token starts a new one."""
+        state["started"][rows] = False
+        rows = rows + state["batch_size"]
+        state["attention_mask"][rows] = 0
+        state["position_ids"][rows] = 0
+
+    @staticmethod
+    def _evict_kv_columns(past_key_values, attention_mask, start, count, length):
+        """
+        Drop the KV columns `[start, start + count)` of every layer. The first `length` columns of
+        `attention_mask` describe the cache; the columns after the evicted ones move left in place.
+        """
+        for states in (past_key_values.key_cache, past_key_values.value_cache):
+            for layer_idx, layer_states in enumerate(states):
+                states[layer_idx] = torch.cat([layer_states[:, :, :start], layer_states[:, :, start + count:]], dim=2)
+        past_key_values._seen_tokens -= count
+        attention_mask[:, start:length - count] = attention_mask[:, start + count:length].clone()
+        attention_mask[:, length - count:length] = 0
+
+    def _forward_prefill_chunk(
+        self,
+        input_ids,
+        attention_mask,
+        position_ids,
+        past_key_values,
+        start,
+        end,
+        cache_offset=0,
+        speech_embeds=None,
+        speech_input_mask=None,
+        compute_logits=True,
+        lm_head_indices=None,
+    ):
+        """
+        Prefill columns `[start, end)` of `input_ids` into `past_key_values`.
+
+        `attention_mask` covers the whole cache, i.e. `cache_offset` columns already in it before
+        `input_ids`, and `position_ids` covers `input_ids`. The voice embeddings in `speech_embeds`
+        (one row per `True` of `speech_input_mask`, in row-major order) are scattered into the
+        chunk columns they belong to.
+        """
+        inputs_embeds = self.model.get_input_embeddings()(input_ids[:, start:end])
+        if speech_embeds is not None:
+            chunk_mask = speech_input_mask[:, start:end]
+            if chunk_mask.any():
+                speech_index = speech_input_mask.flatten().long().cumsum(0).view_as(speech_input_mask) - 1
+                inputs_embeds[chunk_mask] = speech_embeds[speech_index[:, start:end][chunk_mask]].to(inputs_embeds.dtype)
+        return self(
+            inputs_embeds=inputs_embeds,
+            attention_mask=attention_mask[:, :cache_offset + end],
+            position_ids=position_ids[:, start:end],
+            past_key_values=past_key_values,
+            use_cache=True,
+            cache_position=torch.arange(cache_offset + start, cache_offset + end, device=input_ids.device),
+            logits_to_keep=1,
+            compute_logits=compute_logits,
+            lm_head_indices=lm_head_indices,
+            return_dict=True,
+        )
+
+    def _chunked_prefill(
+        self,
+        input_ids,
+        attention_mask,
+        position_ids,
+        past_key_values,
+        chunk_size=None,
+        cache_offset=0,
+        speech_embeds=None,
+        speech_input_mask=None,
+        compute_logits=True,
+        lm_head_indices=None,
+    ):
+        """
+        Prefill `input_ids` in chunks of `chunk_size` tokens (all at once if `None`) and return the
+        outputs of the last chunk. Peak activation memory is bounded by the chunk size instead of
+        the prompt length; see `_forward_prefill_chunk` for the arguments.
+        """
+        length = input_ids.shape[1]
+        chunk_size = chunk_size or length
+        for start in range(0, length, chunk_size):
+            end = min(start + chunk_size, length)
+            outputs = self._forward_prefill_chunk(
+                input_ids, attention_mask, position_ids, past_key_values, start, end,
+                cache_offset=cache_offset, speech_embeds=speech_embeds, speech_input_mask=speech_input_mask,
+                compute_logits=compute_logits and end == length, lm_head_indices=lm_head_indices,
+            )
+        return outputs
+
+    def _get_prefix_states(
+        self,
+        prefix_cache,
+        prefix_ids,
+        speech_tensors=None,
+        speech_masks=None,
+        speech_input_mask=None,
+        speech_type="audio",
+        prefill_chunk_size=None,
+    ):
+        """Look up the KV states of one unpadded prompt prefix in `prefix_cache`, prefilling it on a miss."""
+        revision = f"{self._voice_latent_cache_revision()}/{speech_type}"
+        key = prefix_cache.make_key(prefix_ids.tolist(), speech_tensors, revision)
+        entry = prefix_cache.get(key)
+        if entry is not None:
+            return entry
+
+        prefix_ids = prefix_ids.view(1, -1)
+        speech_embeds = None
+        if speech_tensors is not None:
+            speech_embeds = self._process_speech_inputs(speech_tensors.to(self.dtype), speech_masks, speech_type=speech_type)[1]
+            speech_input_mask = speech_input_mask.view(1, -1)
+        cache = DynamicCache()
+        self._chunked_prefill(
+            prefix_ids,
+            torch.ones_like(prefix_ids),
+            torch.arange(prefix_ids.shape[1], device=prefix_ids.device)[None],
+            cache,
+            chunk_size=prefill_chunk_size,
+            speech_embeds=speech_embeds,
+            speech_input_mask=speech_input_mask,
+            compute_logits=False,
+        )
+        entry = VibeVoicePrefixCacheEntry(key_cache=list(cache.key_cache), value_cache=list(cache.value_cache))
+        prefix_cache.put(key, entry)
+        return entry
+
+    def _prefill_with_prefix_cache(
+        self,
+        prefix_cache,
+        input_ids,
+        attention_mask,
+        voice_prompt_lengths,
+        speech_tensors=None,
+        speech_masks=None,
+        speech_input_mask=None,
+        speech_type="audio",
+        lm_head_indices=None,
+        prefill_chunk_size=None,
+    ):
+        """
+        Prefill a left-padded prompt batch, reusing the cached KV states of the system + voice prompt prefixes.
+
+        The returned cache holds the prefixes in a first block of `max(voice_prompt_lengths)` columns and the
+        rest of the prompts (from `' Text input:'` on) in a second block, each left-padded per sample. The
+        returned attention mask describes that layout; it is wider than `attention_mask` when the samples
+        have prefixes of different lengths. Position ids continue from the end of each sample's prefix, so
+        the rotary embeddings match a plain prefill of the same prompt.
+        """
+        batch_size, width = input_ids.shape
+        device = input_ids.device
+        lengths = attention_mask.sum(dim=-1).tolist()
+
+        entries = []
+        speech_row = 0
+        for b in range(batch_size):
+            start = width - lengths[b]
+            prefix_length = voice_prompt_lengths[b]
+            if not 0 < prefix_length < lengths[b]:
+                raise ValueError(
+                    f"Voice prompt length {prefix_length} of sample {b} does not fit its prompt of {lengths[b]} tokens."
+                )
+            sample_speech = {}
+            if speech_tensors is not None and speech_input_mask is not None:
+                sample_mask = speech_input_mask[b, start:]
+                if sample_mask[prefix_length:].any():
+                    raise ValueError("Voice embeddings must be inside the voice prompt prefix to use the prefix cache.")
+                flags = sample_mask.long()
+                num_voices = int((flags[1:] > flags[:-1]).sum().item() + flags[0].item())
+                if num_voices > 0:
+                    sample_speech = {
+                        "speech_tensors": speech_tensors[speech_row:speech_row + num_voices],
+                        "speech_masks": speech_masks[speech_row:speech_row + num_voices],
+                        "speech_input_mask": sample_mask[:prefix_length],
+                        "speech_type": speech_type,
+                    }
+                    speech_row += num_voices
+            entries.append(self._get_prefix_states(
+                prefix_cache, input_ids[b, start:start + prefix_length], **sample_speech, prefill_chunk_size=prefill_chunk_size,
+            ))
+
+        prefix_lengths = torch.tensor(voice_prompt_lengths, dtype=torch.long, device=device)
+        suffix_lengths = torch.tensor(lengths, dtype=torch.long, device=device) - prefix_lengths
+        prefix_width = int(prefix_lengths.max().item())
+        suffix_width = int(suffix_lengths.max().item())
+
+        cache = DynamicCache()
+        for layer_idx in range(len(entries[0].key_cache)):
+            for states, cached in ((cache.key_cache, "key_cache"), (cache.value_cache, "value_cache")):
+                states.append(torch.cat([
+                    nn.functional.pad(getattr(entry, cached)[layer_idx], (0, 0, prefix_width - entry.length, 0))
+                    for entry in entries
+                ], dim=0))
+        cache._seen_tokens = prefix_width
+
+        prefix_columns = torch.arange(prefix_width, device=device)
+        suffix_columns = torch.arange(suffix_width, device=device)
+        prefix_mask = prefix_columns[None] >= (prefix_width - prefix_lengths)[:, None]
+        suffix_mask = suffix_columns[None] >= (suffix_width - suffix_lengths)[:, None]
+        kv_attention_mask = torch.cat([prefix_mask, suffix_mask], dim=-1).to(attention_mask.dtype)
+        position_ids = prefix_lengths[:, None] + suffix_columns[None] - (suffix_width - suffix_lengths)[:, None]
+        position_ids.masked_fill_(~suffix_mask, 1)
+
+        # the last `suffix_width` tokens of every row cover its suffix; anything before it is masked
+        outputs = self._chunked_prefill(
+            input_ids[:, width - suffix_width:],
+            kv_attention_mask,
+            position_ids,
+            cache,
+            chunk_size=prefill_chunk_size,
+            cache_offset=prefix_width,
+            lm_head_indices=lm_head_indices,
+        )
+        return outputs, cache, kv_attention_mask
+
     def _build_generate_config_model_kwargs(self, generation_config, inputs, tokenizer, return_processors=False, **kwargs):
         if generation_config is None:
             generation_config = GenerationConfig(
@@ -354,9 +951,38 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
             speech_tensors: Input speech for voice cloning
             speech_masks: Masks for speech tensors  
             speech_input_mask: Positions to insert speech embeddings
+            speech_type: "audio" if `speech_tensors` are waveforms, "pt" for voice pack latents (as set by the processor)
             return_speech: Whether to decode and return speech outputs
-            cfg_scale: CFG scale for speech generation
+            cfg_scale: CFG scale for speech generation. 1.0 turns guidance off: the negative (CFG) language model
+                branch and the unconditional diffusion batch are skipped entirely.
             stop_check_fn: Optional callable that returns True if generation should stop
+            stop_check_interval: Number of decode steps between two calls of `stop_check_fn` (and checks of
+                the audio streamer's stop flags). Defaults to 1.
+            fuse_negative: Run the positive and the negative (CFG) rows through the language model in a
+                single batched forward over a combined cache instead of two separate forwards. Defaults to False.
+            prefix_cache: A `VibeVoicePrefixCache`. The KV states of the system + voice prompt prefix of every
+                sample are looked up in (or added to) it, so only the rest of the prompt is prefilled. Requires
+                `voice_prompt_lengths`, as returned by `VibeVoiceProcessor`.
+            prefill_chunk_size: Prefill the prompt in chunks of this many tokens instead of in one forward,
+                which bounds the prefill activation memory for long scripts. Defaults to None (one chunk).
+            kv_window: Long-form mode. Keep the KV states of the prompt (system, voice and script) plus only the
+                last `kv_window` generated tokens, for the positive and the negative (CFG) sequences, so memory
+                and per-step attention cost stay flat over long sessions. Audio chunks are moved to the CPU as
+                they are produced. Not supported with `fuse_negative`. Defaults to None (keep everything).
+            restrict_vocab: Only project onto the `lm_head` rows of the tokens speech generation can emit
+                (speech_start/end/diffusion, eos, bos) instead of the full vocabulary. Defaults to True.
+            guidance_interval: `(start, end)` fractions of the denoising schedule on which CFG runs the
+                unconditional diffusion batch; the other steps reuse the last unconditional prediction. Defaults
+                to None (every step).
+            sampler: Name of the diffusion sampler, e.g. "unipc" or "ddim" (see
+                `vibevoice.schedule.samplers.available_samplers`). Defaults to None (`noise_scheduler`).
+            early_exit_tolerance: Adaptive step count. A frame stops denoising once the relative change of its
+                predicted clean latent between two steps falls below this tolerance, see `sample_speech_tokens`.
+                The mean steps per frame are returned in `diffusion_steps_per_frame`. Defaults to None (always
+                `ddpm_inference_steps`).
+            warm_start: Start every speech frame but the first of a segment from the previous frame's latent
+                noised part way into the schedule, and only run the last `warm_start` fraction of the denoising
+                steps (e.g. 0.5 for half of them). Defaults to None (every frame starts from noise).
  
         Returns:
             Generated token sequences and optionally speech outputs
@@ -366,6 +992,24 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
         parsed_scripts = kwargs.pop("parsed_scripts", None)
         all_speakers_list = kwargs.pop("all_speakers_list", None)
         max_length_times = kwargs.pop("max_length_times", 2)
+        restrict_vocab = kwargs.pop("restrict_vocab", True)
+        fuse_negative = kwargs.pop("fuse_negative", False)
+        prefix_cache: Optional[VibeVoicePrefixCache] = kwargs.pop("prefix_cache", None)
+        voice_prompt_lengths = kwargs.pop("voice_prompt_lengths", None)
+        speech_type = kwargs.pop("speech_type", "audio")
+        prefill_chunk_size = kwargs.pop("prefill_chunk_size", None)
+        kv_window = kwargs.pop("kv_window", None)
+        guidance_interval = kwargs.pop("guidance_interval", None)
+        sampler = kwargs.pop("sampler", None)
+        early_exit_tolerance = kwargs.pop("early_exit_tolerance", None)
+        warm_start = kwargs.pop("warm_start", None)
+        # without guidance the negative branch is never read, so it is not run at all
+        use_cfg = cfg_scale != 1.0
+        fuse_negative = fuse_negative and use_cfg
+        if kv_window is not None and fuse_negative:
+            raise ValueError("`kv_window` is not supported together with `fuse_negative`.")
+        if prefix_cache is not None and voice_prompt_lengths is None:
+            raise ValueError("`prefix_cache` requires the `voice_prompt_lengths` returned by the processor.")
 
         if kwargs.get('max_new_tokens', None) is None:
             kwargs['max_new_tokens'] = self.config.decoder_config.max_position_embeddings - kwargs['input_ids'].shape[-1]
@@ -374,31 +1018,45 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
             generation_config, inputs, tokenizer, return_processors=True, **kwargs
         )
         
-        negative_kwargs = {
-            'input_ids': torch.full((kwargs['input_ids'].shape[0], 1), tokenizer.speech_start_id, dtype=torch.long, device=kwargs['input_ids'].device),
-            'attention_mask':  torch.ones((kwargs['input_ids'].shape[0], 1), dtype=torch.long, device=kwargs['input_ids'].device),
-            'max_new_tokens': kwargs.get('max_new_tokens', 100) 
-        }
-        negative_generation_config, negative_model_kwargs, negative_input_ids = self._build_generate_config_model_kwargs(
-            None, None, tokenizer, return_processors=False, **negative_kwargs
-        )
-
-        acoustic_cache = VibeVoiceTokenizerStreamingCache()
-        semantic_cache = VibeVoiceTokenizerStreamingCache()
-        
         batch_size = input_ids.shape[0]
+        acoustic_cache = VibeVoiceTokenizerStreamingCache(batch_size)
+        semantic_cache = VibeVoiceTokenizerStreamingCache(batch_size)
+        codecs = self.model if self.onnx_runtime is None else self.onnx_runtime
+
         device = input_ids.device
         finished_tags = torch.zeros(batch_size, dtype=torch.bool, device=device)
-        correct_cnt = torch.zeros(batch_size, dtype=torch.long, device=device)
-        is_prefill = True
+        refresh_negative = kwargs.get('refresh_negative', True)
+        stop_check_interval = max(int(kwargs.get('stop_check_interval', 1)), 1)
+
+        # The negative (CFG) sequences start from a lone speech_start token. Its hidden state
+        # conditions the first diffusion step; afterwards a row is only extended (with the
+        # positive input of that step) on the steps where its sample runs diffusion. Samples
+        # that do not diffuse right after the prompt drop it again, so that, as with a lazily
+        # built negative sequence, their first diffusion step starts the sequence.
+        all_rows = list(range(batch_size))
+        negative_cache = negative_hidden = None
+        if use_cfg:
+            negative_cache = VibeVoiceNegativeCache(batch_size)
+            negative_hidden = self._forward_negative(
+                negative_cache, all_rows,
+                input_ids=torch.full((batch_size, 1), generation_config.speech_start_id, dtype=torch.long, device=device),
+            )
+        fused_cfg_state = None
         inputs_embeds = None
         verbose = kwargs.get("verbose", False)
 
         # Initialize audio chunks storage for each sample
         audio_chunks = [[] for _ in range(batch_size)]
+        # denoising steps and speech frames of every sample, on the CPU
+        diffusion_steps = torch.zeros(batch_size, dtype=torch.long)
+        diffusion_frames = torch.zeros(batch_size, dtype=torch.long)
+        # last speech latent of every sample and whether it belongs to the current speech segment, for `warm_start`
+        previous_latent = None
+        has_previous_latent = torch.zeros(batch_size, dtype=torch.bool)
 
         initial_length = input_ids.shape[-1]
-        initial_length_per_sample = model_kwargs['attention_mask'].sum(dim=-1)
+        attention_mask = model_kwargs['attention_mask']
+        initial_length_per_sample = attention_mask.sum(dim=-1)
 
        # Define all valid tokens that can be generated
         valid_tokens = [
@@ -411,16 +1069,49 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
         if hasattr(generation_config, 'bos_token_id') and generation_config.bos_token_id is not None:
             valid_tokens.append(generation_config.bos_token_id)
         
-        # Add custom processor to constrain token generation
-        token_constraint_processor = VibeVoiceTokenConstraintProcessor(valid_tokens, device=device)
         if logits_processor is None:
             logits_processor = LogitsProcessorList()
-        logits_processor.append(token_constraint_processor)
+        if restrict_vocab:
+            # Project onto the valid rows of lm_head only. They are kept in vocabulary order
+            # so that greedy ties resolve to the same token as with the full projection.
+            valid_token_ids = torch.tensor(sorted(set(valid_tokens)), dtype=torch.long, device=device)
+        else:
+            # Add custom processor to constrain token generation
+            valid_token_ids = None
+            token_constraint_processor = VibeVoiceTokenConstraintProcessor(valid_tokens, device=device)
+            logits_processor.append(token_constraint_processor)
         
         max_steps = min(generation_config.max_length - initial_length, int(max_length_times * initial_length))
         max_step_per_sample = torch.min(generation_config.max_length - initial_length_per_sample, (max_length_times * initial_length_per_sample).long())
         reach_max_step_sample = torch.zeros(batch_size, dtype=torch.bool, device=device)
 
+        # The decode loop keeps its state in preallocated buffers (token ids, attention mask, cache
+        # positions) and calls the model directly instead of going through
+        # `prepare_inputs_for_generation` / `_update_model_kwargs_for_generation`. The sampled
+        # tokens are copied to the host once per step and every other decision is taken from
+        # that copy, so the step does not synchronize on device-side checks.
+        total_length = initial_length + max(max_steps, 0)
+        sequences = input_ids.new_zeros((batch_size, total_length))
+        sequences[:, :initial_length] = input_ids
+        attention_mask_buffer = attention_mask.new_zeros((batch_size, total_length))
+        attention_mask_buffer[:, :initial_length] = attention_mask
+        cache_positions = torch.arange(total_length, device=device)
+        past_key_values = model_kwargs['past_key_values']
+        cur_length = initial_length
+        # the prefix cache lays the prompt out over more KV columns than `input_ids` has
+        kv_offset = 0
+        if kv_window is not None:
+            # trim the caches in blocks so that the copies are amortized over several steps
+            kv_evict_block = max(kv_window // 8, 1)
+
+        finished = [False] * batch_size
+        max_step_list = max_step_per_sample.tolist()
+        eos_token_id = generation_config.eos_token_id
+        speech_start_id = generation_config.speech_start_id
+        speech_end_id = generation_config.speech_end_id
+        speech_diffusion_id = generation_config.speech_diffusion_id
+        active_samples = None
+
         # Create progress iterator if verbose
         if kwargs.get("show_progress_bar", True):
             progress_bar = tqdm(range(max_steps), desc="Generating", leave=False)
@@ -428,64 +1119,121 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
             progress_bar = range(max_steps)
         
         for step in progress_bar:
-            # Check for external stop signal
-            if stop_check_fn is not None and stop_check_fn():
-                if verbose:
-                    print(f"Generation stopped externally at step {step + 1}")
-                # End the audio streamer if it exists
-                if audio_streamer is not None:
-                    audio_streamer.end()
-                break
-            
-            # Check if audio_streamer has been ended (stopped externally)
-            if audio_streamer is not None and hasattr(audio_streamer, 'finished_flags'):
-                if any(audio_streamer.finished_flags):
+            if step % stop_check_interval == 0:
+                # Check for external stop signal
+                if stop_check_fn is not None and stop_check_fn():
                     if verbose:
-                        print(f"Audio generation stopped externally at step {step + 1}")
+                        print(f"Generation stopped externally at step {step + 1}")
+                    # End the audio streamer if it exists
+                    if audio_streamer is not None:
+                        audio_streamer.end()
                     break
+                
+                # Check if audio_streamer has been ended (stopped externally)
+                if audio_streamer is not None and hasattr(audio_streamer, 'finished_flags'):
+                    if any(audio_streamer.finished_flags):
+                        if verbose:
+                            print(f"Audio generation stopped externally at step {step + 1}")
+                        break
             
-            if finished_tags.all():
+            if all(finished):
                 if hasattr(progress_bar, 'set_description'):
                     progress_bar.set_description("Generation complete")
                 break
 
-            if input_ids.shape[-1] >= generation_config.max_length:
+            if cur_length >= generation_config.max_length:
                 print(f"Reached maximum generation length {generation_config.max_length}, stopped it.")
-                reached_samples = torch.arange(batch_size, device=device)[~finished_tags]
-                if reached_samples.numel() > 0:
+                reached_samples = [i for i in all_rows if not finished[i]]
+                if len(reached_samples) > 0:
                     reach_max_step_sample[reached_samples] = True
                 break
             
             # Update progress bar description with active samples
-            if hasattr(progress_bar, 'set_description'):
-                active_samples = (~finished_tags).sum().item()
+            if hasattr(progress_bar, 'set_description') and active_samples != batch_size - sum(finished):
+                active_samples = batch_size - sum(finished)
                 progress_bar.set_description(f"Generating (active: {active_samples}/{batch_size})")
 
-            model_inputs = self.prepare_inputs_for_generation(input_ids, **model_kwargs)
-            if is_prefill:
+            fused_forward = fused_cfg_state is not None
+            if fused_forward:
+                # Positive and negative rows share one forward pass
+                outputs, negative_hidden = self._forward_fused_cfg(fused_cfg_state, inputs_embeds, valid_token_ids)
+            elif step == 0:
                 # we process the speech inputs only during the first generation step
-                prefill_inputs = {
-                    "speech_tensors": speech_tensors.to(device=device),
-                    "speech_masks": speech_masks.to(device),
-                    "speech_input_mask": speech_input_mask.to(device),
-                }
-                is_prefill = False
+                prefill_inputs = {}
+                if speech_tensors is not None:
+                    prefill_inputs = {
+                        "speech_tensors": speech_tensors.to(device=device),
+                        "speech_masks": speech_masks.to(device),
+                        "speech_input_mask": speech_input_mask.to(device),
+                        "speech_type": speech_type,
+                    }
+                if prefix_cache is not None:
+                    outputs, past_key_values, kv_attention_mask = self._prefill_with_prefix_cache(
+                        prefix_cache, input_ids, attention_mask, voice_prompt_lengths,
+                        **prefill_inputs, lm_head_indices=valid_token_ids, prefill_chunk_size=prefill_chunk_size,
+                    )
+                    kv_offset = kv_attention_mask.shape[1] - initial_length
+                    attention_mask_buffer = kv_attention_mask.new_zeros((batch_size, total_length + kv_offset))
+                    attention_mask_buffer[:, :kv_attention_mask.shape[1]] = kv_attention_mask
+                    cache_positions = torch.arange(total_length + kv_offset, device=device)
+                elif prefill_chunk_size is not None:
+                    position_ids = attention_mask.long().cumsum(-1) - 1
+                    position_ids.masked_fill_(attention_mask == 0, 1)
+                    speech_embeds = None
+                    if speech_tensors is not None:
+                        speech_embeds = self._process_speech_inputs(
+                            prefill_inputs["speech_tensors"].to(self.dtype), prefill_inputs["speech_masks"], speech_type=speech_type,
+                        )[1]
+                    outputs = self._chunked_prefill(
+                        input_ids, attention_mask, position_ids, past_key_values, chunk_size=prefill_chunk_size,
+                        speech_embeds=speech_embeds, speech_input_mask=prefill_inputs.get("speech_input_mask"),
+                        lm_head_indices=valid_token_ids,
+                    )
+                    kv_attention_mask = attention_mask
+                else:
+                    position_ids = attention_mask.long().cumsum(-1) - 1
+                    position_ids.masked_fill_(attention_mask == 0, 1)
+                    outputs = self(
+                        input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids,
+                        past_key_values=past_key_values, use_cache=True, cache_position=cache_positions[:initial_length],
+                        **prefill_inputs, logits_to_keep=1, lm_head_indices=valid_token_ids,
+                        return_dict=True, output_attentions=False, output_hidden_states=False,
+                    )
+                    kv_attention_mask = attention_mask
+                next_position_ids = initial_length_per_sample.clone()
+                prompt_kv_length = kv_attention_mask.shape[1]
+                if fuse_negative:
+                    # From the next step on, the negative rows ride along in the positive forward
+                    fused_cfg_state = self._init_fused_cfg_state(past_key_values, kv_attention_mask, negative_cache)
             else:
-                _ = model_inputs.pop('inputs_embeds', None)
-                prefill_inputs = {'inputs_embeds': inputs_embeds}
-
-            # Forward pass through the model
-            outputs = self(
-                **model_inputs, **prefill_inputs, logits_to_keep=1, return_dict=True, output_attentions=False, output_hidden_states=False,
-            )
-            model_kwargs = self._update_model_kwargs_for_generation(
-                outputs, model_kwargs, is_encoder_decoder=False,
-            )
+                kv_length = cur_length + kv_offset
+                if kv_window is not None and kv_length - 1 - prompt_kv_length - kv_window >= kv_evict_block:
+                    # Evict the oldest generated frames. The kept keys carry the rotary embedding of
+                    # their original positions and new tokens continue from `next_position_ids`,
+                    # so relative positions are unchanged.
+                    evict_count = kv_length - 1 - prompt_kv_length - kv_window
+                    self._evict_kv_columns(past_key_values, attention_mask_buffer, prompt_kv_length, evict_count, kv_length - 1)
+                    kv_offset -= evict_count
+                    kv_length -= evict_count
+                attention_mask_buffer[:, kv_length - 1] = 1
+                outputs = self(
+                    inputs_embeds=inputs_embeds, attention_mask=attention_mask_buffer[:, :kv_length],
+                    position_ids=next_position_ids[:, None], past_key_values=past_key_values, use_cache=True,
+                    cache_position=cache_positions[kv_length - 1:kv_length], logits_to_keep=1, lm_head_indices=valid_token_ids,
+                    return_dict=True, output_attentions=False, output_hidden_states=False,
+                )
+                next_position_ids += 1
 
             # Get logits and apply logits processor
             next_token_logits = outputs.logits[:, -1, :].to(copy=True, dtype=torch.float32, device=input_ids.device)
             # next_token_logits = outputs.logits[:, -1, :].to(copy=True, device=input_ids.device)
-            next_token_scores = logits_processor(input_ids, next_token_logits)
+            restricted_scores = valid_token_ids is not None and len(logits_processor) == 0
+            if valid_token_ids is not None and not restricted_scores:
+                # generic logits processors work on full-vocabulary scores
+                full_token_logits = next_token_logits.new_full((batch_size, self.lm_head.weight.shape[0]), float('-inf'))
+                full_token_logits[:, valid_token_ids] = next_token_logits
+                next_token_logits = full_token_logits
+            next_token_scores = logits_processor(sequences[:, :cur_length], next_token_logits)
             
             # token selection
             if generation_config.do_sample:
@@ -494,73 +1242,65 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
                 next_tokens = torch.multinomial(probs, num_samples=1).squeeze(1)
             else:
                 next_tokens = torch.argmax(next_token_scores, dim=-1)
+            if restricted_scores:
+                next_tokens = valid_token_ids[next_tokens]
 
-            next_tokens[finished_tags] = generation_config.eos_token_id
-            input_ids = torch.cat([input_ids, next_tokens[:, None]], dim=-1)
+            next_tokens.masked_fill_(finished_tags, eos_token_id)
+            sequences[:, cur_length] = next_tokens
+            cur_length += 1
+            # the only device-to-host transfer of the step
+            token_list = next_tokens.tolist()
             
-            if not kwargs.get('refresh_negative', True):
-                negative_model_inputs = self.prepare_inputs_for_generation(negative_input_ids, **negative_model_kwargs)
-                # Forward negative pass through the model
-                if negative_model_inputs['inputs_embeds'] is None and inputs_embeds is not None:
-                    negative_model_inputs['inputs_embeds'] = inputs_embeds
-                    negative_model_inputs['input_ids'] = None
-
-                negative_outputs = self(
-                    **negative_model_inputs, logits_to_keep=0, return_dict=True, output_attentions=False, output_hidden_states=False,
-                )
-                negative_model_kwargs = self._update_model_kwargs_for_generation(
-                    negative_outputs, negative_model_kwargs, is_encoder_decoder=False,
-                )
-                negative_input_ids = torch.cat([negative_input_ids, next_tokens[:, None]], dim=-1)
+            if use_cfg and not refresh_negative and step > 0 and not fused_forward:
+                # every sample extends its negative sequence on every step, without resets
+                negative_hidden = self._forward_negative(negative_cache, all_rows, inputs_embeds=inputs_embeds)
 
             # reached end of generation
-            if (next_tokens == generation_config.eos_token_id).any():
-                eos_indices = (next_tokens == generation_config.eos_token_id).nonzero(as_tuple=False).squeeze(1)
-                # Only print for samples that are newly finished (not already marked as finished)
-                new_eos_indices = eos_indices[~finished_tags[eos_indices]]
-                if new_eos_indices.numel() > 0:
-                    finished_tags[new_eos_indices] = True
-                    if verbose:
-                        print(f"Samples {new_eos_indices.tolist()} reached EOS token at step {step + 1}.", flush=True)
-                    if audio_streamer is not None:
-                        audio_streamer.end(new_eos_indices)
+            new_eos_indices = [i for i in all_rows if token_list[i] == eos_token_id and not finished[i]]
+            if len(new_eos_indices) > 0:
+                for i in new_eos_indices:
+                    finished[i] = True
+                finished_tags[new_eos_indices] = True
+                if verbose:
+                    print(f"Samples {new_eos_indices} reached EOS token at step {step + 1}.", flush=True)
+                if audio_streamer is not None:
+                    audio_streamer.end(torch.tensor(new_eos_indices))
 
             # Check if any sample reached its maximum generation length
-            max_length_reached = step >= max_step_per_sample
-            new_max_length_indices = torch.nonzero(max_length_reached & ~finished_tags, as_tuple=False).squeeze(1)
-            if new_max_length_indices.numel() > 0:
+            new_max_length_indices = [i for i in all_rows if step >= max_step_list[i] and not finished[i]]
+            if len(new_max_length_indices) > 0:
+                for i in new_max_length_indices:
+                    finished[i] = True
                 finished_tags[new_max_length_indices] = True
                 reach_max_step_sample[new_max_length_indices] = True
                 if verbose:
-                    print(f"Samples {new_max_length_indices.tolist()} reached max generation length at step {step + 1}.", flush=True)
+                    print(f"Samples {new_max_length_indices} reached max generation length at step {step + 1}.", flush=True)
                 if audio_streamer is not None:
-                    audio_streamer.end(new_max_length_indices)
+                    audio_streamer.end(torch.tensor(new_max_length_indices))
 
             # speech_end
-            diffusion_end_indices = (next_tokens == generation_config.speech_end_id).nonzero(as_tuple=False).squeeze(1)
-            if diffusion_end_indices.numel() > 0:
+            diffusion_end_indices = [i for i in all_rows if token_list[i] == speech_end_id]
+            if len(diffusion_end_indices) > 0:
                 # Clear tokenizer caches for samples that reached speech end
-                acoustic_cache.set_to_zero(diffusion_end_indices)
-                semantic_cache.set_to_zero(diffusion_end_indices)
+                acoustic_cache.set_to_zero(torch.tensor(diffusion_end_indices))
+                semantic_cache.set_to_zero(torch.tensor(diffusion_end_indices))
+                has_previous_latent[diffusion_end_indices] = False
             
             # speech_begin
-            diffusion_start_indices = torch.arange(batch_size, device=device)[~finished_tags & (next_tokens == generation_config.speech_start_id)]
-            if diffusion_start_indices.numel() > 0 and kwargs.get('refresh_negative', True):
-                # update attention mask
-                for i, sample_idx in enumerate(diffusion_start_indices.tolist()):
-                    negative_model_kwargs['attention_mask'][sample_idx, :] = 0
-                    negative_model_kwargs['attention_mask'][sample_idx, -1] = 1
-                # update past key values
-                for layer_idx, (k_cache, v_cache) in enumerate(zip(negative_model_kwargs['past_key_values'].key_cache, 
-                                                                        negative_model_kwargs['past_key_values'].value_cache)):
-                    # Process each non-diffusion sample
-                    for sample_idx in diffusion_start_indices.tolist():
-                        # Shift cache for this sample
-                        k_cache[sample_idx, :, -1, :] = k_cache[sample_idx, :, 0, :].clone()
-                        v_cache[sample_idx, :, -1, :] = v_cache[sample_idx, :, 0, :].clone()
-                # update negative_input_ids
-                for sample_idx in diffusion_start_indices.tolist():
-                    negative_input_ids[sample_idx, -1] = generation_config.speech_start_id
+            diffusion_start_indices = [i for i in all_rows if token_list[i] == speech_start_id and not finished[i]]
+            if len(diffusion_start_indices) > 0 and refresh_negative and use_cfg:
+                # restart the negative sequence of these samples from speech_start
+                if fused_cfg_state is not None:
+                    self._reset_fused_cfg(fused_cfg_state, torch.tensor(diffusion_start_indices, device=device))
+                else:
+                    negative_cache.reset_rows(diffusion_start_indices)
+            if step == 0 and refresh_negative and use_cfg:
+                idle_rows = [i for i in all_rows if token_list[i] != speech_diffusion_id]
+                if len(idle_rows) > 0:
+                    if fused_cfg_state is not None:
+                        self._discard_fused_cfg(fused_cfg_state, torch.tensor(idle_rows, device=device))
+                    else:
+                        negative_cache.discard_rows(idle_rows)
             
             # Prepare inputs_embeds for next iteration
             # Initialize with default embeddings for all tokens
@@ -568,84 +1308,63 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
             
             # forward diffusion
             # Diffusion indices are those that are not finished and not special tokens
-            diffusion_indices = torch.arange(batch_size, device=device)[~finished_tags & (next_tokens == generation_config.speech_diffusion_id)]
+            diffusion_list = [i for i in all_rows if token_list[i] == speech_diffusion_id and not finished[i]]
+
+            if fused_forward and refresh_negative:
+                # keep the speculative negative entry only for the samples that run diffusion
+                rollback_rows = [
+                    i for i in all_rows if token_list[i] != speech_diffusion_id and i not in diffusion_start_indices
+                ]
+                if len(rollback_rows) > 0:
+                    self._rollback_fused_cfg(fused_cfg_state, torch.tensor(rollback_rows, device=device))
             
-            if diffusion_indices.numel() > 0:
-                if kwargs.get('refresh_negative', True):
-                    negative_model_inputs = self.prepare_inputs_for_generation(negative_input_ids, **negative_model_kwargs)
-                    # Forward negative pass through the model
-                    if negative_model_inputs['inputs_embeds'] is None and inputs_embeds is not None:
-                        negative_model_inputs['inputs_embeds'] = inputs_embeds
-                        negative_model_inputs['input_ids'] = None
-
-                    negative_outputs = self(
-                        **negative_model_inputs, logits_to_keep=0, return_dict=True, output_attentions=False, output_hidden_states=False,
-                    )
-                    negative_model_kwargs = self._update_model_kwargs_for_generation(
-                        negative_outputs, negative_model_kwargs, is_encoder_decoder=False,
+            if len(diffusion_list) > 0:
+                diffusion_indices = torch.tensor(diffusion_list, device=device)
+                if use_cfg and refresh_negative and step > 0 and not fused_forward:
+                    # only the diffusing samples extend their negative sequence
+                    negative_hidden[diffusion_indices] = self._forward_negative(
+                        negative_cache, diffusion_list, inputs_embeds=inputs_embeds[diffusion_indices],
                     )
-                    negative_input_ids = torch.cat([negative_input_ids, next_tokens[:, None]], dim=-1)
-                # correct the non-diffusion indices
-                # we forward all samples' negative outputs even if 
-                #   they are not in diffusion mode to keep the cache consistent
-                # So we need to correct the kv cache of non-diffusion samples
-                non_diffusion_mask = ~finished_tags & (next_tokens != generation_config.speech_diffusion_id)
-                if non_diffusion_mask.any():
-                    non_diffusion_indices = torch.arange(batch_size, device=device)[non_diffusion_mask]
-                    start_indices = correct_cnt[non_diffusion_indices]
-
-                    # 1. Update attention_mask - need to handle each sample separately
-                    seq_len = negative_model_kwargs['attention_mask'].shape[1]
-                    for i, (sample_idx, start_idx) in enumerate(zip(non_diffusion_indices.tolist(), start_indices.tolist())):
-                        # Shift the attention mask for this sample
-                        if start_idx + 1 < seq_len - 1:
-                            negative_model_kwargs['attention_mask'][sample_idx, start_idx+1:] = \
-                                negative_model_kwargs['attention_mask'][sample_idx, start_idx:-1].clone()
-                        negative_model_kwargs['attention_mask'][sample_idx, start_idx] = 0
-
-                    # 2. Update past_key_values
-                    for layer_idx, (k_cache, v_cache) in enumerate(zip(negative_model_kwargs['past_key_values'].key_cache, 
-                                                                        negative_model_kwargs['past_key_values'].value_cache)):
-                        # Process each non-diffusion sample
-                        for sample_idx, start_idx in zip(non_diffusion_indices.tolist(), start_indices.tolist()):
-                            if start_idx + 1 < k_cache.shape[2] - 1:
-                                # Shift cache for this sample
-                                k_cache[sample_idx, :, start_idx+1:, :] = k_cache[sample_idx, :, start_idx:-1, :].clone()
-                                v_cache[sample_idx, :, start_idx+1:, :] = v_cache[sample_idx, :, start_idx:-1, :].clone()
-                    
-                    # 3. Update negative_input_ids
-                    for sample_idx, start_idx in zip(non_diffusion_indices.tolist(), start_indices.tolist()):
-                        if start_idx + 1 < negative_input_ids.shape[1] - 1:
-                            negative_input_ids[sample_idx, start_idx+1:] = \
-                                negative_input_ids[sample_idx, start_idx:-1].clone()
-                                
-                    correct_cnt[non_diffusion_indices] += 1
+                elif fused_forward and refresh_negative:
+                    fused_cfg_state["started"][diffusion_indices] = True
 
                 positive_condition = outputs.last_hidden_state[diffusion_indices, -1, :]
-                negative_condition = negative_outputs.last_hidden_state[diffusion_indices, -1, :]
+                negative_condition = negative_hidden[diffusion_indices] if use_cfg else None
                 
-                speech_latent = self.sample_speech_tokens(
+                warm = has_previous_latent[diffusion_list] if warm_start is not None else None
+                speech_latent, num_steps = self._sample_speech_tokens_warm(
                     positive_condition,
                     negative_condition,
+                    previous_latent[diffusion_indices.to(previous_latent.device)] if warm is not None and warm.any() else None,
+                    warm,
+                    warm_start=warm_start,
                     cfg_scale=cfg_scale,
-                ).unsqueeze(1)
+                    guidance_interval=guidance_interval,
+                    sampler=sampler,
+                    early_exit_tolerance=early_exit_tolerance,
+                )
+                if warm_start is not None:
+                    if previous_latent is None:
+                        previous_latent = speech_latent.new_zeros(batch_size, speech_latent.shape[-1])
+                    previous_latent[diffusion_indices.to(previous_latent.device)] = speech_latent
+                    has_previous_latent[diffusion_list] = True
+                speech_latent = speech_latent.unsqueeze(1)
+                diffusion_steps[diffusion_list] += num_steps
+                diffusion_frames[diffusion_list] += 1
                                 
                 # Decode acoustic latent to audio using acoustic streaming cache
                 scaled_latent = speech_latent / self.model.speech_scaling_factor.to(speech_latent.device) - self.model.speech_bias_factor.to(speech_latent.device)
-                audio_chunk = self.model.acoustic_tokenizer.decode(
-                    scaled_latent.to(self.model.acoustic_tokenizer.device),
+                audio_chunk = codecs.acoustic_tokenizer.decode(
+                    scaled_latent.to(codecs.acoustic_tokenizer.device),
                     cache=acoustic_cache,  # Use acoustic-specific cache
-                    sample_indices=diffusion_indices.to(self.model.acoustic_tokenizer.device),
+                    sample_indices=diffusion_indices.to(codecs.acoustic_tokenizer.device),
                     use_cache=True,
                     debug=False
                 )
                 
                 # Store audio chunks for each sample
-                for i, sample_idx in enumerate(diffusion_indices):
-                    idx = sample_idx.item()
-                    # Only append audio chunk if the sample is not finished
-                    if not finished_tags[idx]:
-                        audio_chunks[idx].append(audio_chunk[i])
+                for i, idx in enumerate(diffusion_list):
+                    audio_chunks[idx].append(audio_chunk[i] if kv_window is None else audio_chunk[i].cpu())
 
                  # Add streaming support here
                 if audio_streamer is not None:
@@ -653,7 +1372,7 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
                     audio_streamer.put(audio_chunk, diffusion_indices)
                     
                 # Encode audio to semantic features using semantic streaming cache
-                semantic_features = self.model.semantic_tokenizer.encode(
+                semantic_features = codecs.semantic_tokenizer.encode(
                     audio_chunk,
                     cache=semantic_cache,  # Use semantic-specific cache
                     sample_indices=diffusion_indices,
@@ -671,10 +1390,14 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
             
             # Set inputs_embeds for next iteration
             inputs_embeds = next_inputs_embeds
+            if kv_window is not None and use_cfg:
+                negative_cache.evict(kv_window, kv_evict_block)
 
         if audio_streamer is not None:
             audio_streamer.end()
 
+        input_ids = sequences[:, :cur_length]
+
         # Concatenate audio chunks for each sample
         final_audio_outputs = []
         for sample_chunks in audio_chunks:
@@ -686,27 +1409,194 @@ class VibeVoiceForConditionalGenerationInference(VibeVoicePreTrainedModel, Gener
                 # If no audio was generated for this sample, append None
                 final_audio_outputs.append(None)
 
+        diffusion_steps_per_frame = diffusion_steps / diffusion_frames.clamp_min(1)
+        if verbose and early_exit_tolerance is not None:
+            print(f"Mean diffusion steps per frame: {diffusion_steps.sum().item() / max(diffusion_frames.sum().item(), 1):.2f}")
+
         return VibeVoiceGenerationOutput(
             sequences=input_ids,
             speech_outputs=final_audio_outputs if return_speech else None,
             reach_max_step_sample=reach_max_step_sample,
+            diffusion_steps_per_frame=diffusion_steps_per_frame,
         )
     
     @torch.no_grad()
-    def sample_speech_tokens(self, condition, neg_condition, cfg_scale=3.0):
-        self.model.noise_scheduler.set_timesteps(self.ddpm_inference_steps)
-        condition = torch.cat([condition, neg_condition], dim=0).to(self.model.prediction_head.device)
-        speech = torch.randn(condition.shape[0], self.config.acoustic_vae_dim).to(condition)
-        for t in self.model.noise_scheduler.timesteps:
-            half = speech[: len(speech) // 2]
-            combined = torch.cat([half, half], dim=0)
-            eps = self.model.prediction_head(combined, t.repeat(combined.shape[0]).to(combined), condition=condition)
-            cond_eps, uncond_eps = torch.split(eps, len(eps) // 2, dim=0)
-            half_eps = uncond_eps + cfg_scale * (cond_eps - uncond_eps)
-            eps = torch.cat([half_eps, half_eps], dim=0)
-            speech = self.model.noise_scheduler.step(eps, t, speech).prev_sample
-        return speech[: len(speech) // 2]
-    
+    def sample_speech_tokens(
+        self, condition, neg_condition, cfg_scale=3.0, guidance_interval=None, sampler=None,
+        early_exit_tolerance=None, return_num_steps=False, init_latent=None, warm_start=1.0, noise=None,
+    ):
+        """
+        Sample one speech latent per row of `condition`, with classifier-free guidance against `neg_condition`.
+
+        Guidance is off when `neg_condition` is None or `cfg_scale` is 1.0; the diffusion head then only runs on
+        the conditional batch. `guidance_interval=(start, end)` only runs the unconditional batch on the steps
+        whose fraction of the schedule lies in `[start, end)`; the other steps guide with the last unconditional
+        prediction, or not at all before the first guided step. `sampler` selects the solver by name (see
+        `get_noise_sampler`); by default the model's `noise_scheduler` is used.
+
+        With `early_exit_tolerance`, a row stops denoising once the RMS change of its predicted clean latent
+        between two consecutive steps, relative to the RMS of the prediction, falls below the tolerance; its
+        latent is then that prediction, and the converged rows are dropped from the batch of the following
+        steps. This reads the convergence mask back on every step, and always runs eagerly; otherwise the loop
+        goes through `compiled_denoiser` when one is set, unless the head runs on the `onnx_runtime`.
+        `return_num_steps=True` additionally returns the number of denoising steps each row took, as a CPU
+        `LongTensor`.
+
+        Warm start: with `init_latent` (e.g. the previous frame's latents), sampling starts SDEdit-style from
+        `init_latent` noised to the step at which the last `warm_start` fraction of the schedule begins, and only
+        runs those remaining steps.
+
+        `noise` replaces the initial noise of the rows. With a `diffusion_batcher` set, the call is merged with
+        those of concurrent generations and runs in the batcher's worker thread.
+        """
+        batcher = self.diffusion_batcher
+        if batcher is not None and not batcher.owns_current_thread():
+            return batcher.submit(
+                condition, neg_condition, cfg_scale=cfg_scale, noise=noise, init_latent=init_latent,
+                return_num_steps=return_num_steps, guidance_interval=guidance_interval, sampler=sampler,
+                early_exit_tolerance=early_exit_tolerance, warm_start=warm_start,
+            )
+        # the schedule is shared and cached with all solver coefficients tabulated, the solver state is
+        # local to this call, so concurrent generations on one model do not interfere and no frame
+        # recomputes the sigma tables or the per-step coefficients
+        noise_scheduler = self.get_noise_sampler(sampler)
+        start_index = 0
+        if init_latent is not None:
+            if not 0.0 < warm_start <= 1.0:
+                raise ValueError(f"`warm_start` must be in (0, 1], got {warm_start}")
+            start_index = self.ddpm_inference_steps - max(round(warm_start * self.ddpm_inference_steps), 1)
+        if noise_scheduler.config.thresholding:
+            schedule = noise_scheduler.get_schedule(self.ddpm_inference_steps, start_index=start_index)
+        else:
+            schedule = noise_scheduler.compile_schedule(self.ddpm_inference_steps, start_index=start_index)
+        solver_state = noise_scheduler.init_state(schedule)
+        num_steps = len(schedule.timesteps)
+        prediction_head = self.model.prediction_head if self.onnx_runtime is None else self.onnx_runtime.prediction_head
+
+        batch_size = condition.shape[0]
+        guidance = neg_condition is not None and not (isinstance(cfg_scale, (int, float)) and cfg_scale == 1.0)
+        if guidance:
+            # the interval is a fraction of the full schedule, also when warm starting part way into it
+            guided_steps = self._guided_steps(self.ddpm_inference_steps, guidance_interval)[start_index:]
+        else:
+            guided_steps = [False] * num_steps
+        if guidance:
+            condition = torch.cat([condition, neg_condition], dim=0)
+        condition = condition.to(prediction_head.device)
+        # the noise is drawn for the conditional and unconditional rows either way, so a seed gives
+        # the same initial latents with and without guidance
+        if noise is None:
+            speech = torch.randn(2 * batch_size, self.config.acoustic_vae_dim).to(condition)[:batch_size]
+        else:
+            speech = noise.to(condition)
+        if init_latent is not None:
+            speech = noise_scheduler.noise_to_step(schedule, init_latent.to(speech), speech)
+        # both are constant over the inner steps of a frame
+        timestep_embeddings = prediction_head.get_timestep_embeddings(schedule.timesteps)
+        projected_condition = prediction_head.cond_proj(condition)
+        num_steps_taken = torch.full((batch_size,), num_steps, dtype=torch.long)
+        # the compiled loop traces the PyTorch head, not the ONNX Runtime one
+        use_compiled = self.compiled_denoiser is not None and prediction_head is self.model.prediction_head
+        if use_compiled and early_exit_tolerance is None:
+            denoised = self.compiled_denoiser(
+                noise_scheduler, schedule, guided_steps, speech, timestep_embeddings, projected_condition,
+                cfg_scale, prediction_head,
+            )
+            if denoised is not None:
+                return (denoised, num_steps_taken) if return_num_steps else denoised
+        if early_exit_tolerance is not None:
+            # rows of the batch still being denoised, and the latents of the converged ones
+            active = torch.arange(batch_size, device=speech.device)
+            result = torch.empty_like(speech)
+            last_x0 = None
+        uncond_eps = None
+        for step_index in range(num_steps):
+            num_active = speech.shape[0]
+            if guided_steps[step_index]:
+                combined = torch.cat([speech, speech], dim=0)
+                eps = prediction_head.denoise(combined, timestep_embeddings[step_index], projected_condition)
+                cond_eps, uncond_eps = torch.split(eps, num_active, dim=0)
+            else:
+                cond_eps = prediction_head.denoise(
+                    speech, timestep_embeddings[step_index], projected_condition[:num_active]
+                )
+            eps = cond_eps if uncond_eps is None else uncond_eps + cfg_scale * (cond_eps - uncond_eps)
+            if early_exit_tolerance is None or step_index == num_steps - 1:
+                speech = noise_scheduler.step_with_state(solver_state, eps, speech)
+                continue
+
+            x0 = noise_scheduler.predict_original_sample(schedule, step_index, eps, speech)
+            speech = noise_scheduler.step_with_state(solver_state, eps, speech)
+            if last_x0 is not None:
+                change = (x0 - last_x0).pow(2).mean(dim=-1) / x0.pow(2).mean(dim=-1).clamp_min(1e-12)
+                converged = change < early_exit_tolerance**2
+                if converged.any():
+                    done, keep = converged.nonzero().squeeze(1), (~converged).nonzero().squeeze(1)
+                    result[active[done]] = x0[done].to(result.dtype)
+                    num_steps_taken[active[done].cpu()] = step_index + 1
+                    if keep.numel() == 0:
+                        return (result, num_steps_taken) if return_num_steps else result
+                    active, speech, x0 = active[keep], speech[keep], x0[keep]
+                    if guidance:
+                        projected_condition = torch.cat([
+                            projected_condition[:num_active][keep], projected_condition[num_active:][keep]
+                        ])
+                    else:
+                        projected_condition = projected_condition[keep]
+                    if uncond_eps is not None:
+                        uncond_eps = uncond_eps[keep]
+                    if isinstance(cfg_scale, torch.Tensor) and cfg_scale.dim() > 0:
+                        cfg_scale = cfg_scale[keep]
+                    solver_state.model_outputs = [
+                        None if output is None else output[keep] for output in solver_state.model_outputs
+                    ]
+                    if solver_state.last_sample is not None:
+                        solver_state.last_sample = solver_state.last_sample[keep]
+            last_x0 = x0
+        if early_exit_tolerance is not None:
+            result[active] = speech.to(result.dtype)
+            speech = result
+        return (speech, num_steps_taken) if return_num_steps else speech
+
+    def _sample_speech_tokens_warm(self, condition, neg_condition, init_latent, warm, warm_start=None, **kwargs):
+        """
+        `sample_speech_tokens` with `return_num_steps=True` where only the rows flagged in `warm` (a CPU bool
+        tensor, or None for no row) warm start from `init_latent`. The warm and the cold rows run different parts
+        of the schedule, so they are sampled as two batches and put back in row order.
+        """
+        if warm is None or not warm.any():
+            return self.sample_speech_tokens(condition, neg_condition, return_num_steps=True, **kwargs)
+        if warm.all():
+            return self.sample_speech_tokens(
+                condition, neg_condition, init_latent=init_latent, warm_start=warm_start, return_num_steps=True, **kwargs,
+            )
+        latents, steps, order = [], [], []
+        for rows, group_init in ((warm.nonzero().squeeze(1), init_latent), ((~warm).nonzero().squeeze(1), None)):
+            index = rows.to(condition.device)
+            latent, num_steps = self.sample_speech_tokens(
+                condition[index],
+                neg_condition[index] if neg_condition is not None else None,
+                init_latent=group_init[rows.to(group_init.device)] if group_init is not None else None,
+                warm_start=warm_start if group_init is not None else 1.0,
+                return_num_steps=True,
+                **kwargs,
+            )
+            latents.append(latent)
+            steps.append(num_steps)
+            order.append(rows)
+        inverse = torch.cat(order).argsort()
+        return torch.cat(latents)[inverse.to(latents[0].device)], torch.cat(steps)[inverse]
+
+    @staticmethod
+    def _guided_steps(num_steps, guidance_interval=None):
+        """Which of `num_steps` denoising steps run the unconditional batch for `guidance_interval`."""
+        if guidance_interval is None:
+            return [True] * num_steps
+        start, end = guidance_interval
+        if not 0.0 <= start < end <= 1.0:
+            raise ValueError(f"`guidance_interval` must satisfy 0 <= start < end <= 1, got {guidance_interval}")
+        return [start <= step / num_steps < end for step in range(num_steps)]
+
 
 AutoModelForCausalLM.register(VibeVoiceConfig, VibeVoiceForConditionalGenerationInference)
 
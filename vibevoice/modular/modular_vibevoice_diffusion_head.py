@@ -237,6 +237,10 @@ class VibeVoiceDiffusionHead(PreTrainedModel):
         
         self.initialize_weights()
 
+        # timestep embeddings per schedule, see `get_timestep_embeddings`
+        self._timestep_embedding_cache = {}
+        self._timestep_embedding_signature = None
+
     def initialize_weights(self):
         """Initialize the weights of the model."""
         # Initialize timestep embedder
@@ -268,17 +272,64 @@ class VibeVoiceDiffusionHead(PreTrainedModel):
         Returns:
             `torch.Tensor`: The predicted noise/velocity
         """
-        x = self.noisy_images_proj(noisy_images)
         t = self.t_embedder(timesteps)
         condition = self.cond_proj(condition)
-        c = condition + t
-        
+        return self.denoise(noisy_images, t, condition)
+
+    def denoise(self, noisy_images, timestep_embeddings, projected_condition):
+        """
+        `forward` with the timestep embeddings and the condition projection already computed, so a denoising
+        loop can take them out of the loop (see `get_timestep_embeddings` and `cond_proj`).
+
+        Args:
+            noisy_images (`torch.Tensor`): Noisy images/latents to denoise
+            timestep_embeddings (`torch.Tensor`): Output of `t_embedder`, broadcastable to the condition
+            projected_condition (`torch.Tensor`): Output of `cond_proj` for the conditioning information
+
+        Returns:
+            `torch.Tensor`: The predicted noise/velocity
+        """
+        x = self.noisy_images_proj(noisy_images)
+        c = projected_condition + timestep_embeddings
+
         for layer in self.layers:
             x = layer(x, c)
-            
+
         x = self.final_layer(x, c)
         return x
 
+    def _timestep_embedder_signature(self):
+        # changes when the embedder's weights are updated in place (version counter), replaced
+        # (storage) or its modules are swapped, e.g. by quantization
+        return tuple(id(module) for module in self.t_embedder.mlp) + tuple(
+            (p.data_ptr(), p._version) for p in self.t_embedder.parameters()
+        )
+
+    @torch.no_grad()
+    def get_timestep_embeddings(self, timesteps):
+        """
+        `t_embedder` outputs for the timesteps of a denoising schedule, as a `(num_steps, 1, cond_dim)` tensor.
+
+        A schedule only has `num_inference_steps` distinct timesteps and they are the same for every frame, so
+        the embeddings are computed once per schedule and cached. The cache is dropped whenever the embedder
+        weights change; `clear_timestep_embedding_cache` drops it explicitly.
+        """
+        signature = self._timestep_embedder_signature()
+        if signature != self._timestep_embedding_signature:
+            self._timestep_embedding_cache = {}
+            self._timestep_embedding_signature = signature
+        key = (tuple(timesteps.tolist()), str(self.device), self.dtype)
+        embeddings = self._timestep_embedding_cache.get(key)
+        if embeddings is None:
+            # same dtype as `forward` sees when the timesteps are cast like the noisy latents
+            embeddings = self.t_embedder(timesteps.to(self.device, self.dtype))[:, None]
+            self._timestep_embedding_cache[key] = embeddings
+        return embeddings
+
+    def clear_timestep_embedding_cache(self):
+        self._timestep_embedding_cache = {}
+        self._timestep_embedding_signature = None
+
 
 AutoModel.register(VibeVoiceDiffusionHeadConfig, VibeVoiceDiffusionHead)
 
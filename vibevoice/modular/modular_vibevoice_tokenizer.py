@@ -79,14 +79,15 @@ class ConvRMSNorm(RMSNorm):
         super().__init__(dim, eps, elementwise_affine, weight_shape)
 
     def forward(self, x):
-        x = x.transpose(1, 2)  # b ... t -> b t ...
         if (not APEX_AVAILABLE) or (not self.elementwise_affine):
-            # Fallback to native implementation
-            output = self._norm(x.float()).type_as(x)
+            # Fallback to native implementation, normalizing over the channel dimension in place of transposing
+            x_float = x.float()
+            output = (x_float * torch.rsqrt(x_float.pow(2).mean(1, keepdim=True) + self.eps)).type_as(x)
             if self.weight is not None:
-                output = output * self.weight
-        else:
-            output = fused_rms_norm_affine(x, self.weight, self.weight.shape, self.eps)
+                output = output * self.weight.unsqueeze(-1)
+            return output
+        x = x.transpose(1, 2)  # b ... t -> b t ...
+        output = fused_rms_norm_affine(x, self.weight, self.weight.shape, self.eps)
         output = output.transpose(1, 2)  # b t ... -> b ... t
         return output
 
@@ -191,69 +192,93 @@ class NormConvTranspose1d(nn.Module):
 
 
 class VibeVoiceTokenizerStreamingCache:
-    """Cache for streaming convolution, similar to KV cache in attention"""
-    def __init__(self):
-        self.cache = {}  # Dict mapping (layer_id, sample_idx) to state tensor
-        
+    """
+    Cache for streaming convolution, similar to KV cache in attention.
+
+    Every streaming layer gets one preallocated `[capacity, channels, context]` buffer, indexed by
+    sample (slot) index, so reading and updating the states of a batch is one gather and one
+    scatter per layer whatever the batch size, and resetting slots is one fill per layer. The
+    buffers start at zero: a slot without history reads as all-zero context, which gives the
+    same outputs as a fresh stream for the causal convolutions using the cache. States shorter
+    than a layer's buffer are stored right-aligned, zero-padded on the left.
+
+    Args:
+        max_batch_size (`int`, *optional*):
+            Number of slots to preallocate. Buffers grow when a larger sample index shows up.
+    """
+    def __init__(self, max_batch_size: Optional[int] = None):
+        self.capacity = max_batch_size or 1
+        self.cache: Dict[str, torch.Tensor] = {}  # layer_id -> [capacity, channels, context] states
+        # the sample indices of the last call (with their version, which in-place edits bump) and their copies
+        # on the buffer devices; every layer of one encode/decode call gets the same tensor, so its capacity
+        # check and copies happen once per call
+        self._indices = None
+        self._indices_version = None
+        self._indices_on_device: Dict[torch.device, torch.Tensor] = {}
+
+    def _index(self, sample_indices: torch.Tensor, device: torch.device) -> torch.Tensor:
+        """`sample_indices` on `device`, after growing the buffers to fit them. Buffers must be re-read after."""
+        if sample_indices is not self._indices or sample_indices._version != self._indices_version:
+            self._indices = sample_indices
+            self._indices_version = sample_indices._version
+            self._indices_on_device = {}
+            required = int(sample_indices.max()) + 1 if len(sample_indices) > 0 else 0
+            if required > self.capacity:
+                self._grow(max(required, 2 * self.capacity))
+        index = self._indices_on_device.get(device)
+        if index is None:
+            index = self._indices_on_device[device] = sample_indices.to(device=device, dtype=torch.long)
+        return index
+
+    def _grow(self, capacity: int):
+        for layer_id, buffer in self.cache.items():
+            self.cache[layer_id] = torch.cat([buffer, buffer.new_zeros(capacity - buffer.shape[0], *buffer.shape[1:])])
+        self.capacity = capacity
+
     def get(self, layer_id: str, sample_indices: torch.Tensor) -> Optional[torch.Tensor]:
-        """Get cached states for given layer and sample indices"""
-        states = []
-        max_length = 0
-        
-        # First pass: collect states and find max length
-        for idx in sample_indices.tolist():
-            key = (layer_id, idx)
-            if key not in self.cache:
-                return None  # If any sample is missing, return None
-            state = self.cache[key]
-            states.append(state)
-            max_length = max(max_length, state.shape[-1])
-        
-        # Second pass: pad states to max length if needed
-        if len(states) > 0 and states[0].dim() >= 2:
-            padded_states = []
-            for state in states:
-                if state.shape[-1] < max_length:
-                    # Pad on the time dimension (last dimension)
-                    pad_size = max_length - state.shape[-1]
-                    # Pad with zeros on the LEFT to align the most recent samples
-                    padded_state = F.pad(state, (pad_size, 0), mode='constant', value=0)
-                    padded_states.append(padded_state)
-                else:
-                    padded_states.append(state)
-            return torch.stack(padded_states, dim=0)
-        else:
-            return torch.stack(states, dim=0)
-    
+        """Get cached states for given layer and sample indices, None before the layer stored any state"""
+        buffer = self.cache.get(layer_id)
+        if buffer is None:
+            return None
+        index = self._index(sample_indices, buffer.device)
+        return self.cache[layer_id].index_select(0, index)  # re-read, it may have grown
+
     def set(self, layer_id: str, sample_indices: torch.Tensor, states: torch.Tensor):
         """Set cached states for given layer and sample indices"""
-        for i, idx in enumerate(sample_indices.tolist()):
-            key = (layer_id, idx)
-            self.cache[key] = states[i].detach()
+        states = states.detach()
+        buffer = self.cache.get(layer_id)
+        index = self._index(sample_indices, states.device if buffer is None else buffer.device)
+        buffer = self.cache.get(layer_id)  # may have grown
+        if buffer is None:
+            buffer = states.new_zeros(self.capacity, *states.shape[1:])
+        elif states.shape[-1] > buffer.shape[-1]:
+            # only while a layer's history is still shorter than its context
+            buffer = F.pad(buffer, (states.shape[-1] - buffer.shape[-1], 0))
+        self.cache[layer_id] = buffer
+        if states.shape[-1] < buffer.shape[-1]:
+            states = F.pad(states, (buffer.shape[-1] - states.shape[-1], 0))
+        buffer.index_copy_(0, index, states)
 
     def set_to_zero(self, sample_indices: torch.Tensor):
         """Set all cached states to zero for given sample indices"""
-        for key in list(self.cache.keys()):
-            layer_id, sample_idx = key
-            if sample_idx in sample_indices.tolist():
-                # Create zero tensor with same shape and dtype as cached tensor
-                cached_tensor = self.cache[key]
-                self.cache[key] = torch.zeros_like(cached_tensor)
-                
+        for layer_id in list(self.cache):
+            index = self._index(sample_indices, self.cache[layer_id].device)
+            self.cache[layer_id].index_fill_(0, index, 0)
+
     def clear(self, layer_id: Optional[str] = None, sample_indices: Optional[torch.Tensor] = None):
         """Clear cache for specific layer/samples or everything"""
         if layer_id is None and sample_indices is None:
             self.cache.clear()
         elif layer_id is not None and sample_indices is None:
             # Clear all samples for a specific layer
-            keys_to_remove = [k for k in self.cache.keys() if k[0] == layer_id]
-            for k in keys_to_remove:
-                del self.cache[k]
+            self.cache.pop(layer_id, None)
         elif layer_id is not None and sample_indices is not None:
-            # Clear specific samples for a specific layer
-            for idx in sample_indices.tolist():
-                key = (layer_id, idx)
-                self.cache.pop(key, None)
+            # Clear specific samples for a specific layer, which then read as a fresh stream
+            if layer_id in self.cache:
+                index = self._index(sample_indices, self.cache[layer_id].device)
+                self.cache[layer_id].index_fill_(0, index, 0)
+        else:
+            self.set_to_zero(sample_indices)
 
 class SConv1d(nn.Module):
     """Conv1d with built-in handling of asymmetric or causal padding and normalization."""
@@ -330,6 +355,12 @@ class SConv1d(nn.Module):
                           debug: bool = False) -> torch.Tensor:
         """Streaming forward pass with cache operations kept separate from compiled code"""
         B, C, T = x.shape
+
+        # A chunk that is not a multiple of the stride ends the stream: its right is zero-padded like the
+        # extra padding of the non-streaming pass, so the last frames are the same
+        extra_padding = (-T) % self.stride
+        if extra_padding > 0:
+            x = F.pad(x, (0, extra_padding))
         
         # Cache operations (not compiled)
         cached_states = cache.get(self.layer_id, sample_indices)
@@ -442,9 +473,11 @@ class SConvTranspose1d(nn.Module):
         # For transposed convolution, padding calculation is different
         self.padding_total = kernel_size - stride
         
-        # For streaming, we need to keep track of input history
-        # Transposed conv needs to see multiple input samples to produce correct output
-        self.context_size = kernel_size - 1
+        # For streaming, we keep the overlap-add tail: the partial sums of the last `kernel_size - stride`
+        # output samples, which the next input frames still add to. A normalization over time (GroupNorm)
+        # needs the whole window instead, so it keeps the last `kernel_size - 1` input frames and recomputes.
+        self.overlap_add = norm != 'time_group_norm'
+        self.context_size = kernel_size - stride if self.overlap_add else kernel_size - 1
         
         # Create a unique layer ID for cache management
         self._layer_id = None
@@ -480,6 +513,55 @@ class SConvTranspose1d(nn.Module):
                           sample_indices: torch.Tensor,
                           debug: bool = False) -> torch.Tensor:
         """Streaming forward pass with cache operations kept separate from compiled code"""
+        if self.overlap_add:
+            return self._forward_overlap_add(x, cache, sample_indices, debug)
+        return self._forward_recompute(x, cache, sample_indices, debug)
+
+    def _forward_overlap_add(self, x: torch.Tensor,
+                            cache: VibeVoiceTokenizerStreamingCache,
+                            sample_indices: torch.Tensor,
+                            debug: bool = False) -> torch.Tensor:
+        """
+        Streaming forward pass that only convolves the new input. Its `T * stride + kernel_size - stride` raw
+        output samples get the tail of the previous chunk added to their start; the first `T * stride` samples
+        after the left padding are returned and the last `kernel_size - stride`, which the next chunk still adds
+        to, become the new tail. Same output as recomputing over the cached input frames, see `_forward_recompute`.
+        """
+        B, C, T = x.shape
+        convtr = self.convtr.convtr
+        tail_size = self.kernel_size - self.stride
+
+        # raw transposed conv of the new frames only, bias included once per output sample
+        y = convtr(x)
+        if tail_size > 0:
+            tail = cache.get(self.layer_id, sample_indices)
+            if tail is not None:
+                y[:, :, :tail_size] += tail
+            new_tail = y[:, :, -tail_size:]
+            if convtr.bias is not None:
+                # the next chunk adds its own bias to these samples
+                new_tail = new_tail - convtr.bias[:, None]
+            cache.set(self.layer_id, sample_indices, new_tail)
+
+        if debug:
+            print(f"[DEBUG] Input shape: {x.shape}, raw output shape: {y.shape}, tail size: {tail_size}")
+
+        # the chunk's samples start `padding_left` into its raw output, as in `_forward_recompute`
+        if self.causal:
+            padding_right = math.ceil(self.padding_total * self.trim_right_ratio)
+            padding_left = self.padding_total - padding_right
+        else:
+            padding_right = self.padding_total // 2
+            padding_left = self.padding_total - padding_right
+        output = y[:, :, padding_left:padding_left + T * self.stride]
+        # per-timestep normalization of the completed sums
+        return self.convtr.norm(output)
+
+    def _forward_recompute(self, x: torch.Tensor,
+                          cache: VibeVoiceTokenizerStreamingCache,
+                          sample_indices: torch.Tensor,
+                          debug: bool = False) -> torch.Tensor:
+        """Streaming forward pass that recomputes the transposed conv over the cached input frames"""
         B, C, T = x.shape
         
         # Cache operations (not compiled)
@@ -596,6 +678,81 @@ class FFN(nn.Module):
         return x
 
 
+class ConvFFN(nn.Module):
+    """`FFN` on channel-first inputs, as two 1x1 convolutions, so the block needs no permutes around it"""
+    def __init__(
+        self,
+        embed_dim,
+        ffn_dim,
+        bias=False,
+    ):
+        super().__init__()
+        self.embed_dim = embed_dim
+        self.conv1 = nn.Conv1d(self.embed_dim, ffn_dim, 1, bias=bias)
+        self.gelu = ACT2FN["gelu"]
+        self.conv2 = nn.Conv1d(ffn_dim, self.embed_dim, 1, bias=bias)
+
+    @classmethod
+    def from_ffn(cls, ffn: FFN) -> "ConvFFN":
+        conv_ffn = cls(ffn.embed_dim, ffn.linear1.out_features, bias=ffn.linear1.bias is not None)
+        conv_ffn.to(device=ffn.linear1.weight.device, dtype=ffn.linear1.weight.dtype)
+        with torch.no_grad():
+            for conv, linear in ((conv_ffn.conv1, ffn.linear1), (conv_ffn.conv2, ffn.linear2)):
+                conv.weight.copy_(linear.weight.unsqueeze(-1))
+                if linear.bias is not None:
+                    conv.bias.copy_(linear.bias)
+        return conv_ffn
+
+    def forward(self, x):
+        x = self.conv1(x)
+        x = self.gelu(x)
+        x = self.conv2(x)
+        return x
+
+
+def _scale_conv_inputs(conv: nn.Conv1d, scale: torch.Tensor):
+    """Fold a per-channel scale of the input of `conv` into its weight, in place"""
+    weight = conv.weight
+    out_channels, in_per_group = weight.shape[:2]
+    group = torch.arange(out_channels, device=weight.device) // (out_channels // conv.groups)
+    channels = group[:, None] * in_per_group + torch.arange(in_per_group, device=weight.device)
+    weight.copy_((weight.float() * scale.float()[channels].unsqueeze(-1)).to(weight.dtype))
+
+
+def _scale_conv_outputs(conv: nn.Conv1d, scale: torch.Tensor):
+    """Fold a per-channel scale of the output of `conv` into its weight and bias, in place"""
+    conv.weight.copy_((conv.weight.float() * scale.float()[:, None, None]).to(conv.weight.dtype))
+    if conv.bias is not None:
+        conv.bias.copy_((conv.bias.float() * scale.float()).to(conv.bias.dtype))
+
+
+def _remove_weight_parametrizations(module: nn.Module):
+    """Replace the `weight_norm`/`spectral_norm` reparametrizations below `module` by their current weights"""
+    for submodule in module.modules():
+        for remove in (nn.utils.remove_weight_norm, nn.utils.remove_spectral_norm):
+            try:
+                remove(submodule)
+            except ValueError:
+                pass
+
+
+@torch.no_grad()
+def freeze_tokenizer_for_inference(coder: nn.Module):
+    """
+    Inference-only rewrite of a `TokenizerEncoder`/`TokenizerDecoder`, in place: weight reparametrizations
+    become plain weights, every `Block1D` is frozen (see `Block1D.freeze_for_inference`) and the affine
+    weight of a final RMSNorm is folded into the head.
+    """
+    _remove_weight_parametrizations(coder)
+    for stage in coder.stages:
+        for block in stage:
+            block.freeze_for_inference()
+    if isinstance(coder.norm, ConvRMSNorm) and coder.norm.weight is not None:
+        _scale_conv_inputs(coder.head.conv.conv, coder.norm.weight)
+        coder.norm.weight = None
+        coder.norm.elementwise_affine = False
+
+
 class Convlayer(nn.Module):
     def __init__(
             self, 
@@ -662,6 +819,57 @@ class Block1D(nn.Module):
             self.gamma = None
             self.ffn_gamma = None
 
+    def ffn_forward(self, x):
+        """The FFN branch on channel-first `x`, without the residual"""
+        x = self.ffn_norm(x)
+        if isinstance(self.ffn, ConvFFN):
+            x = self.ffn(x)
+        else:
+            x = x.permute(0, 2, 1)
+            x = self.ffn(x)
+            x = x.permute(0, 2, 1)
+        if self.ffn_gamma is not None:
+            x = x * self.ffn_gamma.unsqueeze(-1)
+        return x
+
+    @torch.no_grad()
+    def freeze_for_inference(self):
+        """
+        Fold the affine weights of the RMSNorms and the layer scales into the adjacent convolutions and turn the
+        FFN into 1x1 convolutions, in place. The mixer conv gets the norm weight on its inputs, which commutes
+        with its padding and zero history, and `gamma` on its outputs unless a conv norm follows it. A
+        LayerNorm before the mixer is kept, its bias would also apply to the padding.
+        """
+        _remove_weight_parametrizations(self)
+        mixer = self.mixer.conv.conv
+        if isinstance(self.norm, ConvRMSNorm) and self.norm.weight is not None:
+            _scale_conv_inputs(mixer.conv, self.norm.weight)
+            self.norm.weight = None
+            self.norm.elementwise_affine = False
+        if self.gamma is not None and isinstance(mixer.norm, nn.Identity):
+            _scale_conv_outputs(mixer.conv, self.gamma)
+            self.gamma = None
+
+        if isinstance(self.ffn, FFN):
+            self.ffn = ConvFFN.from_ffn(self.ffn)
+        conv1, conv2 = self.ffn.conv1, self.ffn.conv2
+        if isinstance(self.ffn_norm, ConvRMSNorm) and self.ffn_norm.weight is not None:
+            _scale_conv_inputs(conv1, self.ffn_norm.weight)
+            self.ffn_norm.weight = None
+            self.ffn_norm.elementwise_affine = False
+        elif isinstance(self.ffn_norm, ConvLayerNorm) and self.ffn_norm.weight is not None:
+            # pointwise, so the bias folds too
+            shift = conv1.weight.float().squeeze(-1) @ self.ffn_norm.bias.float()
+            if conv1.bias is None:
+                conv1.bias = nn.Parameter(torch.zeros_like(shift).to(conv1.weight.dtype))
+            conv1.bias.copy_((conv1.bias.float() + shift).to(conv1.bias.dtype))
+            _scale_conv_inputs(conv1, self.ffn_norm.weight)
+            self.ffn_norm.weight.fill_(1.0)
+            self.ffn_norm.bias.zero_()
+        if self.ffn_gamma is not None:
+            _scale_conv_outputs(conv2, self.ffn_gamma)
+            self.ffn_gamma = None
+
     def forward(self, x):
         # mixer
         residual = x
@@ -672,14 +880,7 @@ class Block1D(nn.Module):
         x = residual + self.drop_path(x)
 
         # ffn
-        residual = x
-        x = self.ffn_norm(x)
-        x = x.permute(0, 2, 1)
-        x = self.ffn(x)
-        x = x.permute(0, 2, 1)
-        if self.ffn_gamma is not None:
-            x = x * self.ffn_gamma.unsqueeze(-1)
-        x = residual + self.drop_path(x)
+        x = x + self.drop_path(self.ffn_forward(x))
 
         return x
 
@@ -794,14 +995,7 @@ class TokenizerEncoder(nn.Module):
                     x = residual + x
                     
                     # FFN part
-                    residual = x
-                    x = block.ffn_norm(x)
-                    x = x.permute(0, 2, 1)
-                    x = block.ffn(x)
-                    x = x.permute(0, 2, 1)
-                    if block.ffn_gamma is not None:
-                        x = x * block.ffn_gamma.unsqueeze(-1)
-                    x = residual + x
+                    x = x + block.ffn_forward(x)
                 else:
                     x = block(x)
 
@@ -932,14 +1126,7 @@ class TokenizerDecoder(nn.Module):
                     x = residual + x
                     
                     # FFN part
-                    residual = x
-                    x = block.ffn_norm(x)
-                    x = x.permute(0, 2, 1)
-                    x = block.ffn(x)
-                    x = x.permute(0, 2, 1)
-                    if block.ffn_gamma is not None:
-                        x = x * block.ffn_gamma.unsqueeze(-1)
-                    x = residual + x
+                    x = x + block.ffn_forward(x)
                 else:
                     x = block(x)
 
@@ -1083,6 +1270,39 @@ class VibeVoiceAcousticTokenizerModel(PreTrainedModel):
         """Convert audio to latent representations"""
         latents = self.encoder(audio, cache=cache, sample_indices=sample_indices, use_cache=use_cache, debug=debug)
         return VibeVoiceTokenizerEncoderOutput(mean=latents.permute(0, 2, 1), std=self.fix_std)
+
+    @torch.no_grad()
+    def encode_chunked(self, audio, chunk_size, lengths=None):
+        """
+        `encode` in chunks of `chunk_size` samples (rounded down to a multiple of the hop length) through the
+        streaming cache, so the activations of long audio never exist at once. Rows stop being encoded after
+        their `lengths` (in samples, default the whole padded width) and their later frames are zero. The
+        encoder is causal with zero padding, so the other frames match `encode` up to rounding; other
+        configurations fall back to `encode`.
+        """
+        if not self.config.causal or self.config.pad_mode != 'constant':
+            return self.encode(audio)
+        hop_length = int(self.encoder.hop_length)
+        chunk_size = max(hop_length, chunk_size // hop_length * hop_length)
+        batch_size, _, width = audio.shape
+        lengths = [width] * batch_size if lengths is None else lengths
+        num_frames = [math.ceil(length / hop_length) for length in lengths]
+
+        cache = VibeVoiceTokenizerStreamingCache(batch_size)
+        latents = None
+        for start in range(0, width, chunk_size):
+            rows = [i for i, n in enumerate(num_frames) if n * hop_length > start]
+            if not rows:
+                break
+            sample_indices = torch.tensor(rows, dtype=torch.long, device=audio.device)
+            chunk = self.encoder(audio[sample_indices, :, start:start + chunk_size], cache=cache, sample_indices=sample_indices, use_cache=True)
+            if latents is None:
+                latents = chunk.new_zeros(batch_size, chunk.shape[1], max(num_frames))
+            first_frame = start // hop_length
+            latents[sample_indices, :, first_frame:first_frame + chunk.shape[-1]] = chunk
+        for i, n in enumerate(num_frames):
+            latents[i, :, n:] = 0
+        return VibeVoiceTokenizerEncoderOutput(mean=latents.permute(0, 2, 1), std=self.fix_std)
     
     @torch.no_grad()
     def sampling(self, encoder_output, dist_type=None):
@@ -1107,6 +1327,20 @@ class VibeVoiceAcousticTokenizerModel(PreTrainedModel):
         audio = self.decoder(latents, cache=cache, sample_indices=sample_indices, use_cache=use_cache, debug=debug)
         return audio
 
+    @torch.no_grad()
+    def freeze_for_inference(self):
+        """
+        Rewrite the encoder and decoder for inference, in place: `weight_norm`/`spectral_norm` become plain
+        weights, the RMSNorm affine weights and the layer scales (`gamma`, `ffn_gamma`) are folded into the
+        adjacent convolutions and the FFNs become channel-first 1x1 convolutions (see
+        `Block1D.freeze_for_inference`). Outputs match the unfrozen model up to rounding. The model can no
+        longer be trained or saved as a checkpoint of this config, and streaming caches filled before freezing
+        must not be reused after.
+        """
+        freeze_tokenizer_for_inference(self.encoder)
+        freeze_tokenizer_for_inference(self.decoder)
+        return self.eval()
+
     def forward(self, audio, cache=None, sample_indices=None, use_cache=False, debug=False):
         """Full forward pass: encode audio to latents, then decode back to audio"""
         encoder_output = self.encode(audio, cache=cache, sample_indices=sample_indices, use_cache=use_cache, debug=debug)
@@ -1179,6 +1413,12 @@ class VibeVoiceSemanticTokenizerModel(PreTrainedModel):
         """Sample from the encoder output distribution"""
         return encoder_output.sample(dist_type='none')
 
+    @torch.no_grad()
+    def freeze_for_inference(self):
+        """Rewrite the encoder for inference, in place, see `VibeVoiceAcousticTokenizerModel.freeze_for_inference`"""
+        freeze_tokenizer_for_inference(self.encoder)
+        return self.eval()
+
     def forward(self, audio, cache=None, sample_indices=None, use_cache=False, debug=False):
         """Full forward pass: encode audio to latents, then decode back to audio"""
         encoder_output = self.encode(audio, cache=cache, sample_indices=sample_indices, use_cache=use_cache, debug=debug)
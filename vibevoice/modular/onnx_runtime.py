@@ -0,0 +1,369 @@
+import copy
+import os
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+import torch.nn as nn
+from transformers.utils import logging
+
+from .modular_vibevoice_tokenizer import VibeVoiceTokenizerEncoderOutput, VibeVoiceTokenizerStreamingCache
+
+logger = logging.get_logger(__name__)
+
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except ImportError:
+    ONNXRUNTIME_AVAILABLE = False
+
+ONNX_FILES = {
+    "diffusion_head": "diffusion_head.onnx",
+    "acoustic_decoder": "acoustic_decoder_step.onnx",
+    "semantic_encoder": "semantic_encoder_step.onnx",
+}
+
+
+class _DenoiseGraph(nn.Module):
+    """`VibeVoiceDiffusionHead.denoise` as a module, the function `sample_speech_tokens` calls per step."""
+
+    def __init__(self, head):
+        super().__init__()
+        self.head = head
+
+    def forward(self, noisy_images, timestep_embeddings, projected_condition):
+        return self.head.denoise(noisy_images, timestep_embeddings, projected_condition)
+
+
+class _StateCache:
+    """Stand-in for `VibeVoiceTokenizerStreamingCache` that reads the states from and writes them to tensors."""
+
+    def __init__(self, states: Dict[str, torch.Tensor]):
+        self.states = states
+        self.updated: Dict[str, torch.Tensor] = {}
+
+    def get(self, layer_id, sample_indices):
+        return self.states[layer_id]
+
+    def set(self, layer_id, sample_indices, states):
+        self.updated[layer_id] = states
+
+
+class _StreamingStep(nn.Module):
+    """One streaming call of a `TokenizerEncoder`/`TokenizerDecoder` with its conv states as inputs and outputs."""
+
+    def __init__(self, coder: nn.Module, layer_ids: List[str]):
+        super().__init__()
+        self.coder = coder
+        self.layer_ids = layer_ids
+
+    def forward(self, x, *states):
+        cache = _StateCache(dict(zip(self.layer_ids, states)))
+        sample_indices = torch.arange(x.shape[0])
+        y = self.coder(x, cache=cache, sample_indices=sample_indices, use_cache=True)
+        return (y,) + tuple(cache.updated[layer_id] for layer_id in self.layer_ids)
+
+
+def _export_streaming_step(coder: nn.Module, step_input: torch.Tensor, path: str, opset_version: int):
+    # the layers holding state and their state shapes, from one streaming call with a real cache
+    probe = VibeVoiceTokenizerStreamingCache(1)
+    coder(step_input[:1], cache=probe, sample_indices=torch.zeros(1, dtype=torch.long), use_cache=True)
+    layer_ids = list(probe.cache)
+    states = [step_input.new_zeros(step_input.shape[0], *probe.cache[layer_id].shape[1:]) for layer_id in layer_ids]
+    state_names = [f"state_{i}" for i in range(len(layer_ids))]
+    output_names = ["output"] + [f"new_state_{i}" for i in range(len(layer_ids))]
+    torch.onnx.export(
+        _StreamingStep(coder, layer_ids),
+        (step_input, *states),
+        path,
+        input_names=["input"] + state_names,
+        output_names=output_names,
+        dynamic_axes={name: {0: "batch"} for name in ["input"] + state_names + output_names},
+        opset_version=opset_version,
+    )
+
+
+@torch.no_grad()
+def export_onnx(model, output_dir: str, opset_version: int = 17) -> Dict[str, str]:
+    """
+    Export the per-frame non-LM modules of a VibeVoice model (`VibeVoiceModel`) to ONNX graphs in `output_dir`,
+    in float32 with a dynamic batch dimension:
+
+    - `diffusion_head.onnx`: `prediction_head.denoise(noisy_images, timestep_embeddings, projected_condition)`;
+    - `acoustic_decoder_step.onnx`: one streaming `acoustic_tokenizer.decode` of a single latent frame;
+    - `semantic_encoder_step.onnx`: one streaming `semantic_tokenizer.encode` of one frame of audio.
+
+    The codec graphs take the conv states of their streaming layers as `state_<i>` inputs and return the updated
+    states as `new_state_<i>` outputs, in place of the streaming cache. Returns the path of every graph.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {name: os.path.join(output_dir, file_name) for name, file_name in ONNX_FILES.items()}
+
+    head = copy.deepcopy(model.prediction_head).float().cpu().eval()
+    config = head.config
+    torch.onnx.export(
+        _DenoiseGraph(head),
+        (torch.randn(2, config.latent_size), torch.randn(1, config.hidden_size), torch.randn(2, config.hidden_size)),
+        paths["diffusion_head"],
+        input_names=["noisy_images", "timestep_embeddings", "projected_condition"],
+        output_names=["output"],
+        dynamic_axes={name: {0: "batch"} for name in ("noisy_images", "projected_condition", "output")},
+        opset_version=opset_version,
+    )
+
+    for tokenizer in (model.acoustic_tokenizer, model.semantic_tokenizer):
+        if not tokenizer.config.causal:
+            raise ValueError("Only causal tokenizers can be exported as streaming steps")
+    acoustic_tokenizer = copy.deepcopy(model.acoustic_tokenizer).float().cpu().eval()
+    decoder_input = torch.zeros(2, acoustic_tokenizer.config.vae_dim, 1)
+    _export_streaming_step(acoustic_tokenizer.decoder, decoder_input, paths["acoustic_decoder"], opset_version)
+
+    semantic_tokenizer = copy.deepcopy(model.semantic_tokenizer).float().cpu().eval()
+    encoder_input = torch.zeros(2, 1, int(semantic_tokenizer.encoder.hop_length))
+    _export_streaming_step(semantic_tokenizer.encoder, encoder_input, paths["semantic_encoder"], opset_version)
+
+    logger.info(f"Exported {len(paths)} ONNX graphs to {output_dir}")
+    return paths
+
+
+def _to_numpy(tensor: torch.Tensor) -> np.ndarray:
+    return tensor.detach().to("cpu", torch.float32).numpy()
+
+
+class OnnxDiffusionHead:
+    """
+    The part of a `VibeVoiceDiffusionHead` that `sample_speech_tokens` uses, with `denoise` running the
+    exported graph. The condition projection and the timestep embeddings, computed once per frame, stay on the
+    PyTorch head.
+    """
+
+    def __init__(self, head, session):
+        self.head = head
+        self.session = session
+        self.config = head.config
+        self.cond_proj = head.cond_proj
+        self.get_timestep_embeddings = head.get_timestep_embeddings
+
+    @property
+    def device(self):
+        return self.head.device
+
+    @property
+    def dtype(self):
+        return self.head.dtype
+
+    def denoise(self, noisy_images, timestep_embeddings, projected_condition):
+        (output,) = self.session.run(None, {
+            "noisy_images": _to_numpy(noisy_images),
+            "timestep_embeddings": _to_numpy(timestep_embeddings.reshape(1, -1)),
+            "projected_condition": _to_numpy(projected_condition),
+        })
+        return torch.from_numpy(output).to(noisy_images.device, noisy_images.dtype)
+
+
+class _OnnxStreamingCodec:
+    """Runs an exported streaming step, keeping its states per sample in a `VibeVoiceTokenizerStreamingCache`."""
+
+    def __init__(self, tokenizer, session):
+        self.tokenizer = tokenizer
+        self.session = session
+        inputs = session.get_inputs()
+        self.input_name = inputs[0].name
+        self.step_size = inputs[0].shape[-1]
+        self.state_names = [state.name for state in inputs[1:]]
+        self.state_shapes = [tuple(state.shape[1:]) for state in inputs[1:]]
+
+    @property
+    def device(self):
+        return self.tokenizer.device
+
+    @property
+    def config(self):
+        return self.tokenizer.config
+
+    def _step(self, x: torch.Tensor, cache: VibeVoiceTokenizerStreamingCache, sample_indices: torch.Tensor):
+        feeds = {self.input_name: _to_numpy(x)}
+        for name, shape in zip(self.state_names, self.state_shapes):
+            state = cache.get(f"onnx_{name}", sample_indices)
+            feeds[name] = np.zeros((x.shape[0], *shape), dtype=np.float32) if state is None else _to_numpy(state)
+        output, *states = self.session.run(None, feeds)
+        for name, state in zip(self.state_names, states):
+            cache.set(f"onnx_{name}", sample_indices, torch.from_numpy(state))
+        return torch.from_numpy(output)
+
+    def _stream(self, x: torch.Tensor, cache, sample_indices) -> torch.Tensor:
+        if x.shape[-1] % self.step_size != 0:
+            raise ValueError(f"Streaming inputs must be a multiple of {self.step_size} long, got {x.shape[-1]}")
+        outputs = [
+            self._step(x[..., start:start + self.step_size], cache, sample_indices)
+            for start in range(0, x.shape[-1], self.step_size)
+        ]
+        return torch.cat(outputs, dim=-1).to(x.device, x.dtype)
+
+
+class OnnxAcousticDecoder(_OnnxStreamingCodec):
+    """`acoustic_tokenizer.decode` on the exported streaming step; non-streaming calls run the PyTorch tokenizer."""
+
+    def decode(self, latents, cache=None, sample_indices=None, use_cache=False, debug=False):
+        if not use_cache or cache is None:
+            return self.tokenizer.decode(latents)
+        if latents.shape[1] != self.config.vae_dim:
+            latents = latents.permute(0, 2, 1)
+        return self._stream(latents, cache, sample_indices)
+
+
+class OnnxSemanticEncoder(_OnnxStreamingCodec):
+    """`semantic_tokenizer.encode` on the exported streaming step; non-streaming calls run the PyTorch tokenizer."""
+
+    def encode(self, audio, cache=None, sample_indices=None, use_cache=False, debug=False):
+        if not use_cache or cache is None:
+            return self.tokenizer.encode(audio)
+        latents = self._stream(audio, cache, sample_indices)
+        return VibeVoiceTokenizerEncoderOutput(mean=latents.permute(0, 2, 1))
+
+
+class VibeVoiceOnnxRuntime:
+    """
+    ONNX Runtime backend for the per-frame non-LM work of `generate()`.
+
+    The diffusion head and the streaming acoustic decoder and semantic encoder are small-tensor
+    modules whose eager PyTorch execution is dominated by per-op overhead; ONNX Runtime runs their
+    exported graphs (see `export_onnx`) as whole, optimized graphs on its CPU execution provider.
+    `prediction_head`, `acoustic_tokenizer` and `semantic_tokenizer` stand in for the modules of
+    the model in `sample_speech_tokens` and in the streaming decode/encode of each frame. The codec
+    states live in the usual streaming caches. Graphs run in float32, the results are cast back.
+    Components left out of `components` stay on PyTorch.
+
+    Args:
+        model (`VibeVoiceModel`):
+            The model the graphs were exported from.
+        onnx_dir (`str`):
+            Directory written by `export_onnx`.
+        components (`Sequence[str]`, *optional*):
+            Which of `"diffusion_head"`, `"acoustic_decoder"` and `"semantic_encoder"` run on ONNX Runtime.
+            Defaults to all of them.
+        providers (`Sequence[str]`, *optional*, defaults to `("CPUExecutionProvider",)`):
+            ONNX Runtime execution providers.
+        intra_op_num_threads (`int`, *optional*):
+            Threads per session, ONNX Runtime's default when not set.
+
+    Example:
+
+    ```python
+    >>> export_onnx(model.model, "vibevoice-onnx")
+    >>> runtime = VibeVoiceOnnxRuntime(model.model, "vibevoice-onnx")
+    >>> print(onnx_runtime_error(model.model, runtime))
+    >>> model.set_onnx_runtime(runtime)
+    ```
+    """
+
+    def __init__(
+        self,
+        model,
+        onnx_dir: str,
+        components: Optional[Sequence[str]] = None,
+        providers: Sequence[str] = ("CPUExecutionProvider",),
+        intra_op_num_threads: Optional[int] = None,
+    ):
+        if not ONNXRUNTIME_AVAILABLE:
+            raise ImportError("The ONNX Runtime backend requires `onnxruntime`, install it with `pip install onnxruntime`")
+        components = tuple(ONNX_FILES) if components is None else tuple(components)
+        for name in components:
+            if name not in ONNX_FILES:
+                raise ValueError(f"Unknown component {name!r}, expected one of {list(ONNX_FILES)}")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_num_threads is not None:
+            options.intra_op_num_threads = intra_op_num_threads
+
+        def session(name):
+            return ort.InferenceSession(os.path.join(onnx_dir, ONNX_FILES[name]), options, providers=list(providers))
+
+        self.components = components
+        self.prediction_head = (
+            OnnxDiffusionHead(model.prediction_head, session("diffusion_head"))
+            if "diffusion_head" in components else model.prediction_head
+        )
+        self.acoustic_tokenizer = (
+            OnnxAcousticDecoder(model.acoustic_tokenizer, session("acoustic_decoder"))
+            if "acoustic_decoder" in components else model.acoustic_tokenizer
+        )
+        self.semantic_tokenizer = (
+            OnnxSemanticEncoder(model.semantic_tokenizer, session("semantic_encoder"))
+            if "semantic_encoder" in components else model.semantic_tokenizer
+        )
+
+
+@torch.no_grad()
+def onnx_runtime_error(
+    model,
+    runtime: VibeVoiceOnnxRuntime,
+    batch_size: int = 2,
+    num_frames: int = 8,
+    generator: Optional[torch.Generator] = None,
+) -> Dict[str, float]:
+    """
+    Parity of `runtime` with the eager modules of `model` (`VibeVoiceModel`): the largest absolute difference
+    relative to the largest absolute eager value, for the head's predictions at every timestep of a default
+    20-step schedule and for `num_frames` streamed frames of the acoustic decoder and the semantic encoder
+    (fed the eager decoder's audio), all on random inputs.
+    """
+    def relative_error(actual, expected):
+        return ((actual.float() - expected.float()).abs().max() / expected.float().abs().max().clamp_min(1e-12)).item()
+
+    report = {}
+    if "diffusion_head" in runtime.components:
+        head = model.prediction_head
+        config = head.config
+        timestep_embeddings = head.get_timestep_embeddings(model.noise_scheduler.get_schedule(20).timesteps)
+        condition = torch.randn(batch_size, config.hidden_size, generator=generator).to(head.device, head.dtype)
+        projected_condition = head.cond_proj(condition)
+        errors = []
+        for embedding in timestep_embeddings:
+            latent = torch.randn(batch_size, config.latent_size, generator=generator).to(head.device, head.dtype)
+            errors.append(relative_error(
+                runtime.prediction_head.denoise(latent, embedding, projected_condition),
+                head.denoise(latent, embedding, projected_condition),
+            ))
+        report["diffusion_head"] = max(errors)
+
+    acoustic_tokenizer = model.acoustic_tokenizer
+    sample_indices = torch.arange(batch_size)
+    latents = torch.randn(batch_size, num_frames, acoustic_tokenizer.config.vae_dim, generator=generator)
+    latents = latents.to(acoustic_tokenizer.device, acoustic_tokenizer.dtype)
+    eager_cache, runtime_cache = VibeVoiceTokenizerStreamingCache(batch_size), VibeVoiceTokenizerStreamingCache(batch_size)
+    audio, runtime_audio = [], []
+    for frame in range(num_frames):
+        latent = latents[:, frame: frame + 1]
+        audio.append(acoustic_tokenizer.decode(latent, cache=eager_cache, sample_indices=sample_indices, use_cache=True))
+        if "acoustic_decoder" in runtime.components:
+            runtime_audio.append(runtime.acoustic_tokenizer.decode(
+                latent, cache=runtime_cache, sample_indices=sample_indices, use_cache=True,
+            ))
+    if runtime_audio:
+        report["acoustic_decoder"] = relative_error(torch.cat(runtime_audio, dim=-1), torch.cat(audio, dim=-1))
+
+    if "semantic_encoder" in runtime.components:
+        semantic_tokenizer = model.semantic_tokenizer
+        eager_cache, runtime_cache = VibeVoiceTokenizerStreamingCache(batch_size), VibeVoiceTokenizerStreamingCache(batch_size)
+        features, runtime_features = [], []
+        for chunk in audio:
+            chunk = chunk.to(semantic_tokenizer.device, semantic_tokenizer.dtype)
+            features.append(semantic_tokenizer.encode(
+                chunk, cache=eager_cache, sample_indices=sample_indices, use_cache=True,
+            ).mean)
+            runtime_features.append(runtime.semantic_tokenizer.encode(
+                chunk, cache=runtime_cache, sample_indices=sample_indices, use_cache=True,
+            ).mean)
+        report["semantic_encoder"] = relative_error(torch.cat(runtime_features, dim=1), torch.cat(features, dim=1))
+    return report
+
+
+__all__ = [
+    "VibeVoiceOnnxRuntime",
+    "OnnxDiffusionHead",
+    "OnnxAcousticDecoder",
+    "OnnxSemanticEncoder",
+    "export_onnx",
+    "onnx_runtime_error",
+]
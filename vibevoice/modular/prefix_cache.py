@@ -0,0 +1,126 @@
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+import torch
+
+from transformers.utils import logging
+
+logger = logging.get_logger(__name__)
+
+
+def hash_speech(speech: torch.Tensor) -> str:
+    """
+    Content hash of a (possibly zero-padded) reference waveform.
+
+    Trailing zeros are stripped first, so the hash does not depend on how much the
+    processor padded the waveform to the longest voice of the batch.
+    """
+    speech = speech.detach().reshape(-1).float().cpu()
+    nonzero = speech.nonzero()
+    speech = speech[: int(nonzero[-1].item()) + 1] if nonzero.numel() > 0 else speech[:0]
+    return hashlib.sha256(speech.numpy().tobytes()).hexdigest()
+
+
+@dataclass
+class VibeVoicePrefixCacheEntry:
+    """Language model key/value states of one prompt prefix, each of shape `(1, num_heads, prefix_length, head_dim)`."""
+    key_cache: List[torch.Tensor]
+    value_cache: List[torch.Tensor]
+
+    @property
+    def length(self) -> int:
+        return self.key_cache[0].shape[2]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(t.numel() * t.element_size() for t in self.key_cache + self.value_cache)
+
+
+class VibeVoicePrefixCache:
+    """
+    LRU cache of the language model key/value states of prompt prefixes.
+
+    Every prompt built by `VibeVoiceProcessor` starts with the system prompt followed by the
+    voice section (one reference clip per speaker). The cache stores the KV states after that
+    prefix, keyed by its token ids, the content hash of the voice waveforms and the revision of
+    the speech modules that embedded them, so requests reusing the same voices only prefill
+    from `' Text input:'` on. Entries are evicted in least-recently-used order once
+    `max_memory_bytes` is exceeded.
+
+    Args:
+        max_memory_bytes (`int`, *optional*, defaults to 2 GiB):
+            Budget for the cached key/value tensors.
+    """
+
+    def __init__(self, max_memory_bytes: int = 2 * 1024 ** 3):
+        self.max_memory_bytes = max_memory_bytes
+        self._entries: "OrderedDict[str, VibeVoicePrefixCacheEntry]" = OrderedDict()
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    @staticmethod
+    def make_key(prefix_ids: Sequence[int], speech_tensors: Optional[torch.Tensor] = None, revision: str = "") -> str:
+        """
+        Build the cache key of a prefix from its token ids, the voice waveforms it embeds and `revision`,
+        which names the modules that produced the states (see `_voice_latent_cache_revision`).
+        """
+        h = hashlib.sha256()
+        h.update(torch.as_tensor(prefix_ids, dtype=torch.long).cpu().numpy().tobytes())
+        if speech_tensors is not None:
+            for speech in speech_tensors:
+                h.update(hash_speech(speech).encode())
+        h.update(f"|{revision}".encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[VibeVoicePrefixCacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: VibeVoicePrefixCacheEntry):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        if entry.nbytes > self.max_memory_bytes:
+            logger.warning(
+                f"Prefix of {entry.length} tokens needs {entry.nbytes} bytes, more than the prefix cache budget "
+                f"of {self.max_memory_bytes} bytes; it is not cached."
+            )
+            return
+        self._entries[key] = entry
+        self.memory_bytes += entry.nbytes
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+
+    def clear(self):
+        self._entries.clear()
+        self.memory_bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "memory_bytes": self.memory_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+__all__ = [
+    "VibeVoicePrefixCache",
+    "VibeVoicePrefixCacheEntry",
+    "hash_speech",
+]
@@ -0,0 +1,118 @@
+import copy
+from typing import Dict, Optional
+
+import torch
+import torch.nn as nn
+from transformers.utils import logging
+
+logger = logging.get_logger(__name__)
+
+
+class Int8DynamicLinear(nn.Module):
+    """
+    Drop-in replacement of an `nn.Linear` with int8 weights (one scale per output channel) and dynamically
+    quantized int8 activations, for CPU inference.
+
+    The quantized kernel only takes float32, so inputs are upcast and the output is cast back to the input
+    dtype; the module can replace a linear of a bf16 model without touching its neighbours.
+    """
+
+    def __init__(self, linear: nn.Linear):
+        super().__init__()
+        float_linear = nn.Linear(linear.in_features, linear.out_features, bias=linear.bias is not None)
+        with torch.no_grad():
+            float_linear.weight.copy_(linear.weight.float())
+            if linear.bias is not None:
+                float_linear.bias.copy_(linear.bias.float())
+        float_linear.qconfig = torch.ao.quantization.per_channel_dynamic_qconfig
+        self.linear = torch.ao.nn.quantized.dynamic.Linear.from_float(float_linear)
+        self.in_features = linear.in_features
+        self.out_features = linear.out_features
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.linear(x.float()).to(x.dtype)
+
+    def extra_repr(self) -> str:
+        return f"in_features={self.in_features}, out_features={self.out_features}"
+
+
+def quantize_linear_layers(module: nn.Module) -> int:
+    """Replace every `nn.Linear` below `module` by an `Int8DynamicLinear`, in place. Returns how many."""
+    for parameter in module.parameters():
+        if parameter.device.type != "cpu":
+            raise ValueError(f"Int8 dynamic quantization runs on the CPU, but the module is on {parameter.device}")
+    count = 0
+    for name, child in module.named_children():
+        if isinstance(child, nn.Linear):
+            setattr(module, name, Int8DynamicLinear(child))
+            count += 1
+        else:
+            count += quantize_linear_layers(child)
+    return count
+
+
+@torch.no_grad()
+def diffusion_head_error(
+    reference: nn.Module,
+    quantized: nn.Module,
+    timesteps: torch.Tensor,
+    num_samples: int = 64,
+    generator: Optional[torch.Generator] = None,
+) -> Dict[str, float]:
+    """
+    Deviation of the noise/velocity predictions of `quantized` from those of the unquantized `reference` head,
+    over `num_samples` random latents and conditions at each of `timesteps`: the RMS error relative to the RMS of
+    the reference predictions (`relative_rms_error`) and the smallest cosine similarity of a prediction
+    (`min_cosine_similarity`).
+    """
+    config = reference.config
+    dtype = next(reference.parameters()).dtype
+    latents = torch.randn(len(timesteps), num_samples, config.latent_size, generator=generator).to(dtype)
+    conditions = torch.randn(num_samples, config.hidden_size, generator=generator).to(dtype)
+    errors, norms, cosines = [], [], []
+    for t, latent in zip(timesteps, latents):
+        t = t.expand(num_samples).to(dtype)
+        expected = reference(latent, t, conditions).float()
+        actual = quantized(latent, t, conditions).float()
+        errors.append((actual - expected).pow(2).mean())
+        norms.append(expected.pow(2).mean())
+        cosines.append(nn.functional.cosine_similarity(actual, expected, dim=-1).min())
+    return {
+        "relative_rms_error": (torch.stack(errors).mean() / torch.stack(norms).mean()).sqrt().item(),
+        "min_cosine_similarity": torch.stack(cosines).min().item(),
+    }
+
+
+def quantize_diffusion_modules(
+    model, check_accuracy: bool = True, num_samples: int = 64
+) -> Optional[Dict[str, float]]:
+    """
+    Int8 dynamic quantization of the diffusion head and the acoustic/semantic connectors of a VibeVoice model
+    (`VibeVoiceModel`), in place. With `check_accuracy`, the head's predictions are compared with those of an
+    unquantized copy over the timesteps of a default 20-step schedule (see `diffusion_head_error`) and the
+    result is logged and returned.
+    """
+    reference = copy.deepcopy(model.prediction_head) if check_accuracy else None
+    count = 0
+    for module in (model.prediction_head, model.acoustic_connector, model.semantic_connector):
+        count += quantize_linear_layers(module)
+    # the timestep embeddings were computed by the unquantized embedder
+    model.prediction_head.clear_timestep_embedding_cache()
+    logger.info(f"Quantized {count} linear layers to int8")
+    if reference is None:
+        return None
+    timesteps = model.noise_scheduler.get_schedule(20).timesteps
+    report = diffusion_head_error(reference, model.prediction_head, timesteps, num_samples=num_samples)
+    logger.info(
+        f"Int8 diffusion head: relative RMS error {report['relative_rms_error']:.4f}, "
+        f"min cosine similarity {report['min_cosine_similarity']:.4f}"
+    )
+    return report
+
+
+__all__ = [
+    "Int8DynamicLinear",
+    "quantize_linear_layers",
+    "diffusion_head_error",
+    "quantize_diffusion_modules",
+]
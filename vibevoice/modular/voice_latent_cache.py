@@ -0,0 +1,99 @@
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import torch
+
+from .prefix_cache import hash_speech
+
+
+@dataclass
+class VibeVoiceVoiceLatents:
+    """
+    Encoded voice prompt of one reference waveform, restricted to its valid latent frames.
+
+    Args:
+        mean (`torch.FloatTensor` of shape `(num_frames, vae_dim)`):
+            Mean of the acoustic tokenizer encoder output.
+        features (`torch.FloatTensor` of shape `(num_frames, vae_dim)`):
+            Sampled latents after the speech bias and scaling factors.
+        connected (`torch.FloatTensor` of shape `(num_frames, hidden_size)`):
+            Output of the acoustic connector, i.e. the embeddings inserted into the prompt.
+    """
+    mean: torch.Tensor
+    features: torch.Tensor
+    connected: torch.Tensor
+
+    @property
+    def nbytes(self) -> int:
+        return sum(t.numel() * t.element_size() for t in (self.mean, self.features, self.connected))
+
+
+class VibeVoiceVoiceLatentCache:
+    """
+    LRU cache of encoded voice prompts used by `_process_speech_inputs`.
+
+    Entries are keyed by the content hash of the reference waveform, its number of latent
+    frames and the model revision, so a voice that was already seen skips the acoustic
+    encoder and the connector entirely. Like the prefix cache, a cached voice keeps the
+    latents sampled when it was first encoded.
+
+    Args:
+        max_memory_bytes (`int`, *optional*, defaults to 256 MiB):
+            Budget for the cached tensors.
+    """
+
+    def __init__(self, max_memory_bytes: int = 256 * 1024 ** 2):
+        self.max_memory_bytes = max_memory_bytes
+        self._entries: "OrderedDict[str, VibeVoiceVoiceLatents]" = OrderedDict()
+        self.memory_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(speech: torch.Tensor, num_frames: int, revision: str = "") -> str:
+        h = hashlib.sha256()
+        h.update(hash_speech(speech).encode())
+        h.update(f"{int(num_frames)}|{revision}".encode())
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[VibeVoiceVoiceLatents]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, entry: VibeVoiceVoiceLatents):
+        if key in self._entries or entry.nbytes > self.max_memory_bytes:
+            return
+        self._entries[key] = entry
+        self.memory_bytes += entry.nbytes
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.memory_bytes -= evicted.nbytes
+
+    def clear(self):
+        """Drop all entries, e.g. after the acoustic tokenizer or connector weights changed in place."""
+        self._entries.clear()
+        self.memory_bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "memory_bytes": self.memory_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+__all__ = [
+    "VibeVoiceVoiceLatentCache",
+    "VibeVoiceVoiceLatents",
+]
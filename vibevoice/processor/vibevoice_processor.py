@@ -10,6 +10,7 @@ import torch
 from transformers.tokenization_utils_base import BatchEncoding, PaddingStrategy, PreTokenizedInput, TextInput, TruncationStrategy
 from transformers.utils import TensorType, logging
 from .vibevoice_tokenizer_processor import AudioNormalizer
+from .voice_pack import check_voice_pack, is_voice_pack, voice_pack_latents
 
 logger = logging.get_logger(__name__)
 
@@ -185,6 +186,8 @@ class VibeVoiceProcessor:
                 Voice samples for each script. Can be:
                 - A list of samples for a single script
                 - A list of lists for batch processing
+                A sample is an audio path, a waveform, or a voice pack (path or loaded dict) written by
+                `vibevoice-voicepack`. All samples of a batch must be of the same kind.
             padding (`bool`, `str` or `PaddingStrategy`, defaults to `True`):
                 Whether to pad sequences to the same length
             truncation (`bool`, `str` or `TruncationStrategy`, defaults to `False`):
@@ -203,6 +206,8 @@ class VibeVoiceProcessor:
                 - **speech_tensors** -- Padded speech inputs (if voice_samples provided)
                 - **speech_masks** -- Speech masks (if voice_samples provided)
                 - **speech_input_mask** -- Boolean masks indicating speech token positions
+                - **voice_prompt_lengths** -- Number of system and voice prompt tokens at the start of each sequence
+                - **speech_type** -- `"audio"` for waveforms, `"pt"` for voice pack latents
         """
         # Handle single vs batch input
         if isinstance(text, str) or (isinstance(text, list) and len(text) > 0 and not isinstance(text[0], str)):
@@ -301,6 +306,7 @@ class VibeVoiceProcessor:
             "speech_input_mask": speech_input_mask,
             "parsed_script": parsed_lines,
             "all_speakers": all_speakers,
+            "voice_prompt_length": len(system_tokens) + len(voice_tokens),
         }
     
     def _batch_encode(
@@ -393,13 +399,18 @@ class VibeVoiceProcessor:
             )
             batch_encoding["speech_tensors"] = speech_dict["padded_speeches"]
             batch_encoding["speech_masks"] = speech_dict["speech_masks"]
+            # voice packs carry acoustic latents (num_frames, vae_dim) instead of waveforms
+            batch_encoding["speech_type"] = "pt" if all_speech_inputs[0].ndim == 2 else "audio"
         else:
             batch_encoding["speech_tensors"] = None
             batch_encoding["speech_masks"] = None
+            batch_encoding["speech_type"] = "audio"
             
         # Add metadata
         batch_encoding["parsed_scripts"] = [enc["parsed_script"] for enc in encodings]
         batch_encoding["all_speakers_list"] = [enc["all_speakers"] for enc in encodings]
+        # length of the system + voice prompt prefix of each (unpadded) sequence, see `VibeVoicePrefixCache`
+        batch_encoding["voice_prompt_lengths"] = [enc["voice_prompt_length"] for enc in encodings]
         
         return batch_encoding
 
@@ -422,22 +433,34 @@ class VibeVoiceProcessor:
         for speaker_id, speaker_audio in enumerate(speaker_samples):
             prefix_tokens = self.tokenizer.encode(f" Speaker {speaker_id}:", add_special_tokens=False)
             
-            # Process audio
-            if isinstance(speaker_audio, str):
-                # Load audio from file
-                wav = self.audio_processor._load_audio_from_path(speaker_audio)
-            else:
-                wav = np.array(speaker_audio, dtype=np.float32)
-            
-            # Apply normalization if needed
-            if self.db_normalize and self.audio_normalizer:
-                wav = self.audio_normalizer(wav)
+            voice_pack = None
+            source = speaker_audio if isinstance(speaker_audio, str) else f"Voice pack of speaker {speaker_id}"
+            if isinstance(speaker_audio, str) and speaker_audio.lower().endswith('.pt'):
+                # `.pt` files are either voice packs or raw waveform tensors; load them only once
+                speaker_audio = torch.load(speaker_audio, map_location='cpu')
+                if not is_voice_pack(speaker_audio):
+                    speaker_audio = np.asarray(speaker_audio, dtype=np.float32).squeeze()
+            if is_voice_pack(speaker_audio):
+                voice_pack = check_voice_pack(speaker_audio, source)
             
-            # Calculate token length based on compression ratio
-            # if speaker_audio.endswith('.pt') or speaker_audio.endswith('.npy'):
-            #     vae_tok_len = wav.shape[0]
-            # else:
-            vae_tok_len = math.ceil(wav.shape[0] / self.speech_tok_compress_ratio)
+            if voice_pack is not None:
+                # Pre-encoded latents: one token per latent frame, no normalization
+                wav = voice_pack_latents(voice_pack)
+                vae_tok_len = wav.shape[0]
+            else:
+                # Process audio
+                if isinstance(speaker_audio, str):
+                    # Load audio from file
+                    wav = self.audio_processor._load_audio_from_path(speaker_audio)
+                else:
+                    wav = np.array(speaker_audio, dtype=np.float32)
+                
+                # Apply normalization if needed
+                if self.db_normalize and self.audio_normalizer:
+                    wav = self.audio_normalizer(wav)
+                
+                # Calculate token length based on compression ratio
+                vae_tok_len = math.ceil(wav.shape[0] / self.speech_tok_compress_ratio)
             
             # Build tokens and masks
             speaker_tokens = (prefix_tokens + 
@@ -480,9 +503,11 @@ class VibeVoiceProcessor:
         if not speech_inputs:
             return {"padded_speeches": None, "speech_masks": None}
         
-        # Calculate sequence lengths
-        vae_tok_seqlens = [math.ceil(s.shape[0] / self.speech_tok_compress_ratio) for s in speech_inputs]
-        # vae_tok_seqlens = [math.ceil(s.shape[0] / self.speech_tok_compress_ratio) if s.ndim == 1 else s.shape[0] for s in speech_inputs]
+        if len(set(s.ndim for s in speech_inputs)) > 1:
+            raise ValueError("Cannot batch raw audio voice samples together with voice packs.")
+        
+        # Calculate sequence lengths (voice pack latents already have one row per token)
+        vae_tok_seqlens = [math.ceil(s.shape[0] / self.speech_tok_compress_ratio) if s.ndim == 1 else s.shape[0] for s in speech_inputs]
         max_speech_length = max(s.shape[0] for s in speech_inputs)
         
         # Pad speeches
@@ -0,0 +1,69 @@
+import os
+from typing import Any, Dict, Optional, Union
+
+import numpy as np
+import torch
+
+from transformers.utils import logging
+
+logger = logging.get_logger(__name__)
+
+VOICE_PACK_VERSION = 1
+
+
+def is_voice_pack(obj: Any) -> bool:
+    """Whether `obj` is a loaded voice pack (see `save_voice_pack`)."""
+    return isinstance(obj, dict) and "latents" in obj and "voice_pack_version" in obj
+
+
+def save_voice_pack(path: Union[str, os.PathLike], latents: torch.Tensor, **metadata):
+    """
+    Save the acoustic latents of one reference voice as a voice pack.
+
+    A voice pack is a `.pt` file holding a dict with the acoustic tokenizer encoder mean of
+    the voice (`latents`, of shape `(num_frames, vae_dim)`) and free-form metadata such as the
+    source file and the model it was encoded with. `VibeVoiceProcessor` accepts voice packs
+    in place of reference audio; the model then skips the acoustic encoder for them.
+    """
+    if latents.dim() != 2:
+        raise ValueError(f"Voice pack latents must have shape (num_frames, vae_dim), got {tuple(latents.shape)}")
+    pack = dict(metadata)
+    pack["latents"] = latents.detach().cpu()
+    pack["num_frames"] = latents.shape[0]
+    pack["voice_pack_version"] = VOICE_PACK_VERSION
+    torch.save(pack, path)
+
+
+def check_voice_pack(pack: Dict[str, Any], source: Any = "Voice pack") -> Dict[str, Any]:
+    """Return the loaded voice pack `pack`, raising if it was written by a newer version of vibevoice."""
+    if pack["voice_pack_version"] > VOICE_PACK_VERSION:
+        raise ValueError(
+            f"{source} has voice pack version {pack['voice_pack_version']}, "
+            f"this version of vibevoice reads up to version {VOICE_PACK_VERSION}."
+        )
+    return pack
+
+
+def load_voice_pack(path: Union[str, os.PathLike]) -> Optional[Dict[str, Any]]:
+    """Load a voice pack, or return `None` if `path` holds something else (e.g. a raw waveform tensor)."""
+    obj = torch.load(path, map_location="cpu")
+    if not is_voice_pack(obj):
+        return None
+    return check_voice_pack(obj, path)
+
+
+def voice_pack_latents(pack: Dict[str, Any]) -> np.ndarray:
+    """The latents of a loaded voice pack as a float32 array of shape `(num_frames, vae_dim)`."""
+    latents = pack["latents"]
+    if isinstance(latents, torch.Tensor):
+        latents = latents.float().numpy()
+    return np.asarray(latents, dtype=np.float32)
+
+
+__all__ = [
+    "is_voice_pack",
+    "check_voice_pack",
+    "save_voice_pack",
+    "load_voice_pack",
+    "voice_pack_latents",
+]
@@ -15,6 +15,7 @@
 # DISCLAIMER: This file is strongly influenced by https://github.com/LuChengTHU/dpm-solver
 
 import math
+from dataclasses import dataclass, field
 from typing import List, Optional, Tuple, Union
 
 import numpy as np
@@ -119,6 +120,120 @@ def rescale_zero_terminal_snr(betas):
 
     return betas
 
+@dataclass(frozen=True)
+class DPMSolverSchedule:
+    """
+    Timesteps and noise levels of a `DPMSolverMultistepScheduler` for one number of inference steps.
+
+    A schedule is built once by `DPMSolverMultistepScheduler.get_schedule` and never modified, so it can be
+    shared by any number of denoising loops running at the same time.
+
+    Args:
+        timesteps (`torch.LongTensor` of shape `(num_inference_steps,)`):
+            The discrete timesteps fed to the model, from noisiest to cleanest.
+        sigmas (`torch.FloatTensor` of shape `(num_inference_steps + 1,)`):
+            The noise level of every timestep followed by the final one, kept on the CPU.
+    """
+    timesteps: torch.Tensor
+    sigmas: torch.Tensor
+
+    @property
+    def num_inference_steps(self) -> int:
+        return len(self.timesteps)
+
+
+@dataclass
+class DPMSolverState:
+    """
+    The mutable part of a multistep DPM-Solver run: the converted model outputs of the previous steps, the number
+    of lower order steps taken so far and the index of the next step (plus the sample before the last update, for
+    predictor-corrector samplers). Create one per denoising loop with `DPMSolverMultistepScheduler.init_state` and
+    pass it to `step_with_state`.
+    """
+    schedule: DPMSolverSchedule
+    model_outputs: List[Optional[torch.Tensor]] = field(default_factory=list)
+    lower_order_nums: int = 0
+    step_index: int = 0
+    last_sample: Optional[torch.Tensor] = None
+
+
+def _linear_combination(tensors, coeffs):
+    """`sum(c * t for t, c in zip(tensors, coeffs))`, skipping zero coefficients (whose tensor may be None)."""
+    result = None
+    for tensor, coeff in zip(tensors, coeffs):
+        if coeff == 0.0:
+            continue
+        if result is None:
+            result = tensor * coeff
+        else:
+            result.add_(tensor, alpha=coeff)
+    return result
+
+
+@dataclass(frozen=True)
+class DPMSolverCompiledSchedule(DPMSolverSchedule):
+    """
+    A `DPMSolverSchedule` with every per-step coefficient of the solver tabulated, built by
+    `DPMSolverMultistepScheduler.compile_schedule`.
+
+    With a fixed number of steps, the solver order of every step and all the alpha / sigma / lambda terms of the
+    updates are constants. Folded together, step `i` is
+
+        m_i  = convert[i][0] * sample + convert[i][1] * model_output
+        prev = update[i][0] * sample + update[i][1] * m_i + update[i][2] * m_{i-1} + update[i][3] * m_{i-2}
+               + update[i][4] * noise
+
+    where `m` are the converted model outputs (data or noise predictions depending on the algorithm type), so
+    `step` is a handful of tensor ops with Python float coefficients and no per-step scalar math.
+
+    Args:
+        orders (`Tuple[int]`):
+            The solver order used at every step.
+        convert (`Tuple[Tuple[float, float]]`):
+            Coefficients of the sample and the model output in the converted model output.
+        update (`Tuple[Tuple[float, float, float, float, float]]`):
+            Coefficients of the sample, the last three converted model outputs and the noise in the update.
+        slice_model_output (`bool`):
+            Whether the model output carries a learned variance to drop before the update.
+    """
+    orders: Tuple[int, ...] = ()
+    convert: Tuple[Tuple[float, float], ...] = ()
+    update: Tuple[Tuple[float, float, float, float, float], ...] = ()
+    slice_model_output: bool = False
+
+    def step(
+        self,
+        state: DPMSolverState,
+        model_output: torch.Tensor,
+        sample: torch.Tensor,
+        noise: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """Advance `state` by one step with the tabulated coefficients and return the previous sample."""
+        step_index = state.step_index
+        if step_index >= len(self.orders):
+            raise ValueError(f"The solver state already took all {len(self.orders)} steps of its schedule")
+        dtype = model_output.dtype
+        if self.slice_model_output:
+            model_output = model_output[:, :3]
+        sample = sample.to(torch.float32)
+        model_output = model_output.to(torch.float32)
+
+        a, b = self.convert[step_index]
+        converted = model_output * b if a == 0.0 else torch.add(sample * a, model_output, alpha=b)
+        model_outputs = state.model_outputs
+        for i in range(len(model_outputs) - 1):
+            model_outputs[i] = model_outputs[i + 1]
+        model_outputs[-1] = converted
+
+        history = (converted,) + tuple(reversed(model_outputs[:-1]))
+        terms = (sample,) + (history + (None, None))[:3] + (noise,)
+        prev_sample = _linear_combination(terms, self.update[step_index])
+
+        state.lower_order_nums = min(state.lower_order_nums + 1, len(model_outputs))
+        state.step_index += 1
+        return prev_sample.to(dtype)
+
+
 class DPMSolverMultistepScheduler(SchedulerMixin, ConfigMixin):
     """
     `DPMSolverMultistepScheduler` is a fast dedicated high-order solver for diffusion ODEs.
@@ -293,6 +408,7 @@ class DPMSolverMultistepScheduler(SchedulerMixin, ConfigMixin):
         self._step_index = None
         self._begin_index = None
         self.sigmas = self.sigmas.to("cpu")  # to avoid too much CPU/GPU communication
+        self._schedules = {}
 
     @property
     def step_index(self):
@@ -346,6 +462,27 @@ class DPMSolverMultistepScheduler(SchedulerMixin, ConfigMixin):
         if timesteps is not None and self.config.use_lu_lambdas:
             raise ValueError("Cannot use `timesteps` with `config.use_lu_lambdas = True`")
 
+        timesteps, sigmas = self._compute_timesteps_and_sigmas(num_inference_steps, timesteps)
+
+        self.sigmas = torch.from_numpy(sigmas)
+        self.timesteps = torch.from_numpy(timesteps).to(device=device, dtype=torch.int64)
+
+        self.num_inference_steps = len(timesteps)
+
+        self.model_outputs = [
+            None,
+        ] * self.config.solver_order
+        self.lower_order_nums = 0
+
+        # add an index counter for schedulers that allow duplicated timesteps
+        self._step_index = None
+        self._begin_index = None
+        self.sigmas = self.sigmas.to("cpu")  # to avoid too much CPU/GPU communication
+
+    def _compute_timesteps_and_sigmas(
+        self, num_inference_steps: Optional[int], timesteps: Optional[List[int]]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """The timesteps and float32 sigmas (one more than the timesteps) that `set_timesteps` installs."""
         if timesteps is not None:
             timesteps = np.array(timesteps).astype(np.int64)
         else:
@@ -406,21 +543,7 @@ class DPMSolverMultistepScheduler(SchedulerMixin, ConfigMixin):
             )
 
         sigmas = np.concatenate([sigmas, [sigma_last]]).astype(np.float32)
-
-        self.sigmas = torch.from_numpy(sigmas)
-        self.timesteps = torch.from_numpy(timesteps).to(device=device, dtype=torch.int64)
-
-        self.num_inference_steps = len(timesteps)
-
-        self.model_outputs = [
-            None,
-        ] * self.config.solver_order
-        self.lower_order_nums = 0
-
-        # add an index counter for schedulers that allow duplicated timesteps
-        self._step_index = None
-        self._begin_index = None
-        self.sigmas = self.sigmas.to("cpu")  # to avoid too much CPU/GPU communication
+        return timesteps, sigmas
 
     # Copied from diffusers.schedulers.scheduling_ddpm.DDPMScheduler._threshold_sample
     def _threshold_sample(self, sample: torch.Tensor) -> torch.Tensor:
@@ -567,19 +690,25 @@ class DPMSolverMultistepScheduler(SchedulerMixin, ConfigMixin):
                 "Passing `timesteps` is deprecated and has no effect as model output conversion is now handled via an internal counter `self.step_index`",
             )
 
+        return self._convert_model_output(model_output, sample, self.sigmas, self.step_index)
+
+    def _convert_model_output(
+        self, model_output: torch.Tensor, sample: torch.Tensor, sigmas: torch.Tensor, step_index: int
+    ) -> torch.Tensor:
+        """`convert_model_output` at `sigmas[step_index]`, without reading the scheduler's step counter."""
         # DPM-Solver++ needs to solve an integral of the data prediction model.
         if self.config.algorithm_type in ["dpmsolver++", "sde-dpmsolver++"]:
             if self.config.prediction_type == "epsilon":
                 # DPM-Solver and DPM-Solver++ only need the "mean" output.
                 if self.config.variance_type in ["learned", "learned_range"]:
                     model_output = model_output[:, :3]
-                sigma = self.sigmas[self.step_index]
+                sigma = sigmas[step_index]
                 alpha_t, sigma_t = self._sigma_to_alpha_sigma_t(sigma)
                 x0_pred = (sample - sigma_t * model_output) / alpha_t
             elif self.config.prediction_type == "sample":
                 x0_pred = model_output
             elif self.config.prediction_type == "v_prediction":
-                sigma = self.sigmas[self.step_index]
+                sigma = sigmas[step_index]
                 alpha_t, sigma_t = self._sigma_to_alpha_sigma_t(sigma)
                 x0_pred = alpha_t * sample - sigma_t * model_output
             else:
@@ -602,11 +731,11 @@ class DPMSolverMultistepScheduler(SchedulerMixin, ConfigMixin):
                 else:
                     epsilon = model_output
             elif self.config.prediction_type == "sample":
-                sigma = self.sigmas[self.step_index]
+                sigma = sigmas[step_index]
                 alpha_t, sigma_t = self._sigma_to_alpha_sigma_t(sigma)
                 epsilon = (sample - alpha_t * model_output) / sigma_t
             elif self.config.prediction_type == "v_prediction":
-                sigma = self.sigmas[self.step_index]
+                sigma = sigmas[step_index]
                 alpha_t, sigma_t = self._sigma_to_alpha_sigma_t(sigma)
                 epsilon = alpha_t * model_output + sigma_t * sample
             else:
@@ -616,7 +745,7 @@ class DPMSolverMultistepScheduler(SchedulerMixin, ConfigMixin):
                 )
 
             if self.config.thresholding:
-                sigma = self.sigmas[self.step_index]
+                sigma = sigmas[step_index]
                 alpha_t, sigma_t = self._sigma_to_alpha_sigma_t(sigma)
                 x0_pred = (sample - sigma_t * epsilon) / alpha_t
                 x0_pred = self._threshold_sample(x0_pred)
@@ -666,7 +795,17 @@ class DPMSolverMultistepScheduler(SchedulerMixin, ConfigMixin):
                 "Passing `prev_timestep` is deprecated and has no effect as model output conversion is now handled via an internal counter `self.step_index`",
             )
 
-        sigma_t, sigma_s = self.sigmas[self.step_index + 1], self.sigmas[self.step_index]
+        return self._dpm_solver_first_order_update(model_output, sample, noise, self.sigmas, self.step_index)
+
+    def _dpm_solver_first_order_update(
+        self,
+        model_output: torch.Tensor,
+        sample: torch.Tensor,
+        noise: Optional[torch.Tensor],
+        sigmas: torch.Tensor,
+        step_index: int,
+    ) -> torch.Tensor:
+        sigma_t, sigma_s = sigmas[step_index + 1], sigmas[step_index]
         alpha_t, sigma_t = self._sigma_to_alpha_sigma_t(sigma_t)
         alpha_s, sigma_s = self._sigma_to_alpha_sigma_t(sigma_s)
         lambda_t = torch.log(alpha_t) - torch.log(sigma_t)
@@ -735,10 +874,22 @@ class DPMSolverMultistepScheduler(SchedulerMixin, ConfigMixin):
                 "Passing `prev_timestep` is deprecated and has no effect as model output conversion is now handled via an internal counter `self.step_index`",
             )
 
+        return self._multistep_dpm_solver_second_order_update(
+            model_output_list, sample, noise, self.sigmas, self.step_index
+        )
+
+    def _multistep_dpm_solver_second_order_update(
+        self,
+        model_output_list: List[torch.Tensor],
+        sample: torch.Tensor,
+        noise: Optional[torch.Tensor],
+        sigmas: torch.Tensor,
+        step_index: int,
+    ) -> torch.Tensor:
         sigma_t, sigma_s0, sigma_s1 = (
-            self.sigmas[self.step_index + 1],
-            self.sigmas[self.step_index],
-            self.sigmas[self.step_index - 1],
+            sigmas[step_index + 1],
+            sigmas[step_index],
+            sigmas[step_index - 1],
         )
 
         alpha_t, sigma_t = self._sigma_to_alpha_sigma_t(sigma_t)
@@ -858,11 +1009,20 @@ class DPMSolverMultistepScheduler(SchedulerMixin, ConfigMixin):
                 "Passing `prev_timestep` is deprecated and has no effect as model output conversion is now handled via an internal counter `self.step_index`",
             )
 
+        return self._multistep_dpm_solver_third_order_update(model_output_list, sample, self.sigmas, self.step_index)
+
+    def _multistep_dpm_solver_third_order_update(
+        self,
+        model_output_list: List[torch.Tensor],
+        sample: torch.Tensor,
+        sigmas: torch.Tensor,
+        step_index: int,
+    ) -> torch.Tensor:
         sigma_t, sigma_s0, sigma_s1, sigma_s2 = (
-            self.sigmas[self.step_index + 1],
-            self.sigmas[self.step_index],
-            self.sigmas[self.step_index - 1],
-            self.sigmas[self.step_index - 2],
+            sigmas[step_index + 1],
+            sigmas[step_index],
+            sigmas[step_index - 1],
+            sigmas[step_index - 2],
         )
 
         alpha_t, sigma_t = self._sigma_to_alpha_sigma_t(sigma_t)
@@ -1021,6 +1181,280 @@ class DPMSolverMultistepScheduler(SchedulerMixin, ConfigMixin):
 
         return SchedulerOutput(prev_sample=prev_sample)
 
+    def get_schedule(
+        self, num_inference_steps: int, device: Union[str, torch.device] = None, start_index: int = 0
+    ) -> DPMSolverSchedule:
+        """
+        The `DPMSolverSchedule` of `num_inference_steps` steps, equal to what `set_timesteps(num_inference_steps,
+        device)` would install. Schedules are computed once and cached on the scheduler; unlike `set_timesteps`,
+        this does not touch the scheduler's own stepping state.
+
+        With `start_index`, the schedule only has the steps from `start_index` on, for a loop that starts from a
+        sample noised to `timesteps[start_index]` instead of from pure noise (see `noise_to_step`).
+        """
+        key = (num_inference_steps, str(device), start_index)
+        schedule = self._schedules.get(key)
+        if schedule is None:
+            if start_index > 0:
+                full = self.get_schedule(num_inference_steps, device=device)
+                if start_index >= full.num_inference_steps:
+                    raise ValueError(f"`start_index` must be below {full.num_inference_steps}, got {start_index}")
+                schedule = DPMSolverSchedule(timesteps=full.timesteps[start_index:], sigmas=full.sigmas[start_index:])
+            else:
+                timesteps, sigmas = self._compute_timesteps_and_sigmas(num_inference_steps, None)
+                schedule = DPMSolverSchedule(
+                    timesteps=torch.from_numpy(timesteps).to(device=device, dtype=torch.int64),
+                    sigmas=torch.from_numpy(sigmas),
+                )
+            # concurrent callers may both build the same schedule; either copy is fine to keep
+            self._schedules[key] = schedule
+        return schedule
+
+    def compile_schedule(
+        self, num_inference_steps: int, device: Union[str, torch.device] = None, start_index: int = 0
+    ) -> DPMSolverCompiledSchedule:
+        """
+        The `DPMSolverCompiledSchedule` of `num_inference_steps` steps: the schedule of `get_schedule` plus the
+        tabulated solver coefficients of every step. Cached like `get_schedule`. Dynamic thresholding is not a
+        linear update and is not supported. A schedule with a `start_index` begins again with first order steps.
+        """
+        if self.config.thresholding:
+            raise ValueError("`compile_schedule` does not support `thresholding`, use `get_schedule` instead")
+        key = ("compiled", num_inference_steps, str(device), start_index)
+        schedule = self._schedules.get(key)
+        if schedule is None:
+            schedule = self._compile(self.get_schedule(num_inference_steps, device=device, start_index=start_index))
+            self._schedules[key] = schedule
+        return schedule
+
+    def _compile(self, schedule: DPMSolverSchedule) -> DPMSolverCompiledSchedule:
+        orders, convert, update = self._tabulate_coefficients(schedule.sigmas)
+        return DPMSolverCompiledSchedule(
+            timesteps=schedule.timesteps,
+            sigmas=schedule.sigmas,
+            orders=orders,
+            convert=convert,
+            update=update,
+            slice_model_output=self.config.variance_type in ["learned", "learned_range"],
+        )
+
+    def _tabulate_coefficients(self, sigmas: torch.Tensor):
+        """Per-step solver orders and the conversion / update coefficients of `DPMSolverCompiledSchedule`."""
+        config = self.config
+        num_steps = len(sigmas) - 1
+        sigmas = sigmas.double().numpy()
+        with np.errstate(divide="ignore"):
+            alphas = 1.0 / np.sqrt(sigmas**2 + 1.0)
+            sigma_ts = sigmas * alphas
+            lambdas = np.log(alphas) - np.log(sigma_ts)
+        data_prediction = config.algorithm_type in ["dpmsolver++", "sde-dpmsolver++"]
+        sde = config.algorithm_type in ["sde-dpmsolver", "sde-dpmsolver++"]
+
+        orders, convert, update = [], [], []
+        for i in range(num_steps):
+            lower_order_final = (i == num_steps - 1) and (
+                config.euler_at_final
+                or (config.lower_order_final and num_steps < 15)
+                or config.final_sigmas_type == "zero"
+            )
+            lower_order_second = (i == num_steps - 2) and config.lower_order_final and num_steps < 15
+            lower_order_nums = min(i, config.solver_order)
+            if config.solver_order == 1 or lower_order_nums < 1 or lower_order_final:
+                order = 1
+            elif config.solver_order == 2 or lower_order_nums < 2 or lower_order_second:
+                order = 2
+            else:
+                order = 3
+            if order == 3 and sde:
+                raise NotImplementedError(f"Third order steps are not implemented for {config.algorithm_type}")
+            orders.append(order)
+
+            alpha_s0, sigma_s0 = alphas[i], sigma_ts[i]
+            if config.prediction_type == "epsilon":
+                a, b = (1.0 / alpha_s0, -sigma_s0 / alpha_s0) if data_prediction else (0.0, 1.0)
+            elif config.prediction_type == "sample":
+                a, b = (0.0, 1.0) if data_prediction else (1.0 / sigma_s0, -alpha_s0 / sigma_s0)
+            elif config.prediction_type == "v_prediction":
+                a, b = (alpha_s0, -sigma_s0) if data_prediction else (sigma_s0, alpha_s0)
+            else:
+                raise ValueError(
+                    f"prediction_type given as {config.prediction_type} must be one of `epsilon`, `sample`, or"
+                    " `v_prediction` for the DPMSolverMultistepScheduler."
+                )
+            convert.append((float(a), float(b)))
+
+            # x_t = c_x * sample + p0 * D0 + p1 * D1 + p2 * D2 + c_noise * noise, see the update methods;
+            # the third order update always uses the "heun" D1 term, stored in p1_heun
+            alpha_t, sigma_t = alphas[i + 1], sigma_ts[i + 1]
+            h = lambdas[i + 1] - lambdas[i]
+            with np.errstate(over="ignore", invalid="ignore"):
+                if config.algorithm_type == "dpmsolver++":
+                    c_x, c_noise = sigma_t / sigma_s0, 0.0
+                    p0 = -alpha_t * np.expm1(-h)
+                    p1_heun = alpha_t * (np.expm1(-h) / h + 1.0)
+                    p1 = 0.5 * p0 if config.solver_type == "midpoint" else p1_heun
+                    p2 = -alpha_t * ((np.expm1(-h) + h) / h**2 - 0.5)
+                elif config.algorithm_type == "dpmsolver":
+                    c_x, c_noise = alpha_t / alpha_s0, 0.0
+                    p0 = -sigma_t * np.expm1(h)
+                    p1_heun = -sigma_t * (np.expm1(h) / h - 1.0)
+                    p1 = 0.5 * p0 if config.solver_type == "midpoint" else p1_heun
+                    p2 = -sigma_t * ((np.expm1(h) - h) / h**2 - 0.5)
+                elif config.algorithm_type == "sde-dpmsolver++":
+                    c_x = sigma_t / sigma_s0 * np.exp(-h)
+                    c_noise = sigma_t * np.sqrt(-np.expm1(-2.0 * h))
+                    p0 = -alpha_t * np.expm1(-2.0 * h)
+                    p1 = 0.5 * p0 if config.solver_type == "midpoint" else alpha_t * (np.expm1(-2.0 * h) / (2.0 * h) + 1.0)
+                    p1_heun = p2 = 0.0
+                else:
+                    c_x = alpha_t / alpha_s0
+                    c_noise = sigma_t * np.sqrt(np.expm1(2.0 * h))
+                    p0 = -2.0 * sigma_t * np.expm1(h)
+                    p1 = 0.5 * p0 if config.solver_type == "midpoint" else -2.0 * sigma_t * (np.expm1(h) / h - 1.0)
+                    p1_heun = p2 = 0.0
+
+            # expand D0, D1, D2 into the converted model outputs m0, m1, m2
+            if order == 1:
+                k0, k1, k2 = p0, 0.0, 0.0
+            elif order == 2:
+                r0 = (lambdas[i] - lambdas[i - 1]) / h
+                k0, k1, k2 = p0 + p1 / r0, -p1 / r0, 0.0
+            else:
+                r0 = (lambdas[i] - lambdas[i - 1]) / h
+                r1 = (lambdas[i - 1] - lambdas[i - 2]) / h
+                c10 = p1_heun * (1.0 + r0 / (r0 + r1)) + p2 / (r0 + r1)
+                c11 = -p1_heun * r0 / (r0 + r1) - p2 / (r0 + r1)
+                k0, k1, k2 = p0 + c10 / r0, -c10 / r0 + c11 / r1, -c11 / r1
+            if not sde:
+                c_noise = 0.0
+            update.append(tuple(float(c) for c in (c_x, k0, k1, k2, c_noise)))
+
+        return tuple(orders), tuple(convert), tuple(update)
+
+    def init_state(self, schedule: DPMSolverSchedule) -> DPMSolverState:
+        """A fresh `DPMSolverState` for one denoising loop over `schedule`."""
+        return DPMSolverState(schedule=schedule, model_outputs=[None] * self.config.solver_order)
+
+    def noise_to_step(
+        self, schedule: DPMSolverSchedule, original_samples: torch.Tensor, noise: torch.Tensor
+    ) -> torch.Tensor:
+        """`original_samples` noised to the first step of `schedule`, the starting sample of a loop over it."""
+        sigma = float(schedule.sigmas[0])
+        alpha_t = 1.0 / math.sqrt(sigma**2 + 1.0)
+        return alpha_t * original_samples + (sigma * alpha_t) * noise
+
+    def predict_original_sample(
+        self, schedule: DPMSolverSchedule, step_index: int, model_output: torch.Tensor, sample: torch.Tensor
+    ) -> torch.Tensor:
+        """
+        The data (x0) prediction of `model_output` at `sample` and step `step_index` of `schedule`, whatever the
+        algorithm type. Only reads the schedule, so it can be called next to `step_with_state`.
+        """
+        if self.config.variance_type in ["learned", "learned_range"]:
+            model_output = model_output[:, :3]
+        sigma = float(schedule.sigmas[step_index])
+        alpha_t = 1.0 / math.sqrt(sigma**2 + 1.0)
+        sigma_t = sigma * alpha_t
+        if self.config.prediction_type == "epsilon":
+            return (sample - sigma_t * model_output) / alpha_t
+        elif self.config.prediction_type == "sample":
+            return model_output
+        elif self.config.prediction_type == "v_prediction":
+            return alpha_t * sample - sigma_t * model_output
+        raise ValueError(
+            f"prediction_type given as {self.config.prediction_type} must be one of `epsilon`, `sample`, or"
+            " `v_prediction` for the DPMSolverMultistepScheduler."
+        )
+
+    def step_with_state(
+        self,
+        state: DPMSolverState,
+        model_output: torch.Tensor,
+        sample: torch.Tensor,
+        generator=None,
+        variance_noise: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        """
+        Functional counterpart of `step`: advances `state` by one step of its schedule and returns the previous
+        sample. Only `state` is updated, the scheduler itself is only read, so several loops (threads or batch
+        slots) can step through the same scheduler concurrently, each with its own state.
+
+        Args:
+            state (`DPMSolverState`):
+                The solver state of this denoising loop, see `init_state`.
+            model_output (`torch.Tensor`):
+                The direct output from learned diffusion model at `state.schedule.timesteps[state.step_index]`.
+            sample (`torch.Tensor`):
+                A current instance of a sample created by the diffusion process.
+            generator (`torch.Generator`, *optional*):
+                A random number generator, used by the SDE variants.
+            variance_noise (`torch.Tensor`, *optional*):
+                Noise for the SDE variants instead of sampling it from `generator`.
+
+        Returns:
+            `torch.Tensor`: The sample at the next (less noisy) timestep.
+        """
+        schedule = state.schedule
+        step_index = state.step_index
+        num_steps = schedule.num_inference_steps
+        if isinstance(schedule, DPMSolverCompiledSchedule):
+            noise = None
+            if self.config.algorithm_type in ["sde-dpmsolver", "sde-dpmsolver++"]:
+                if variance_noise is None:
+                    noise = randn_tensor(
+                        model_output.shape, generator=generator, device=model_output.device, dtype=torch.float32
+                    )
+                else:
+                    noise = variance_noise.to(device=model_output.device, dtype=torch.float32)
+            return schedule.step(state, model_output, sample, noise=noise)
+        if step_index >= num_steps:
+            raise ValueError(f"The solver state already took all {num_steps} steps of its schedule")
+
+        # Improve numerical stability for small number of steps
+        lower_order_final = (step_index == num_steps - 1) and (
+            self.config.euler_at_final
+            or (self.config.lower_order_final and num_steps < 15)
+            or self.config.final_sigmas_type == "zero"
+        )
+        lower_order_second = (step_index == num_steps - 2) and self.config.lower_order_final and num_steps < 15
+
+        model_output = self._convert_model_output(model_output, sample, schedule.sigmas, step_index)
+        model_outputs = state.model_outputs
+        for i in range(self.config.solver_order - 1):
+            model_outputs[i] = model_outputs[i + 1]
+        model_outputs[-1] = model_output
+
+        # Upcast to avoid precision issues when computing prev_sample
+        sample = sample.to(torch.float32)
+        if self.config.algorithm_type in ["sde-dpmsolver", "sde-dpmsolver++"] and variance_noise is None:
+            noise = randn_tensor(
+                model_output.shape, generator=generator, device=model_output.device, dtype=torch.float32
+            )
+        elif self.config.algorithm_type in ["sde-dpmsolver", "sde-dpmsolver++"]:
+            noise = variance_noise.to(device=model_output.device, dtype=torch.float32)
+        else:
+            noise = None
+
+        if self.config.solver_order == 1 or state.lower_order_nums < 1 or lower_order_final:
+            prev_sample = self._dpm_solver_first_order_update(
+                model_output, sample, noise, schedule.sigmas, step_index
+            )
+        elif self.config.solver_order == 2 or state.lower_order_nums < 2 or lower_order_second:
+            prev_sample = self._multistep_dpm_solver_second_order_update(
+                model_outputs, sample, noise, schedule.sigmas, step_index
+            )
+        else:
+            prev_sample = self._multistep_dpm_solver_third_order_update(
+                model_outputs, sample, schedule.sigmas, step_index
+            )
+
+        if state.lower_order_nums < self.config.solver_order:
+            state.lower_order_nums += 1
+        state.step_index += 1
+
+        # Cast sample back to expected dtype
+        return prev_sample.to(model_output.dtype)
+
     def add_noise(
         self,
         original_samples: torch.Tensor,
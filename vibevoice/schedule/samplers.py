@@ -0,0 +1,238 @@
+"""
+Few-step samplers for the diffusion head and a registry to select them by name.
+
+Every sampler is a `DPMSolverMultistepScheduler` (or a subclass of it) built from the config of the
+model's `noise_scheduler`, so it shares its beta schedule (the cosine `betas_for_alpha_bar` schedule
+for the released checkpoints), timestep spacing and prediction type, and it exposes the same
+functional API (`compile_schedule`, `init_state`, `step_with_state`) used by `sample_speech_tokens`.
+
+    >>> model.generate(**inputs, sampler="unipc")  # or per request in the continuous batching engine
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+import numpy as np
+import torch
+
+from .dpm_solver import (
+    DPMSolverCompiledSchedule,
+    DPMSolverMultistepScheduler,
+    DPMSolverSchedule,
+    DPMSolverState,
+    _linear_combination,
+)
+
+
+class _CompiledOnlyMixin:
+    """Samplers whose update only exists in tabulated form."""
+
+    def step(self, *args, **kwargs):
+        raise NotImplementedError(
+            f"{self.__class__.__name__} has no stateful `step`, use `compile_schedule` and `step_with_state`"
+        )
+
+    def step_with_state(self, state: DPMSolverState, model_output, sample, generator=None, variance_noise=None):
+        if not isinstance(state.schedule, DPMSolverCompiledSchedule):
+            raise ValueError(f"{self.__class__.__name__} steps through schedules built by `compile_schedule`")
+        return super().step_with_state(state, model_output, sample, generator=generator, variance_noise=variance_noise)
+
+
+class EulerVSampler(_CompiledOnlyMixin, DPMSolverMultistepScheduler):
+    """
+    Plain Euler integration of the probability flow ODE in the angular parametrization of v-prediction.
+
+    With `alpha_t = cos(phi)` and `sigma_t = sin(phi)`, the sample `x = cos(phi) * x0 + sin(phi) * eps` moves with
+    velocity `v = dx/dphi = cos(phi) * eps - sin(phi) * x0`, which is what a v-prediction model outputs. Every
+    step is `x <- x + (phi_next - phi) * v`; epsilon and sample predictions are converted to `v` first.
+    """
+
+    def _tabulate_coefficients(self, sigmas: torch.Tensor):
+        sigmas = sigmas.double().numpy()
+        phis = np.arctan(sigmas)
+        alphas, sigma_ts = np.cos(phis), np.sin(phis)
+        convert, update = [], []
+        for i in range(len(sigmas) - 1):
+            alpha_t, sigma_t = alphas[i], sigma_ts[i]
+            if self.config.prediction_type == "v_prediction":
+                a, b = 0.0, 1.0
+            elif self.config.prediction_type == "epsilon":
+                a, b = -sigma_t / alpha_t, 1.0 / alpha_t
+            elif self.config.prediction_type == "sample":
+                a, b = alpha_t / sigma_t, -1.0 / sigma_t
+            else:
+                raise ValueError(f"prediction_type {self.config.prediction_type} is not supported by {self.__class__}")
+            convert.append((float(a), float(b)))
+            update.append((1.0, float(phis[i + 1] - phis[i]), 0.0, 0.0, 0.0))
+        return (1,) * len(convert), tuple(convert), tuple(update)
+
+
+@dataclass(frozen=True)
+class UniPCCompiledSchedule(DPMSolverCompiledSchedule):
+    """
+    A `DPMSolverCompiledSchedule` for `UniPCSampler`. Before the predictor update of step `i > 0`, the corrector
+    replaces the sample the model was evaluated at by
+
+        correct[i][0] * last_sample + correct[i][1] * m_i + correct[i][2] * m_{i-1} + ...
+
+    where `last_sample` is the (corrected) sample of the previous step and `m` the converted model outputs.
+    """
+    correct: Tuple[Tuple[float, ...], ...] = ()
+
+    def step(
+        self,
+        state: DPMSolverState,
+        model_output: torch.Tensor,
+        sample: torch.Tensor,
+        noise: Optional[torch.Tensor] = None,
+    ) -> torch.Tensor:
+        step_index = state.step_index
+        if step_index >= len(self.orders):
+            raise ValueError(f"The solver state already took all {len(self.orders)} steps of its schedule")
+        dtype = model_output.dtype
+        if self.slice_model_output:
+            model_output = model_output[:, :3]
+        sample = sample.to(torch.float32)
+        model_output = model_output.to(torch.float32)
+
+        a, b = self.convert[step_index]
+        converted = model_output * b if a == 0.0 else torch.add(sample * a, model_output, alpha=b)
+        model_outputs = state.model_outputs
+        if self.correct[step_index]:
+            terms = (state.last_sample, converted) + tuple(reversed(model_outputs))
+            sample = _linear_combination(terms, self.correct[step_index])
+        for i in range(len(model_outputs) - 1):
+            model_outputs[i] = model_outputs[i + 1]
+        model_outputs[-1] = converted
+        state.last_sample = sample
+
+        history = (converted,) + tuple(reversed(model_outputs[:-1]))
+        terms = (sample,) + (history + (None, None))[:3]
+        prev_sample = _linear_combination(terms, self.update[step_index])
+
+        state.lower_order_nums = min(state.lower_order_nums + 1, len(model_outputs))
+        state.step_index += 1
+        return prev_sample.to(dtype)
+
+
+class UniPCSampler(_CompiledOnlyMixin, DPMSolverMultistepScheduler):
+    """
+    UniPC (https://arxiv.org/abs/2302.04867) with data prediction and the `bh2` variant of B(h): a multistep
+    predictor of `solver_order` plus a corrector that reuses the model output of the next step, so it costs no
+    extra model evaluation. Follows `diffusers.UniPCMultistepScheduler`, with the coefficients tabulated.
+    """
+
+    def _compile(self, schedule: DPMSolverSchedule) -> UniPCCompiledSchedule:
+        orders, convert, update, correct = self._tabulate_unipc_coefficients(schedule.sigmas)
+        return UniPCCompiledSchedule(
+            timesteps=schedule.timesteps,
+            sigmas=schedule.sigmas,
+            orders=orders,
+            convert=convert,
+            update=update,
+            slice_model_output=self.config.variance_type in ["learned", "learned_range"],
+            correct=correct,
+        )
+
+    @staticmethod
+    def _rhos(rks, hh, order, predictor):
+        """The UniP / UniC weights of the divided differences, see `multistep_uni_{p,c}_bh_update`."""
+        B_h = np.expm1(hh)
+        h_phi_k = np.expm1(hh) / hh - 1.0
+        factorial_i = 1
+        R, b = [], []
+        for i in range(1, order + 1):
+            R.append(np.power(rks, i - 1))
+            b.append(h_phi_k * factorial_i / B_h)
+            factorial_i *= i + 1
+            h_phi_k = h_phi_k / hh - 1.0 / factorial_i
+        R, b = np.stack(R), np.array(b)
+        if predictor:
+            return np.array([0.5]) if order == 2 else np.linalg.solve(R[:-1, :-1], b[:-1])
+        return np.array([0.5]) if order == 1 else np.linalg.solve(R, b)
+
+    def _tabulate_unipc_coefficients(self, sigmas: torch.Tensor):
+        config = self.config
+        num_steps = len(sigmas) - 1
+        # the conversion to data predictions is the one of DPM-Solver++
+        _, convert, _ = super()._tabulate_coefficients(sigmas)
+        sigmas = sigmas.double().numpy()
+        with np.errstate(divide="ignore"):
+            alphas = 1.0 / np.sqrt(sigmas**2 + 1.0)
+            sigma_ts = sigmas * alphas
+            lambdas = np.log(alphas) - np.log(sigma_ts)
+
+        orders, update, correct = [], [], []
+        for i in range(num_steps):
+            order = min(config.solver_order, num_steps - i) if config.lower_order_final else config.solver_order
+            order = min(order, min(i, config.solver_order) + 1)
+            orders.append(order)
+
+            with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+                # UniC: correct x_i from x_{i-1} with the outputs m_{i-1}, m_{i-2}, ... and the new m_i
+                if i == 0:
+                    correct.append(())
+                else:
+                    p = orders[i - 1]
+                    h = lambdas[i] - lambdas[i - 1]
+                    rks = np.array([(lambdas[i - 1 - k] - lambdas[i - 1]) / h for k in range(1, p)] + [1.0])
+                    rhos = self._rhos(rks, -h, p, predictor=False)
+                    scale = alphas[i] * np.expm1(-h)
+                    coeffs = [sigma_ts[i] / sigma_ts[i - 1], -scale * rhos[-1], -alphas[i] * np.expm1(-h) + scale * rhos[-1]]
+                    for k in range(1, p):
+                        coeffs[2] += scale * rhos[k - 1] / rks[k - 1]
+                        coeffs.append(-scale * rhos[k - 1] / rks[k - 1])
+                    correct.append(tuple(float(c) for c in coeffs))
+
+                # UniP: predict x_{i+1} from x_i with the outputs m_i, m_{i-1}, ...
+                h = lambdas[i + 1] - lambdas[i]
+                scale = alphas[i + 1] * np.expm1(-h)
+                coeffs = [sigma_ts[i + 1] / sigma_ts[i], -alphas[i + 1] * np.expm1(-h), 0.0, 0.0]
+                if order > 1:
+                    rks = np.array([(lambdas[i - k] - lambdas[i]) / h for k in range(1, order)] + [1.0])
+                    rhos = self._rhos(rks, -h, order, predictor=True)
+                    for k in range(1, order):
+                        coeffs[1] += scale * rhos[k - 1] / rks[k - 1]
+                        coeffs[1 + k] = -scale * rhos[k - 1] / rks[k - 1]
+                update.append(tuple(float(c) for c in coeffs))
+
+        return tuple(orders), convert, tuple(update), tuple(correct)
+
+
+# name -> (scheduler class, config overrides on top of the model's noise scheduler config)
+SAMPLERS: Dict[str, Tuple[Type[DPMSolverMultistepScheduler], Dict[str, Any]]] = {
+    "dpmsolver++2m": (DPMSolverMultistepScheduler, {"algorithm_type": "dpmsolver++", "solver_order": 2}),
+    "dpmsolver++3m": (DPMSolverMultistepScheduler, {"algorithm_type": "dpmsolver++", "solver_order": 3}),
+    # first order DPM-Solver++ is DDIM (eta = 0)
+    "ddim": (DPMSolverMultistepScheduler, {"algorithm_type": "dpmsolver++", "solver_order": 1}),
+    "unipc": (UniPCSampler, {"algorithm_type": "dpmsolver++", "solver_order": 2}),
+    "euler": (EulerVSampler, {"algorithm_type": "dpmsolver++", "solver_order": 1}),
+}
+
+
+def register_sampler(name: str, scheduler_class: Type[DPMSolverMultistepScheduler], **config_overrides):
+    """Make `scheduler_class`, built with `config_overrides`, selectable as `sampler=name`."""
+    SAMPLERS[name] = (scheduler_class, config_overrides)
+
+
+def available_samplers() -> List[str]:
+    return sorted(SAMPLERS)
+
+
+def create_sampler(name: str, noise_scheduler: DPMSolverMultistepScheduler) -> DPMSolverMultistepScheduler:
+    """A new sampler `name` sharing the beta schedule, spacing and prediction type of `noise_scheduler`."""
+    if name not in SAMPLERS:
+        raise ValueError(f"Unknown sampler {name!r}, choose one of {available_samplers()}")
+    scheduler_class, config_overrides = SAMPLERS[name]
+    return scheduler_class.from_config(noise_scheduler.config, **config_overrides)
+
+
+__all__ = [
+    "EulerVSampler",
+    "UniPCSampler",
+    "UniPCCompiledSchedule",
+    "SAMPLERS",
+    "register_sampler",
+    "available_samplers",
+    "create_sampler",
+]
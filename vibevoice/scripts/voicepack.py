@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+import argparse
+import json
+import math
+import os
+from typing import List
+
+import torch
+from safetensors import safe_open
+
+from vibevoice.modular.configuration_vibevoice import VibeVoiceConfig
+from vibevoice.modular.modular_vibevoice_tokenizer import VibeVoiceAcousticTokenizerModel
+from vibevoice.processor.vibevoice_processor import VibeVoiceProcessor
+from vibevoice.processor.voice_pack import VOICE_PACK_VERSION, save_voice_pack
+from transformers.utils import cached_file, logging
+
+logger = logging.get_logger(__name__)
+
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.m4a', '.ogg')
+MANIFEST_NAME = "voicepack.json"
+ACOUSTIC_TOKENIZER_PREFIX = "model.acoustic_tokenizer."
+
+
+def find_voices(voices_dir: str) -> List[str]:
+    """Audio files directly inside `voices_dir`, sorted by name."""
+    return sorted(
+        os.path.join(voices_dir, f) for f in os.listdir(voices_dir)
+        if f.lower().endswith(AUDIO_EXTENSIONS) and os.path.isfile(os.path.join(voices_dir, f))
+    )
+
+
+def load_acoustic_tokenizer(model_path: str, device: str = "cpu") -> VibeVoiceAcousticTokenizerModel:
+    """
+    Load only the acoustic tokenizer of a VibeVoice checkpoint, in the dtype the model runs it in.
+
+    Only the safetensors shards holding acoustic tokenizer weights are read, and only those
+    weights are materialized, so the language model is never loaded.
+    """
+    config = VibeVoiceConfig.from_pretrained(model_path)
+    index_file = cached_file(model_path, "model.safetensors.index.json", _raise_exceptions_for_missing_entries=False)
+    if index_file is not None:
+        with open(index_file) as f:
+            weight_map = json.load(f)["weight_map"]
+        shards = sorted({shard for key, shard in weight_map.items() if key.startswith(ACOUSTIC_TOKENIZER_PREFIX)})
+    else:
+        shards = ["model.safetensors"]
+
+    state_dict = {}
+    for shard in shards:
+        with safe_open(cached_file(model_path, shard), framework="pt") as f:
+            for key in f.keys():
+                if key.startswith(ACOUSTIC_TOKENIZER_PREFIX):
+                    state_dict[key[len(ACOUSTIC_TOKENIZER_PREFIX):]] = f.get_tensor(key)
+
+    dtype = config.torch_dtype or torch.float32
+    if isinstance(dtype, str):
+        dtype = getattr(torch, dtype)
+    acoustic_tokenizer = VibeVoiceAcousticTokenizerModel(config.acoustic_tokenizer_config)
+    acoustic_tokenizer.load_state_dict(state_dict)
+    return acoustic_tokenizer.to(device=device, dtype=dtype).eval()
+
+
+@torch.no_grad()
+def build_voice_packs(
+    model_path: str,
+    voices_dir: str,
+    output_dir: str,
+    device: str = "cpu",
+    dtype: str = "float32",
+    batch_size: int = 4,
+):
+    """
+    Encode every reference voice of `voices_dir` with the acoustic tokenizer and write one
+    voice pack per voice to `output_dir`, plus a `voicepack.json` manifest.
+
+    The voices go through the same loading and dB normalization as in `VibeVoiceProcessor`,
+    so a pack yields the same voice prompt as its source audio.
+    """
+    processor = VibeVoiceProcessor.from_pretrained(model_path)
+    acoustic_tokenizer = load_acoustic_tokenizer(model_path, device=device)
+    model_dtype = next(acoustic_tokenizer.parameters()).dtype
+    storage_dtype = getattr(torch, dtype)
+    compress_ratio = processor.speech_tok_compress_ratio
+
+    voice_files = find_voices(voices_dir)
+    if not voice_files:
+        raise ValueError(f"No audio files found in {voices_dir}")
+    os.makedirs(output_dir, exist_ok=True)
+
+    manifest = {
+        "voice_pack_version": VOICE_PACK_VERSION,
+        "model": model_path,
+        "speech_tok_compress_ratio": compress_ratio,
+        "db_normalize": processor.db_normalize,
+        "voices": {},
+    }
+    for start in range(0, len(voice_files), batch_size):
+        paths = voice_files[start:start + batch_size]
+        wavs = []
+        for path in paths:
+            wav = processor.audio_processor._load_audio_from_path(path)
+            if processor.db_normalize and processor.audio_normalizer:
+                wav = processor.audio_normalizer(wav)
+            wavs.append(torch.from_numpy(wav).float())
+
+        # the acoustic encoder is causal, so zero padding does not change the valid frames
+        padded = torch.nn.utils.rnn.pad_sequence(wavs, batch_first=True)
+        means = acoustic_tokenizer.encode(padded.unsqueeze(1).to(device, model_dtype)).mean
+
+        for path, wav, mean in zip(paths, wavs, means):
+            name = os.path.splitext(os.path.basename(path))[0]
+            num_frames = math.ceil(wav.shape[0] / compress_ratio)
+            metadata = {
+                "source": os.path.basename(path),
+                "num_samples": wav.shape[0],
+                "sampling_rate": processor.audio_processor.sampling_rate,
+            }
+            save_voice_pack(
+                os.path.join(output_dir, f"{name}.pt"),
+                mean[:num_frames].to(storage_dtype),
+                model=model_path,
+                speech_tok_compress_ratio=compress_ratio,
+                db_normalize=processor.db_normalize,
+                **metadata,
+            )
+            manifest["voices"][name] = {"file": f"{name}.pt", "num_frames": num_frames, **metadata}
+            logger.info(f"Encoded {path}: {num_frames} latent frames")
+
+    with open(os.path.join(output_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    logger.info(f"Wrote {len(manifest['voices'])} voice packs to {output_dir}")
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pre-encode reference voices into voice packs that VibeVoiceProcessor accepts in place of audio."
+    )
+    parser.add_argument(
+        "--model_path",
+        type=str,
+        required=True,
+        help="Path or hub id of the VibeVoice model whose acoustic tokenizer encodes the voices",
+    )
+    parser.add_argument(
+        "--voices_dir",
+        type=str,
+        required=True,
+        help="Directory of reference audio files (e.g. demo/voices)",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=True,
+        help="Directory to write the voice packs and the voicepack.json manifest to",
+    )
+    parser.add_argument(
+        "--device",
+        type=str,
+        default="cuda" if torch.cuda.is_available() else "cpu",
+        help="Device to run the acoustic encoder on",
+    )
+    parser.add_argument(
+        "--dtype",
+        type=str,
+        default="float32",
+        choices=["float32", "float16", "bfloat16"],
+        help="Storage dtype of the latents",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=4,
+        help="Number of voices encoded together",
+    )
+    args = parser.parse_args()
+
+    logging.set_verbosity_info()
+    build_voice_packs(
+        args.model_path,
+        args.voices_dir,
+        args.output_dir,
+        device=args.device,
+        dtype=args.dtype,
+        batch_size=args.batch_size,
+    )
+
+
+if __name__ == "__main__":
+    main()